@@ -30,5 +30,7 @@ urlpatterns += [
     url(r'^v1/dataset/attributes/', GetLoomPlots.as_view(),name="dataset_attributes" ),
     url(r'^v1/dataset/statistics/', GetLoomStatistics.as_view(),name="dataset_statistics" ),
     url(r'^v1/dataset/genes/', GetLoomGenes.as_view(),name="dataset_genes" ),
+    url(r'^v1/dataset/dashboard/', GetLoomDashboard.as_view(),name="dataset_dashboard" ),
     url(r'^v1/public/studies/', GetPublicStudies.as_view(),name="public_studies" ),
+    url(r'^v1/search/', SearchCatalogue.as_view(),name="search" ),
 ]
\ No newline at end of file
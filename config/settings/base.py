@@ -62,6 +62,7 @@ DJANGO_APPS = [
     "django.contrib.staticfiles",
     # "django.contrib.humanize", # Handy template tags
     "django.contrib.admin",
+    "django.contrib.postgres",
     "django.forms",
 ]
 THIRD_PARTY_APPS = [
@@ -130,6 +131,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
+    "scilicium_django_react.utils.tracing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -281,8 +283,16 @@ CELERY_TASK_TIME_LIMIT = 5 * 60
 # http://docs.celeryproject.org/en/latest/userguide/configuration.html#task-soft-time-limit
 # TODO: set to whatever value is adequate in your circumstances
 CELERY_TASK_SOFT_TIME_LIMIT = 60
+# Time limit (seconds) of the loom ingest task, which precomputes indexes of large files
+LOOM_INGEST_TIME_LIMIT = env.int("LOOM_INGEST_TIME_LIMIT", default=2 * 3600)
 # http://docs.celeryproject.org/en/latest/userguide/configuration.html#beat-scheduler
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "loom-residency": {
+        "task": "scilicium_django_react.datasets.tasks.update_loom_residency",
+        "schedule": env.int("LOOM_RESIDENCY_INTERVAL", default=300),
+    },
+}
 # django-allauth
 # ------------------------------------------------------------------------------
 ACCOUNT_ALLOW_REGISTRATION = env.bool("DJANGO_ACCOUNT_ALLOW_REGISTRATION", True)
@@ -353,4 +363,41 @@ CORS_URLS_REGEX = r"^/api/.*$"
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000"
-]
\ No newline at end of file
+]
+
+# Loom files
+# ------------------------------------------------------------------------------
+# Maximum number of loom files kept open by each worker process
+LOOM_MAX_OPEN_CONNECTIONS = env.int("LOOM_MAX_OPEN_CONNECTIONS", default=16)
+# Memory budget (bytes) of the decoded loom attributes cache of each worker process
+LOOM_ATTRIBUTE_CACHE_BYTES = env.int("LOOM_ATTRIBUTE_CACHE_BYTES", default=256 * 1024 * 1024)
+# Folder holding structures precomputed from loom files (indexes, summaries...),
+# kept out of MEDIA_ROOT so they are never served publicly
+LOOM_SIDECAR_ROOT = env("LOOM_SIDECAR_ROOT", default=str(ROOT_DIR / "loom_sidecars"))
+# Build sparse by-gene and by-cell copies of loom matrices at upload (uses roughly
+# twice the matrix non-zero values in disk space) for fast expression reads
+LOOM_EXPRESSION_SIDECAR = env.bool("LOOM_EXPRESSION_SIDECAR", default=False)
+# Maximum number of cells sent per scatter plot trace group (0 for no limit)
+LOOM_SCATTER_MAX_POINTS = env.int("LOOM_SCATTER_MAX_POINTS", default=0)
+# Validate Plotly figures against the schema before sending them (debug and tests)
+PLOTLY_VALIDATE = env.bool("PLOTLY_VALIDATE", default=False)
+# Chart results cache: cache alias, lifetime, largest compressed response cached and
+# memory budget of the in-process tier
+CHART_CACHE_ALIAS = "default"
+CHART_CACHE_TIMEOUT = env.int("CHART_CACHE_TIMEOUT", default=24 * 3600)
+CHART_CACHE_MAX_ITEM_BYTES = env.int("CHART_CACHE_MAX_ITEM_BYTES", default=8 * 1024 * 1024)
+CHART_CACHE_LOCAL_BYTES = env.int("CHART_CACHE_LOCAL_BYTES", default=64 * 1024 * 1024)
+# Threads of each worker process running plot jobs, and at most how many of them work on the same loom
+PLOT_EXECUTOR_WORKERS = env.int("PLOT_EXECUTOR_WORKERS", default=8)
+PLOT_DATASET_CONCURRENCY = env.int("PLOT_DATASET_CONCURRENCY", default=2)
+# Seconds a plot request waits for a slot on a busy loom (then 503), and for its result (then 504)
+PLOT_QUEUE_TIMEOUT = env.int("PLOT_QUEUE_TIMEOUT", default=10)
+PLOT_TIMEOUT = env.int("PLOT_TIMEOUT", default=120)
+# Per-stage timings of requests (filter, read, aggregate, figure, serialize...): sent in a
+# Server-Timing header, and logged as JSON for requests slower than the threshold
+SERVER_TIMING = env.bool("SERVER_TIMING", default=True)
+TRACING_LOG_THRESHOLD_MS = env.int("TRACING_LOG_THRESHOLD_MS", default=1000)
+# Page cache budget of the most requested looms' memory-mapped sidecars (attributes, embeddings,
+# indexes, expression), shared by every worker; request scores decay by this factor at each run
+LOOM_RESIDENT_BYTES = env.int("LOOM_RESIDENT_BYTES", default=2 * 1024 * 1024 * 1024)
+LOOM_RESIDENCY_DECAY = env.float("LOOM_RESIDENCY_DECAY", default=0.5)
@@ -216,3 +216,6 @@ sentry_sdk.init(
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Server-Timing headers tell anyone how long each stage of a request takes, only
+# send them when asked to (slow requests are still logged)
+SERVER_TIMING = env.bool("SERVER_TIMING", default=False)
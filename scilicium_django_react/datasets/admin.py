@@ -17,7 +17,11 @@ class datasetAdmin(admin.ModelAdmin, DynamicArrayMixin):
         ),
     ]
 
+class loomAdmin(admin.ModelAdmin, DynamicArrayMixin):
+    list_display = ['name','loomId','ingest_status','ingest_step','ingest_progress']
+    readonly_fields = ['ingest_status','ingest_step','ingest_progress','ingest_error','ingest_version','ingest_updated_at']
+
 admin.site.register(Dataset,datasetAdmin)
-admin.site.register(Loom)
+admin.site.register(Loom,loomAdmin)
 admin.site.register(sopMeta)
 admin.site.register(biomaterialMeta,bioMaterialAdmin)
\ No newline at end of file
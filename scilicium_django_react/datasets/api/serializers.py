@@ -1,8 +1,13 @@
+import json
+import hashlib
+
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from scilicium_django_react.datasets.models import Dataset, Loom, sopMeta, biomaterialMeta
 from scilicium_django_react.ontologies.api.serializers import *
 from scilicium_django_react.utils.loom_reader import *
+from scilicium_django_react.utils.loom_catalog import get_catalogs, ROW_CATALOGS
+from scilicium_django_react.studies.api.catalogue import FieldsMixin
 from scilicium_django_react.studies.models import *
 
 class biomaterialMetaSerializer(serializers.ModelSerializer):
@@ -34,7 +39,7 @@ class DatasetUnrelatedSerializer(serializers.ModelSerializer):
         model = Loom
         fields = "__all__"
 
-class PublicDatasetSerializer(serializers.ModelSerializer):
+class PublicDatasetSerializer(FieldsMixin, serializers.ModelSerializer):
     loom = LoomSerializer(many=False, read_only=True)
     technology = serializers.SerializerMethodField('getTechnologies')
     type = serializers.SerializerMethodField('getType')
@@ -42,11 +47,25 @@ class PublicDatasetSerializer(serializers.ModelSerializer):
     devStage = serializers.SerializerMethodField('getDevStage')
     tissue = serializers.SerializerMethodField('getTissues')
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('loom','sop','bioMeta').prefetch_related(
+            'contributor',
+            'sop__technology',
+            'sop__omics',
+            'bioMeta__tissue',
+            'bioMeta__developmentStage',
+        )
+
     def getTechnologies(self, dataset):
-        return dataset.sop.technology.ontologyLabel
+        if dataset.sop is None:
+            return []
+        return list(dict.fromkeys(t.ontologyLabel for t in dataset.sop.technology.all())) # many to many, not a single term
     
     def getType(self, dataset):
-        return dataset.sop.omics.ontologyLabel
+        if dataset.sop is None:
+            return []
+        return list(dict.fromkeys(t.ontologyLabel for t in dataset.sop.omics.all()))
 
     def getGender(self, dataset):
         return dataset.bioMeta.sex
@@ -88,6 +107,13 @@ class BasicDatasetSerializer(serializers.ModelSerializer):
         }
 
 
+def metadata_version(loom,catalogs):
+    '''
+    Stamp of the metadata of a dataset: loom file version and the loom fields shown with it
+    '''
+    content = json.dumps([catalogs.version, loom.classes, loom.row_name, loom.col_name, loom.cellNumber, loom.geneNumber])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
 class DatasetSerializer(serializers.ModelSerializer):
     loom = LoomSerializer(many=False, read_only=True)
     sop = sopMetaSerializer(many=False, read_only=True)
@@ -108,22 +134,28 @@ class DatasetSerializer(serializers.ModelSerializer):
             return dataset.loom.reductions[0]
             
     def get_metadata(self, dataset):
-        metadata = {'col_name':'','row_name':'','filters':{},'filters_keys':{'ca':[],'ra':[]}}
-        for col in dataset.loom.classes :
-           metadata['filters'][col] = {'name':col,'values':get_ca(dataset.loom.file.path,key=col,unique=True),'attributes':'ca'}
+        loom = dataset.loom
+        catalogs = get_catalogs(loom.file.path) # unique values precomputed at ingest
+        version = metadata_version(loom,catalogs)
+        request = self.context.get('request', None)
+        if request is not None and request.query_params.get('metadata_version', None) == version:
+            return {'version':version,'unchanged':True} # client copy is up to date
+        metadata = {'version':version,'col_name':'','row_name':'','filters':{},'filters_keys':{'ca':[],'ra':[]}}
+        for col in loom.classes :
+           catalog = catalogs.get('ca',col)
+           metadata['filters'][col] = {'name':col,'values':catalog['values'],'counts':catalog['counts'],'attributes':'ca'}
            metadata['filters_keys']['ca'].append(col)
 
         #Always add Chromosome on row attributes
-        if check_ra(dataset.loom.file.path,'Chromosome'):
-            metadata['filters']['Chromosome'] = {'name':'Chromosome','values':get_ra(dataset.loom.file.path,key='Chromosome',unique=True),'attributes':'ra'}
-            metadata['filters_keys']['ra'].append('Chromosome')
-        if check_ra(dataset.loom.file.path,'Symbol'):
-            metadata['filters']['Symbol'] = {'name':'Symbol','values':get_ra(dataset.loom.file.path,key='Symbol',unique=True),'attributes':'ra'}
-            metadata['filters_keys']['ra'].append('Symbol')
-        metadata['row_name'] = dataset.loom.row_name
-        metadata['col_name'] = dataset.loom.col_name
-        metadata['cell_number'] = dataset.loom.cellNumber
-        metadata['gene_number'] = dataset.loom.geneNumber
+        for row in ROW_CATALOGS:
+            if catalogs.has('ra',row):
+                catalog = catalogs.get('ra',row)
+                metadata['filters'][row] = {'name':row,'values':catalog['values'],'counts':catalog['counts'],'attributes':'ra'}
+                metadata['filters_keys']['ra'].append(row)
+        metadata['row_name'] = loom.row_name
+        metadata['col_name'] = loom.col_name
+        metadata['cell_number'] = loom.cellNumber
+        metadata['gene_number'] = loom.geneNumber
         return metadata
     
     def get_relativedatasets(self, dataset):
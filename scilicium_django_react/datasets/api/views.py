@@ -1,13 +1,17 @@
 import os
+import math
+import threading
 
 from rest_framework import viewsets 
 from rest_framework import status, permissions
 from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.renderers import JSONRenderer
 
 from django.core.files import File
-from django.http import HttpResponse, JsonResponse, FileResponse
+from django.http import HttpResponse, JsonResponse, FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import action
 from rest_framework import permissions
@@ -21,6 +25,17 @@ from scilicium_django_react.users.models import User
 from scilicium_django_react.utils.loom_reader import *
 from scilicium_django_react.utils.chartjsCreator import *
 from scilicium_django_react.utils.plotlyCreator import *
+from scilicium_django_react.utils.binary_figure import encode_binary_figure, CONTENT_TYPE as BINARY_FIGURE_CONTENT_TYPE
+from scilicium_django_react.utils.figure_json import raw_json_response
+from scilicium_django_react.utils.chart_cache import chart_cache_key, get_cached_chart, store_chart
+from scilicium_django_react.studies.catalogue import snapshot_response, DATASETS_KEY
+from scilicium_django_react.studies.api.serializers import StudyPublicSerializer
+from scilicium_django_react.studies.api.catalogue import paginated_listing, filter_catalogue, catalogue_page
+from scilicium_django_react.utils.plot_executor import run_plot_job, run_plot_jobs, DatasetBusy, JobTimeout
+from scilicium_django_react.utils.loom_residency import record_access
+from scilicium_django_react.utils.tracing import current_trace, server_timing_enabled
+from scilicium_django_react.utils.hexbin import HEXBIN_GRIDSIZE, HEXBIN_AGGREGATES
+from scilicium_django_react.datasets.search import search_datasets, search_studies, search_terms, facet_counts
 
 
 class DatasetViewSet(viewsets.ModelViewSet):
@@ -56,7 +71,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
     def view(self, request, *args, **kwargs):
         dataset = self.get_object()
         if dataset.status == "PUBLIC" or dataset.created_by == self.request.user:
-            serializer = DatasetSerializer(dataset)
+            serializer = DatasetSerializer(dataset, context={'request': request}) # metadata_version query parameter
             return Response(serializer.data)
         else :
             return Response('Your are not allowed to access this ressource', status=status.HTTP_403_FORBIDDEN)
@@ -75,7 +90,6 @@ class DatasetViewSet(viewsets.ModelViewSet):
     def download(self, request, *args, **kwargs):
         dataset = self.get_object()
         if dataset.status == "PUBLIC" or dataset.created_by == self.request.user:
-            print(dataset.loom.name)
             from scilicium_django_react.utils.utils import zip_results
             user_type = "user"
             if dataset.created_by and dataset.created_by.is_superuser:
@@ -98,9 +112,10 @@ class DatasetViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, permission_classes=[permissions.AllowAny],url_path='public', url_name='public')
     def public(self, request, *args, **kwargs):
-        public = self.queryset.filter(status="PUBLIC")
-        serializer = PublicDatasetSerializer(public, many=True)
-        return Response(serializer.data)
+        if paginated_listing(request): # ?cursor, page_size, fields, facets or ontology filters
+            public = filter_catalogue(self.queryset.filter(status="PUBLIC"),request.query_params)
+            return catalogue_page(request,PublicDatasetSerializer.setup_eager_loading(public),PublicDatasetSerializer,facets_suffix='')
+        return snapshot_response(request,DATASETS_KEY) # pre-encoded, rebuilt when datasets change
         
     
     
@@ -113,6 +128,88 @@ class LoomViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+class SearchPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
+
+class SearchCatalogue(APIView):
+    '''
+    Full-text search of public datasets, studies or ontology terms
+
+    GET ?q=liver mouse 10x&type=datasets|studies|terms&facet=species:Mus musculus&facets=1
+    Facet terms (repeatable) must all match, facets=1 adds the number of
+    matching datasets per facet term.
+    '''
+    permission_classes = (permissions.AllowAny,)
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        q = request.query_params.get('q', '')
+        kind = request.query_params.get('type', 'datasets')
+        if kind == 'terms':
+            return Response({"results":search_terms(q)}, status=status.HTTP_200_OK)
+        if kind == 'studies':
+            results = search_studies(q)
+            serializer_class = StudyPublicSerializer
+        elif kind == 'datasets':
+            results = search_datasets(q, facets=request.query_params.getlist('facet'))
+            serializer_class = PublicDatasetSerializer
+        else :
+            return Response({"msg":"Unknown search type %s" % kind}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(serializer_class.setup_eager_loading(results), request, view=self)
+        response = paginator.get_paginated_response(serializer_class(page, many=True, context={'request': request}).data)
+        if kind == 'datasets' and request.query_params.get('facets') in ('1', 'true'):
+            response.data['facets'] = facet_counts(results)
+        return response
+
+def offload(loom,fn,*args):
+    '''
+    Run a view's loom reads and figure building in the plot executor
+
+    Busy datasets answer 503 with a Retry-After header, jobs running past
+    PLOT_TIMEOUT answer 504. Views count the request with record_access
+    themselves, before any chart cache lookup.
+    '''
+    try:
+        return run_plot_job(loom.id,fn,*args)
+    except DatasetBusy as e:
+        response = Response({"msg":str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = '5'
+        return response
+    except JobTimeout as e:
+        return Response({"msg":str(e)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+class FilterMemo:
+    '''
+    Filter indices shared by the charts of a request
+
+    Charts run in several plot executor threads: the first one asking for a
+    filter resolves it while the others asking for the same filter wait for
+    its result.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = dict() # filter key -> lock held while resolving it
+        self._indices = dict()
+
+    def get(self, loom_path, filters):
+        key = json.dumps(filters, sort_keys=True)
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._indices:
+                self._indices[key] = get_filter_indices(loom_path,filters)
+        return self._indices[key]
+
+def resolve_filters(loom_path,filters,memo=None):
+    '''
+    Filter indices of a request, resolved once per distinct filter when a FilterMemo is shared
+    '''
+    if memo is None:
+        return get_filter_indices(loom_path,filters)
+    return memo.get(loom_path,filters)
+
 class GetLoomStatistics(APIView):
     permission_classes = (permissions.AllowAny,)
     authentication_classes = ()
@@ -120,15 +217,19 @@ class GetLoomStatistics(APIView):
     def post(self, request, *args, **kw):
         post_data = request.data
         data_id = post_data['id']
-        filters = post_data['filters']
 
         # Get data
         data = get_object_or_404(Loom,id=data_id)
+        record_access(data.id) # request counts decide which looms stay resident in memory
+        return offload(data,self.compute,post_data,data)
+
+    def compute(self, post_data, data, memo=None):
+        filters = post_data['filters']
         response_data = dict()
 
 
         if (filters['ca']!={}) or (filters['ra']!={}):
-            cidx_filter, ridx_filter = get_filter_indices(data.file.path,filters)
+            cidx_filter, ridx_filter = resolve_filters(data.file.path,filters,memo)
         else:
             cidx_filter, ridx_filter = (None,None)
         
@@ -152,16 +253,21 @@ class GetLoomGenes(APIView):
     def post(self, request, *args, **kw):
         post_data = request.data
         data_id = post_data['id']
+
+        data = get_object_or_404(Loom,id=data_id)
+        record_access(data.id) # request counts decide which looms stay resident in memory
+        return offload(data,self.compute,post_data,data)
+
+    def compute(self, post_data, data, memo=None):
         filters = post_data['filters']
 
         #Remove potential Symbol in filter
         filters['ra'] = filters['ra'].pop('Symbol', None)
 
-        data = get_object_or_404(Loom,id=data_id)
         response_data = dict()
 
         if (filters['ca']!={}) or (filters['ra']=={}):
-            cidx_filter, ridx_filter = get_filter_indices(data.file.path,filters)
+            cidx_filter, ridx_filter = resolve_filters(data.file.path,filters,memo)
         else:
             cidx_filter, ridx_filter = (None,None)
 
@@ -176,8 +282,42 @@ class GetLoomGenes(APIView):
             return response
         
 
-        
-        
+def scatter_max_points(requested):
+    '''
+    Points budget of a scatter plot: the requested one, capped by LOOM_SCATTER_MAX_POINTS
+    '''
+    limit = getattr(settings, 'LOOM_SCATTER_MAX_POINTS', 0)
+    try:
+        requested = int(requested) if requested else 0
+    except (TypeError, ValueError):
+        requested = 0
+    if limit and (not requested or requested > limit):
+        return limit
+    return requested or None
+
+def scatter_viewport(requested):
+    '''
+    Visible bounding box of a scatter plot, [xmin, xmax, ymin, ymax] as floats
+
+    Return
+    ------
+    list of 4 floats, None if no viewport was requested
+
+    Raise
+    -----
+    ValueError if it is not 4 finite numbers
+    '''
+    if requested is None:
+        return None
+    if not isinstance(requested, (list, tuple)) or len(requested) != 4:
+        raise ValueError('viewport must be [xmin, xmax, ymin, ymax]')
+    try:
+        viewport = [float(v) for v in requested]
+    except (TypeError, ValueError):
+        raise ValueError('viewport must be [xmin, xmax, ymin, ymax]')
+    if not all(math.isfinite(v) for v in viewport):
+        raise ValueError('viewport bounds must be finite numbers')
+    return viewport
 
 class GetLoomPlots(APIView):
     """
@@ -198,13 +338,20 @@ class GetLoomPlots(APIView):
     authentication_classes = ()
 
     def post(self, request, *args, **kw):
-
-        # Process any get params that you may need
-        # If you don't need to process get params,
-        # you can skip this part
-
         post_data = request.data
-        data_id = post_data['id']
+        data = get_object_or_404(Loom,id=post_data['id'])
+        record_access(data.id) # cache hits count too: request counts decide which looms stay resident
+
+        # identical requests on an unchanged loom are served from the chart cache
+        key = chart_cache_key(data,post_data)
+        response = get_cached_chart(key)
+        if response is None:
+            # heavy loom reads run in the bounded plot executor, at most PLOT_DATASET_CONCURRENCY per loom
+            response = offload(data,self.render_chart,post_data,data)
+            store_chart(key,response)
+        return response
+
+    def render_chart(self, post_data, data, memo=None):
         attrs = post_data['attrs']
         style = post_data['style']
         genes_menu = 'undefined'
@@ -220,12 +367,16 @@ class GetLoomPlots(APIView):
         if 'reduction' in filters :
             if filters["reduction"] != '':
                 reduction = filters["reduction"]
-        
-        # Get data
-        data = get_object_or_404(Loom,id=data_id)
+        # level of detail of scatter plots: visible bounding box and points budget
+        try:
+            viewport = scatter_viewport(post_data.get('viewport', None))
+        except ValueError as e:
+            return Response({"msg":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        max_points = scatter_max_points(post_data.get('max_points', None))
+
 
         if (filters['ca']!={}) or (filters['ra']!={}):
-            cidx_filter, ridx_filter = get_filter_indices(data.file.path,filters)
+            cidx_filter, ridx_filter = resolve_filters(data.file.path,filters,memo)
         else:
             cidx_filter, ridx_filter = (None,None)
         
@@ -243,38 +394,50 @@ class GetLoomPlots(APIView):
         response_data = dict()
         response_data["name"] = data.name
         response_data["classes"] = data.classes
-        print(ridx_filter)
-        print(filters['ra'])
         if genes_menu != 'undefined':
             response_data["genes_menu"] = get_ra(data.file.path,unique=True,ridx_filter=ridx_filter)
-        if style =="scatter":
-            response_data['chart'] = json_scatter(data.file.path,color=attrs,reduction=reduction,cidx_filter=cidx_filter)
+        if style =="scatter" and post_data.get('format', 'json') == 'binary':
+            # coordinates and colors as raw little-endian typed arrays, layout and everything else as JSON
+            fig = scatter_figure(data.file.path,color=attrs,reduction=reduction,cidx_filter=cidx_filter,viewport=viewport,max_points=max_points)
             response_data['style'] = "scatter"
-            response = Response(response_data, status=status.HTTP_200_OK)
+            return HttpResponse(encode_binary_figure(fig,meta=response_data), content_type=BINARY_FIGURE_CONTENT_TYPE, status=status.HTTP_200_OK)
+        elif style =="scatter":
+            response_data['chart'] = json_scatter(data.file.path,color=attrs,reduction=reduction,cidx_filter=cidx_filter,viewport=viewport,max_points=max_points)
+            response_data['style'] = "scatter"
+            response = raw_json_response(response_data, status=status.HTTP_200_OK) # charts are already encoded
             return response
 
         elif style=='hexbin':
-            response_data['chart'] = json_hexbin(data.file.path,reduction=reduction,cmap=plt.cm.Greys,background='white',cidx_filter=cidx_filter)
+            # hexagons colored by cell counts, or by the mean/sum expression of a gene
+            try:
+                gridsize = min(max(int(post_data.get('gridsize', HEXBIN_GRIDSIZE)), 1), 200)
+            except (TypeError, ValueError):
+                return Response({"msg":"gridsize must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+            agg = post_data.get('agg', 'mean')
+            if agg not in HEXBIN_AGGREGATES:
+                return Response({"msg":"agg must be one of %s" % ', '.join(HEXBIN_AGGREGATES)}, status=status.HTTP_400_BAD_REQUEST)
+            response_data['chart'] = json_hexbin(data.file.path,reduction=reduction,cmap=plt.cm.Greys,background='white',cidx_filter=cidx_filter,
+                gridsize=gridsize,symbol=post_data.get('symbol', None),agg=agg,shapes=post_data.get('hexbin_output', 'shapes') != 'trace')
             response_data['style'] = 'hexbin'
-            response = Response(response_data, status=status.HTTP_200_OK)
+            response = raw_json_response(response_data, status=status.HTTP_200_OK) # charts are already encoded
             return response
 
         elif style=='dot':
             response_data['chart'] = dotplot_json(data.file.path,attribute=attrs,symbols=symbols,cidx_filter=cidx_filter,ridx_filter=ridx_filter,log=log,scale=scale)
             response_data['style'] = 'dot'
-            response = Response(response_data, status=status.HTTP_200_OK)
+            response = raw_json_response(response_data, status=status.HTTP_200_OK) # charts are already encoded
             return response
 
         elif style=='violin':
             response_data['chart'] = violin_json(data.file.path,attribute=attrs,symbols=symbols,cidx_filter=cidx_filter,log=log)
             response_data['style'] = 'violin'
-            response = Response(response_data, status=status.HTTP_200_OK)
+            response = raw_json_response(response_data, status=status.HTTP_200_OK) # charts are already encoded
             return response
         
         elif style=='density':
             response_data['chart'],response_data['legend'] = json_density(data.file.path,reduction=reduction,ca=attrs,symbols=symbols,cidx_filter=cidx_filter)
             response_data['style'] = 'density'
-            response = Response(response_data, status=status.HTTP_200_OK)
+            response = raw_json_response(response_data, status=status.HTTP_200_OK) # charts are already encoded
             return response
 
         else :
@@ -287,5 +450,90 @@ class GetLoomPlots(APIView):
             response_data['style'] = data["style"]
             response_data['options'] = data["options"]
 
-            response = Response(response_data, status=status.HTTP_200_OK)
+            response = raw_json_response(response_data, status=status.HTTP_200_OK)
             return response
+
+
+class GetLoomDashboard(APIView):
+    """
+        Several charts of a loom sharing one filter, for the dataset page
+        [POST] --> {id, filters, charts: [{key, view: plots|statistics|genes, ...request of that view}]}
+        [RESPONSE] --> application/x-ndjson, one line per chart in completion order:
+            {"key": ..., "status": int, "data": response of the view}
+
+        The filter is resolved once for every chart, charts are computed in
+        the plot executor (at most PLOT_DATASET_CONCURRENCY at once) and each
+        line is sent as soon as its chart is ready. Plots are served from and
+        stored in the chart cache. With SERVER_TIMING on, a last line
+        {"server_timing": ...} gives the stages of the whole batch, as the
+        Server-Timing header is sent before the charts are computed.
+    """
+    permission_classes = (permissions.AllowAny,)
+    authentication_classes = ()
+    max_charts = 20
+    views = {'plots': GetLoomPlots, 'statistics': GetLoomStatistics, 'genes': GetLoomGenes}
+
+    def post(self, request, *args, **kw):
+        post_data = request.data
+        data = get_object_or_404(Loom,id=post_data['id'])
+        filters = post_data.get('filters', {'ca':{},'ra':{}})
+        charts = post_data.get('charts', [])
+        if not isinstance(charts, list) or not 0 < len(charts) <= self.max_charts:
+            return Response({"msg":"charts must be a list of 1 to %d chart requests" % self.max_charts}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(c, dict) for c in charts):
+            return Response({"msg":"each chart must be an object"}, status=status.HTTP_400_BAD_REQUEST)
+        unknown = [c.get('view') for c in charts if c.get('view', 'plots') not in self.views]
+        if unknown:
+            return Response({"msg":"Unknown views %s" % unknown}, status=status.HTTP_400_BAD_REQUEST)
+
+        memo = FilterMemo() # filter indices shared by every chart
+        lines = []
+        calls = []
+        for i,chart in enumerate(charts):
+            spec = dict(chart, id=data.id, filters=json.loads(json.dumps(filters)))
+            spec.pop('format', None) # binary figures are not sent in a batch
+            spec.pop('key', None)
+            spec.pop('view', None) # same chart cache entries as the single chart views
+            key = chart.get('key', i)
+            view = chart.get('view', 'plots')
+            if view == 'plots':
+                cache_key = chart_cache_key(data,spec)
+                cached = get_cached_chart(cache_key)
+                if cached is not None:
+                    lines.append(self.line(key,cached))
+                    continue
+                calls.append((key, cache_key, (self.views[view]().render_chart, (spec,data,memo))))
+            else:
+                calls.append((key, None, (self.views[view]().compute, (spec,data,memo))))
+
+        record_access(data.id)
+        response = StreamingHttpResponse(self.stream(data,lines,calls), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no' # let nginx forward lines as they come
+        return response
+
+    def stream(self, data, lines, calls):
+        yield from lines # cached charts first
+        jobs = run_plot_jobs(data.id,[call for _,_,call in calls])
+        try:
+            for i,response,error in jobs:
+                key, cache_key, _ = calls[i]
+                if error is not None:
+                    code = status.HTTP_503_SERVICE_UNAVAILABLE if isinstance(error, DatasetBusy) else status.HTTP_504_GATEWAY_TIMEOUT if isinstance(error, JobTimeout) else status.HTTP_500_INTERNAL_SERVER_ERROR
+                    yield self.line(key, Response({"msg":str(error)}, status=code))
+                    continue
+                if cache_key is not None:
+                    store_chart(cache_key,response)
+                yield self.line(key,response)
+        finally:
+            jobs.close() # client gone: running charts are cancelled
+        trace = current_trace() # bound by ServerTimingMiddleware while the response is streamed
+        if trace is not None and server_timing_enabled():
+            yield json.dumps({"server_timing": trace.server_timing()}).encode('utf-8') + b'\n'
+
+    def line(self, key, response):
+        if isinstance(response, Response):
+            content = JSONRenderer().render(response.data)
+        else:
+            content = response.content
+        return b'{"key":' + json.dumps(key).encode('utf-8') + b',"status":%d,"data":' % response.status_code + content + b'}\n'
@@ -5,3 +5,6 @@ from django.utils.translation import gettext_lazy as _
 class DatasetsConfig(AppConfig):
     name = "scilicium_django_react.datasets"
     verbose_name = _("Datasets")
+
+    def ready(self):
+        import scilicium_django_react.datasets.signals  # noqa F401 search index maintenance
@@ -0,0 +1,43 @@
+# Generated by Django 3.0.11 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0014_auto_20220120_1220'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loom',
+            name='ingest_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='loom',
+            name='ingest_step',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='loom',
+            name='ingest_progress',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loom',
+            name='ingest_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='loom',
+            name='ingest_version',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='loom',
+            name='ingest_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
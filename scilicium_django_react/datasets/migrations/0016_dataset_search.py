@@ -0,0 +1,34 @@
+# Generated by Django 3.0.11 on 2026-10-17 12:02
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django_better_admin_arrayfield.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0015_loom_ingest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='search_facets',
+            field=django_better_admin_arrayfield.models.fields.ArrayField(base_field=models.CharField(max_length=300), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='dataset_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_facets'], name='dataset_search_facets_gin'),
+        ),
+    ]
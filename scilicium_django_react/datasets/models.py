@@ -1,7 +1,9 @@
 import os
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django_better_admin_arrayfield.models.fields import ArrayField
 
 # Create your models here.
@@ -10,6 +12,15 @@ from scilicium_django_react.studies.models import Study, Contributor
 from scilicium_django_react.ontologies.models import CellLine, Species, Tissue, DevStage, Organ, Chemical, Omics, Granularity, Sequencing, ExperimentalProcess
 from django.utils.text import slugify
 from scilicium_django_react.utils.loom_reader import *
+from scilicium_django_react.utils.loom_pool import loom_pool, file_version
+from scilicium_django_react.utils.loom_cache import attribute_cache
+from scilicium_django_react.utils.loom_index import invalidate_symbol_index, invalidate_bitmaps
+from scilicium_django_react.utils.loom_matrix import invalidate_expression_sidecar
+from scilicium_django_react.utils.loom_summary import invalidate_group_summaries
+from scilicium_django_react.utils.loom_catalog import invalidate_catalogs
+from scilicium_django_react.utils.loom_embedding import invalidate_embeddings
+from scilicium_django_react.utils.chart_cache import invalidate_chart_cache
+from scilicium_django_react.datasets.tasks import ingest_loom
 
 def get_upload_path(instance, filename):
 
@@ -64,6 +75,13 @@ class sopMeta(models.Model):
         return self.name
 
 class Loom(models.Model):
+    INGEST_STATUS = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('READY', 'Ready'),
+        ('FAILED', 'Failed'),
+    )
+
     name = models.CharField(max_length=200,unique=True)
     loomId = models.CharField(max_length=200,unique=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.CASCADE, related_name='loom_upload_created_by')
@@ -77,6 +95,12 @@ class Loom(models.Model):
     classes = ArrayField(models.CharField(max_length=200, blank=True), default=list)
     file = models.FileField(upload_to=get_upload_path, blank=True, null=True)
     default_display = models.CharField(max_length=200, blank=True, null=True)
+    ingest_status = models.CharField(max_length=20, choices=INGEST_STATUS, default="PENDING")
+    ingest_step = models.CharField(max_length=50, blank=True, default="")
+    ingest_progress = models.IntegerField(default=0)
+    ingest_error = models.TextField(blank=True, default="")
+    ingest_version = models.CharField(max_length=50, blank=True, default="")
+    ingest_updated_at = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return self.name
@@ -85,6 +109,18 @@ class Loom(models.Model):
     def save(self, *args, **kwargs):
         force = kwargs.pop('force', False)
         super(Loom, self).save(*args, **kwargs)
+        version = file_version(self.file.path)
+        # indexes and sidecars are rebuilt by the ingest task when the file changes
+        reingest = force or self.ingest_status == 'FAILED' or self.ingest_version != '%d:%d' % version
+        if reingest:
+            loom_pool.invalidate(self.file.path) # file may have been replaced by the upload
+            attribute_cache.invalidate(self.file.path)
+            invalidate_symbol_index(self.file.path)
+            invalidate_bitmaps(self.file.path)
+            invalidate_expression_sidecar(self.file.path)
+            invalidate_group_summaries(self.file.path)
+            invalidate_catalogs(self.file.path)
+            invalidate_embeddings(self.file.path)
         loomattr = extract_attr_keys(self.file.path)
         shape = get_shape(self.file.path)
         self.reductions = get_available_reductions(self.file.path)
@@ -94,7 +130,16 @@ class Loom(models.Model):
         self.cellNumber = shape[1]
         self.geneNumber = shape[0]
         self.loomId = "hul" + str(self.id)
+        if reingest:
+            self.ingest_status = "PENDING"
+            self.ingest_step = ""
+            self.ingest_progress = 0
+            self.ingest_error = ""
+            self.ingest_version = '%d:%d' % version
         super(Loom, self).save()
+        invalidate_chart_cache(self.id) # classes, name... are part of chart responses
+        if reingest:
+            transaction.on_commit(lambda: ingest_loom.delay(self.id, list(version)))
 
 
 class Dataset(models.Model):
@@ -119,7 +164,15 @@ class Dataset(models.Model):
     sop = models.ForeignKey(sopMeta, blank=True, null=True, on_delete=models.SET_NULL, related_name='dataset_sop')
     bioMeta = models.ForeignKey(biomaterialMeta, blank=True, null=True, on_delete=models.SET_NULL, related_name='dataset_biometa')
     contributor = models.ManyToManyField(Contributor, related_name='contributor_dataset', blank=True)
-    
+    # full-text search document and 'facet:label' terms, maintained by datasets.search
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    search_facets = ArrayField(models.CharField(max_length=300), default=list, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='dataset_search_vector_gin'),
+            GinIndex(fields=['search_facets'], name='dataset_search_facets_gin'),
+        ]
 
     def __str__(self):
         return self.title
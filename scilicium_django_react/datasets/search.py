@@ -0,0 +1,172 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Value
+
+from scilicium_django_react.datasets.models import Dataset
+from scilicium_django_react.studies.models import Study
+
+SEARCH_CONFIG = 'english'
+
+# facet name -> (dataset relation, ontology field)
+SEARCH_FACETS = [
+    ('species', 'bioMeta', 'species'),
+    ('tissue', 'bioMeta', 'tissue'),
+    ('organ', 'bioMeta', 'organ'),
+    ('dev_stage', 'bioMeta', 'developmentStage'),
+    ('technology', 'sop', 'technology'),
+    ('omics', 'sop', 'omics'),
+    ('resolution', 'sop', 'resolution'),
+]
+# words of catalogue queries that describe what is searched rather than what it is about
+QUERY_STOPWORDS = {'all', 'any', 'data', 'dataset', 'datasets', 'study', 'studies', 'in', 'of', 'from', 'with', 'and', 'or', 'the'}
+
+def _labels(term):
+    return [label for label in (term.ontologyLabel, term.displayLabel) if label]
+
+def dataset_document(dataset):
+    '''
+    Weighted texts and facet terms of a dataset
+
+    Ontology labels of the dataset weigh 'A'. Labels of the terms linked
+    to them through as_parent weigh 'C', so searching a broad term finds
+    datasets annotated with narrower ones (and conversely, as_parent links
+    are stored both ways).
+
+    Return
+    ------
+    dict weight -> list of texts, list of 'facet:label' terms
+    '''
+    texts = {'A': [dataset.title], 'B': list(dataset.keywords or []), 'C': [], 'D': [dataset.description or '']}
+    facets = []
+    for facet, relation, field in SEARCH_FACETS:
+        meta = getattr(dataset, relation)
+        if meta is None:
+            continue
+        for term in getattr(meta, field).all():
+            texts['A'] += _labels(term)
+            facets.append('%s:%s' % (facet, term.ontologyLabel))
+            for related in term.as_parent.all():
+                texts['C'] += _labels(related)
+    if dataset.study is not None:
+        texts['B'].append(dataset.study.title)
+    return texts, sorted(set(facets))
+
+def _vector(texts):
+    vector = None
+    for weight, values in texts.items():
+        part = SearchVector(Value(' '.join(v for v in values if v)), weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+def _with_documents(datasets):
+    prefetch = ['%s__%s__as_parent' % (relation, field) for _, relation, field in SEARCH_FACETS]
+    return datasets.select_related('bioMeta', 'sop', 'study').prefetch_related(*prefetch)
+
+def index_datasets(datasets=None):
+    '''
+    Recompute the search vector and facets of datasets (all of them if None)
+    '''
+    if datasets is None:
+        datasets = Dataset.objects.all()
+    for dataset in _with_documents(datasets):
+        texts, facets = dataset_document(dataset)
+        Dataset.objects.filter(pk=dataset.pk).update(search_vector=_vector(texts), search_facets=facets)
+
+def index_studies(studies=None):
+    '''
+    Recompute the search vector of studies from their own text, articles and datasets
+    '''
+    if studies is None:
+        studies = Study.objects.all()
+    studies = studies.prefetch_related('article', 'article__author')
+    for study in studies:
+        texts = {'A': [study.title], 'B': [], 'C': [], 'D': [study.description or '']}
+        for article in study.article.all():
+            texts['B'] += [article.title or '', article.journal or '']
+            texts['B'] += [author.fullName for author in article.author.all()]
+            texts['D'].append(article.abstract)
+        for dataset in _with_documents(study.dataset_of.all()):
+            dataset_texts, _ = dataset_document(dataset)
+            texts['A'] += dataset_texts['A']
+            texts['C'] += dataset_texts['C']
+        Study.objects.filter(pk=study.pk).update(search_vector=_vector(texts))
+
+def search_query(q):
+    '''
+    Full-text query of a catalogue search, every remaining word must match
+
+    'all liver datasets in mouse, 10x' searches liver & mouse & 10x.
+    '''
+    words = [w for w in re.findall(r'[\w\-\.]+', q.lower()) if w not in QUERY_STOPWORDS]
+    if not words:
+        return None
+    return SearchQuery(' '.join(words), config=SEARCH_CONFIG)
+
+def search_datasets(q='', facets=(), queryset=None):
+    '''
+    Public datasets matching a text query and facet terms, best ranked first
+
+    The text query and the facets are both answered by GIN indexes in a
+    single SQL query.
+
+    Params
+    ------
+    q : str
+        Free text
+    facets : list
+        'facet:label' terms the datasets must all have
+    '''
+    if queryset is None:
+        queryset = Dataset.objects.filter(status="PUBLIC")
+    if facets:
+        queryset = queryset.filter(search_facets__contains=list(facets))
+    query = search_query(q)
+    if query is None:
+        return queryset.order_by('-id')
+    return queryset.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', '-id')
+
+def search_studies(q='', queryset=None):
+    if queryset is None:
+        queryset = Study.objects.filter(status="PUBLIC")
+    query = search_query(q)
+    if query is None:
+        return queryset.order_by('-id')
+    return queryset.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', '-id')
+
+def facet_counts(datasets):
+    '''
+    Number of datasets per facet term, one aggregate query over the precomputed facets
+
+    Return
+    ------
+    dict facet -> list of {'label', 'count'}
+    '''
+    ids, params = datasets.order_by().values('pk').query.sql_with_params()
+    sql = ('SELECT term, COUNT(*) FROM (SELECT unnest(search_facets) AS term FROM %s WHERE id IN (%s)) AS terms '
+        'GROUP BY term ORDER BY COUNT(*) DESC, term' % (Dataset._meta.db_table, ids))
+    counts = {facet: [] for facet, _, _ in SEARCH_FACETS}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for term, count in cursor.fetchall():
+            facet, label = term.split(':', 1)
+            counts.setdefault(facet, []).append({'label': label, 'count': count})
+    return counts
+
+def search_terms(q, limit=20):
+    '''
+    Ontology terms whose label matches q, with the facet they belong to
+    '''
+    query = search_query(q)
+    if query is None:
+        return []
+    results = []
+    for facet, relation, field in SEARCH_FACETS:
+        model = (Dataset._meta.get_field(relation).related_model)._meta.get_field(field).related_model
+        terms = (model.objects
+            .annotate(search=SearchVector('ontologyLabel', 'displayLabel', config=SEARCH_CONFIG))
+            .filter(search=query)
+            .values('id', 'ontologyLabel', 'displayLabel')[:limit])
+        results += [dict(term, facet=facet) for term in terms]
+    return results
@@ -0,0 +1,119 @@
+import threading
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from scilicium_django_react.studies.models import Study, Article
+from scilicium_django_react.datasets.models import Dataset, biomaterialMeta, sopMeta
+from scilicium_django_react.datasets.search import SEARCH_FACETS
+from scilicium_django_react.datasets.tasks import index_search, reindex_search
+
+M2M_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+
+_pending = threading.local()
+
+def _pending_ids():
+    if not hasattr(_pending, 'datasets'):
+        _pending.datasets, _pending.studies = set(), set()
+    return _pending.datasets, _pending.studies
+
+def schedule_index(datasets=(), studies=()):
+    '''
+    Reindex datasets and studies (ids) in a Celery task once the transaction commits
+
+    Ids queued during one transaction (e.g. the two saves of Dataset.save()
+    and the study of the dataset) are indexed once, by a single task.
+    '''
+    pending_datasets, pending_studies = _pending_ids()
+    pending_datasets.update(datasets)
+    pending_studies.update(studies)
+    transaction.on_commit(flush_index)
+
+def schedule_reindex():
+    '''
+    Rebuild every search document in a Celery task once the transaction commits
+
+    Sent once per transaction however many ontology terms it saves, and in
+    place of the ids queued by schedule_index, which it covers.
+    '''
+    _pending.reindex_all = True
+    transaction.on_commit(flush_index)
+
+def flush_index():
+    pending_datasets, pending_studies = _pending_ids()
+    if getattr(_pending, 'reindex_all', False):
+        _pending.reindex_all = False
+        _pending.datasets, _pending.studies = set(), set()
+        reindex_search.delay()
+        return
+    if not (pending_datasets or pending_studies):
+        return # already sent by an earlier callback of the same transaction
+    _pending.datasets, _pending.studies = set(), set()
+    index_search.delay(sorted(pending_datasets), sorted(pending_studies))
+
+def dataset_saved(sender, instance, **kwargs):
+    schedule_index([instance.pk], [instance.study_id] if instance.study_id else [])
+
+def dataset_deleted(sender, instance, **kwargs):
+    if instance.study_id: # its study document no longer includes it
+        schedule_index(studies=[instance.study_id])
+
+def dataset_meta_saved(sender, instance, **kwargs):
+    if isinstance(instance, biomaterialMeta):
+        datasets = Dataset.objects.filter(bioMeta=instance)
+    else:
+        datasets = Dataset.objects.filter(sop=instance)
+    datasets = list(datasets.values_list('pk', 'study_id'))
+    schedule_index([pk for pk,_ in datasets], [study_id for _,study_id in datasets if study_id])
+
+def dataset_meta_links_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if reverse: # an ontology term linked to many datasets
+        schedule_reindex()
+    else:
+        dataset_meta_saved(sender, instance)
+
+def study_saved(sender, instance, **kwargs):
+    # study title is part of its datasets document
+    schedule_index(instance.dataset_of.values_list('pk', flat=True), [instance.pk])
+
+def study_articles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if reverse: # instance is an article, pk_set holds studies
+        schedule_index(studies=pk_set if pk_set else Study.objects.filter(article=instance).values_list('pk', flat=True))
+    else:
+        schedule_index(studies=[instance.pk])
+
+def article_authors_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    articles = [instance.pk] if not reverse else instance.write_by.all()
+    schedule_index(studies=Study.objects.filter(article__in=articles).values_list('pk', flat=True))
+
+def article_saved(sender, instance, **kwargs):
+    schedule_index(studies=Study.objects.filter(article=instance).values_list('pk', flat=True))
+
+def ontology_changed(sender, instance=None, **kwargs):
+    if kwargs.get('raw') or kwargs.get('action', 'post_add') not in M2M_ACTIONS:
+        return # fixtures loaded with loaddata, or m2m pre_* signals
+    # labels and as_parent links end up in many documents
+    schedule_reindex()
+
+post_save.connect(dataset_saved, sender=Dataset, dispatch_uid='search_save_dataset')
+post_delete.connect(dataset_deleted, sender=Dataset, dispatch_uid='search_delete_dataset')
+post_save.connect(study_saved, sender=Study, dispatch_uid='search_save_study')
+post_save.connect(article_saved, sender=Article, dispatch_uid='search_save_article')
+m2m_changed.connect(study_articles_changed, sender=Study.article.through, dispatch_uid='search_study_article')
+m2m_changed.connect(article_authors_changed, sender=Article.author.through, dispatch_uid='search_article_author')
+for model in (biomaterialMeta, sopMeta):
+    post_save.connect(dataset_meta_saved, sender=model, dispatch_uid='search_save_%s' % model._meta.label)
+for _, relation, field in SEARCH_FACETS:
+    meta = Dataset._meta.get_field(relation).related_model
+    m2m_changed.connect(dataset_meta_links_changed, sender=getattr(meta, field).through, dispatch_uid='search_%s_%s' % (meta._meta.label, field))
+
+for model in apps.get_app_config('ontologies').get_models():
+    post_save.connect(ontology_changed, sender=model, dispatch_uid='search_save_%s' % model._meta.label)
+    m2m_changed.connect(ontology_changed, sender=model.as_parent.through, dispatch_uid='search_parents_%s' % model._meta.label)
@@ -0,0 +1,152 @@
+from django.conf import settings
+from django.utils import timezone
+
+from config import celery_app
+from scilicium_django_react.utils.loom_reader import get_shape, extract_attr_keys, get_available_reductions, get_reduction_x_y
+from scilicium_django_react.utils.loom_pool import file_version
+from scilicium_django_react.utils.loom_cache import build_attribute_sidecar
+from scilicium_django_react.utils.loom_index import build_symbol_index, build_attribute_bitmaps
+from scilicium_django_react.utils.loom_matrix import expression_sidecar_enabled, build_expression_sidecar, build_variance_ranking
+from scilicium_django_react.utils.loom_summary import build_group_summaries
+from scilicium_django_react.utils.loom_catalog import build_catalogs
+from scilicium_django_react.utils.loom_embedding import build_embeddings
+from scilicium_django_react.utils.loom_residency import update_residency, warm_loom
+from scilicium_django_react.utils.chart_cache import invalidate_chart_cache
+from scilicium_django_react.studies.catalogue import invalidate_snapshots, DATASETS_KEY
+
+class StaleIngest(Exception):
+    '''
+    Loom file replaced while it was being ingested, a newer ingest is queued
+    '''
+
+def validate_loom(loom):
+    '''
+    Check that a loom file can be plotted
+    '''
+    ngenes, ncells = get_shape(loom.file.path)
+    if ngenes == 0 or ncells == 0:
+        raise Exception(f'Loom matrix is empty ({ngenes} genes x {ncells} cells)')
+    keys = extract_attr_keys(loom.file.path)
+    if 'Symbol' not in keys['row_attr_keys']:
+        raise Exception('Loom file has no Symbol row attribute')
+
+def _classes(loom):
+    return [col for col in loom.classes if col in loom.colEntity]
+
+def build_attributes(loom):
+    path = loom.file.path
+    coordinates = set(label for r in get_available_reductions(path) for label in get_reduction_x_y(path,r)) # stored as embeddings
+    for key in loom.colEntity:
+        if key not in coordinates:
+            build_attribute_sidecar(path,'ca',key)
+    for key in loom.rowEntity:
+        build_attribute_sidecar(path,'ra',key)
+
+def build_bitmaps(loom):
+    for col in _classes(loom): # filters are built on classes and chromosomes
+        build_attribute_bitmaps(loom.file.path,'ca',col)
+    if 'Chromosome' in loom.rowEntity:
+        build_attribute_bitmaps(loom.file.path,'ra','Chromosome')
+
+def build_expression(loom):
+    if expression_sidecar_enabled():
+        build_expression_sidecar(loom.file.path)
+
+def build_summaries(loom):
+    build_group_summaries(loom.file.path,_classes(loom))
+
+def warm_sidecar(loom):
+    '''
+    Bring the new sidecar into the page cache when the loom is kept resident
+    '''
+    warm_loom(loom.id,loom.file.path)
+
+# ingest steps, in order
+INGEST_STEPS = [
+    ('validate', validate_loom),
+    ('symbol_index', lambda loom: build_symbol_index(loom.file.path)),
+    ('attributes', build_attributes),
+    ('embeddings', lambda loom: build_embeddings(loom.file.path)),
+    ('bitmaps', build_bitmaps),
+    ('expression', build_expression),
+    ('summaries', build_summaries),
+    ('catalogs', lambda loom: build_catalogs(loom.file.path,_classes(loom))),
+    ('variance', lambda loom: build_variance_ranking(loom.file.path)),
+    ('warm', warm_sidecar),
+]
+
+def _report(loom_id, **fields):
+    from scilicium_django_react.datasets.models import Loom
+    Loom.objects.filter(id=loom_id).update(ingest_updated_at=timezone.now(), **fields)
+
+@celery_app.task(
+    ignore_result=True,
+    time_limit=getattr(settings, 'LOOM_INGEST_TIME_LIMIT', 2 * 3600),
+    soft_time_limit=getattr(settings, 'LOOM_INGEST_TIME_LIMIT', 2 * 3600) - 60,
+)
+def ingest_loom(loom_id, version=None):
+    '''
+    Precompute the indexes and sidecars of an uploaded loom file
+
+    Progress is written on the Loom (ingest_status, ingest_step,
+    ingest_progress) after each step. The task stops without error when
+    the file changed since it was queued, the newer upload queued its own
+    ingest.
+
+    Params
+    ------
+    loom_id : int
+        Loom primary key
+    version : list or None
+        File version (mtime_ns, size) the ingest was queued for
+    '''
+    from scilicium_django_react.datasets.models import Loom
+    loom = Loom.objects.filter(id=loom_id).first()
+    if loom is None or not loom.file:
+        return
+    _report(loom_id, ingest_status='RUNNING', ingest_step='', ingest_progress=0, ingest_error='')
+    try:
+        for i, (step, build) in enumerate(INGEST_STEPS):
+            if version is not None and list(file_version(loom.file.path)) != list(version):
+                raise StaleIngest()
+            _report(loom_id, ingest_step=step, ingest_progress=int(100 * i / len(INGEST_STEPS)))
+            build(loom)
+    except StaleIngest:
+        return
+    except Exception as e:
+        _report(loom_id, ingest_status='FAILED', ingest_error=f'{step}: {e}')
+        raise
+    _report(loom_id, ingest_status='READY', ingest_step='', ingest_progress=100)
+    invalidate_snapshots([DATASETS_KEY]) # public listing shows the loom ingest status
+    invalidate_chart_cache(loom_id) # charts cached before the indexes existed are recomputed
+
+@celery_app.task(ignore_result=True)
+def index_search(dataset_ids, study_ids):
+    '''
+    Recompute the search documents of some datasets and studies, queued by the datasets signals
+    '''
+    from scilicium_django_react.datasets.models import Dataset
+    from scilicium_django_react.studies.models import Study
+    from scilicium_django_react.datasets.search import index_datasets, index_studies
+    if dataset_ids:
+        index_datasets(Dataset.objects.filter(pk__in=dataset_ids))
+    if study_ids:
+        index_studies(Study.objects.filter(pk__in=study_ids))
+
+@celery_app.task(ignore_result=True)
+def reindex_search():
+    '''
+    Recompute the search documents of every dataset and study, after ontology changes
+    '''
+    from scilicium_django_react.datasets.search import index_datasets, index_studies
+    index_datasets()
+    index_studies()
+
+@celery_app.task(ignore_result=True)
+def update_loom_residency():
+    '''
+    Keep the sidecars of the most requested looms in the page cache, within LOOM_RESIDENT_BYTES
+    '''
+    from scilicium_django_react.datasets.models import Loom
+    looms = [(loom.id, loom.file.path) for loom in Loom.objects.filter(ingest_status='READY').exclude(file='')]
+    return update_residency(looms)
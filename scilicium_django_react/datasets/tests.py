@@ -1,3 +1,183 @@
-from django.test import TestCase
+import pytest
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from scilicium_django_react.datasets import signals
+from scilicium_django_react.datasets.models import Dataset, biomaterialMeta, sopMeta
+from scilicium_django_react.datasets.search import index_datasets, index_studies, search_datasets, search_query, facet_counts
+from scilicium_django_react.studies.models import Study
+from scilicium_django_react.ontologies.models import Species, Tissue, Sequencing
+
+pytestmark = pytest.mark.django_db
+
+
+def make_dataset(title, species=(), tissues=(), technologies=(), status="PUBLIC", study=None):
+    bio = biomaterialMeta.objects.create(name="Bio " + title, sex=["male"])
+    for label in species:
+        bio.species.add(Species.objects.get_or_create(ontologyLabel=label)[0])
+    for label in tissues:
+        bio.tissue.add(Tissue.objects.get_or_create(ontologyLabel=label)[0])
+    sop = sopMeta.objects.create(name="Sop " + title)
+    for label in technologies:
+        sop.technology.add(Sequencing.objects.get_or_create(ontologyLabel=label)[0])
+    return Dataset.objects.create(title=title, status=status, bioMeta=bio, sop=sop, study=study)
+
+
+class TestSearchCatalogue:
+    def test_default_page_without_limit(self):
+        for n in range(25):
+            make_dataset("Liver atlas %d" % n, tissues=["liver"])
+        index_datasets()
+
+        response = APIClient().get(reverse("api:search"), {"q": "liver"})
+
+        assert response.status_code == 200
+        assert response.data["count"] == 25
+        assert len(response.data["results"]) == 20
+        assert response.data["next"] is not None
+
+    def test_limit_is_capped(self):
+        make_dataset("Liver atlas", tissues=["liver"])
+        index_datasets()
+
+        response = APIClient().get(reverse("api:search"), {"q": "liver", "limit": 1000})
+
+        assert response.status_code == 200
+        assert response.data["count"] == 1
+
+
+class TestPublicCatalogue:
+    url = "api:datasets-public"
+
+    def test_cursor_pages(self):
+        for n in range(5):
+            make_dataset("Dataset %d" % n)
+        make_dataset("Private", status="PRIVATE")
+        client = APIClient()
+
+        response = client.get(reverse(self.url), {"page_size": 2})
+        assert response.status_code == 200
+        titles = [d["title"] for d in response.data["results"]]
+        while response.data["next"]:
+            response = client.get(response.data["next"])
+            titles += [d["title"] for d in response.data["results"]]
+
+        assert titles == ["Dataset %d" % n for n in reversed(range(5))]
+
+    def test_sparse_fields(self):
+        make_dataset("Liver atlas", tissues=["liver"])
+
+        response = APIClient().get(reverse(self.url), {"fields": "title,tissue"})
+
+        assert response.status_code == 200
+        assert response.data["results"] == [{"title": "Liver atlas", "tissue": ["liver"]}]
+
+    def test_ontology_filters(self):
+        make_dataset("Human liver", species=["human"], tissues=["liver"])
+        make_dataset("Human heart", species=["human"], tissues=["heart"])
+        make_dataset("Mouse liver", species=["mouse"], tissues=["liver"])
+        client = APIClient()
+
+        response = client.get(reverse(self.url), {"species": "human", "tissue": "liver,lung", "fields": "title"})
+        assert [d["title"] for d in response.data["results"]] == ["Human liver"]
+
+        response = client.get(reverse(self.url), {"tissue": "liver,heart", "fields": "title"})
+        assert sorted(d["title"] for d in response.data["results"]) == ["Human heart", "Human liver", "Mouse liver"]
+
+    def test_facet_counts(self):
+        make_dataset("Human liver", species=["human"], tissues=["liver"], technologies=["10x"])
+        make_dataset("Human heart", species=["human"], tissues=["heart", "liver"], technologies=["10x"])
+        make_dataset("Mouse liver", species=["mouse"], tissues=["liver"])
+        make_dataset("Private", species=["mouse"], tissues=["heart"], status="PRIVATE")
+
+        response = APIClient().get(reverse(self.url), {"facets": "1", "species": "human"})
+
+        facets = response.data["facets"]
+        assert facets["species"] == [{"label": "human", "count": 2}]
+        assert facets["tissue"] == [{"label": "liver", "count": 2}, {"label": "heart", "count": 1}]
+        assert facets["technology"] == [{"label": "10x", "count": 2}]
+        assert facets["organ"] == []
+
+
+class TestSearch:
+    def test_stopwords_are_ignored(self):
+        assert search_query("all datasets of the") is None
+        make_dataset("Mouse liver", species=["mouse"], tissues=["liver"])
+        make_dataset("Mouse heart", species=["mouse"], tissues=["heart"])
+        index_datasets()
+
+        found = search_datasets("all liver datasets in mouse")
+        assert [d.title for d in found] == ["Mouse liver"]
+
+    def test_facet_filtering(self):
+        make_dataset("Human liver", species=["human"], tissues=["liver"], technologies=["10x"])
+        make_dataset("Mouse liver", species=["mouse"], tissues=["liver"], technologies=["10x"])
+        make_dataset("Human heart", species=["human"], tissues=["heart"])
+        make_dataset("Private", species=["human"], tissues=["liver"], status="PRIVATE")
+        index_datasets()
+
+        found = search_datasets(facets=["species:human", "tissue:liver"])
+        assert [d.title for d in found] == ["Human liver"]
+        found = search_datasets("liver", facets=["technology:10x"])
+        assert sorted(d.title for d in found) == ["Human liver", "Mouse liver"]
+
+    def test_facet_counts(self):
+        make_dataset("Human liver", species=["human"], tissues=["liver"])
+        make_dataset("Human heart", species=["human"], tissues=["heart", "liver"])
+        make_dataset("Mouse liver", species=["mouse"], tissues=["liver"])
+        index_datasets()
+
+        counts = facet_counts(search_datasets(facets=["tissue:liver"]))
+        assert counts["species"] == [{"label": "human", "count": 2}, {"label": "mouse", "count": 1}]
+        assert counts["tissue"] == [{"label": "liver", "count": 3}, {"label": "heart", "count": 1}]
+        assert counts["technology"] == []
+
+
+class TestSearchSignals:
+    @pytest.fixture
+    def queued(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(signals.index_search, "delay", lambda *args: calls.append(args))
+        monkeypatch.setattr(signals.reindex_search, "delay", lambda: calls.append("reindex"))
+        signals.flush_index() # ids left by earlier tests, whose transactions never commit
+        calls.clear()
+        return calls
+
+    def test_saves_are_indexed_once(self, queued):
+        study = Study.objects.create(title="Atlas", status="PUBLIC")
+        dataset = make_dataset("Liver", study=study)
+        dataset.save()
+        signals.flush_index()
+        signals.flush_index()
+
+        assert queued == [([dataset.pk], [study.pk])]
+
+    def test_delete_reindexes_study(self, queued):
+        study = Study.objects.create(title="Atlas", status="PUBLIC")
+        dataset = make_dataset("Liver atlas", study=study)
+        index_studies()
+        signals.flush_index()
+        queued.clear()
+
+        dataset.delete()
+        signals.flush_index()
+        assert queued == [([], [study.pk])]
+
+        index_studies(Study.objects.filter(pk__in=queued[0][1]))
+        assert not Study.objects.filter(pk=study.pk, search_vector=search_query("liver")).exists()
+
+    def test_ontology_saves_reindex_once(self, queued):
+        parent = Tissue.objects.create(ontologyLabel="organ")
+        tissue = Tissue.objects.create(ontologyLabel="liver")
+        tissue.as_parent.add(parent)
+        tissue.save()
+        signals.flush_index()
+        signals.flush_index()
+
+        assert queued == ["reindex"]
+
+    def test_raw_ontology_saves_are_ignored(self, queued):
+        signals.ontology_changed(Tissue, Tissue(ontologyLabel="liver"), raw=True)
+        signals.flush_index()
+
+        assert queued == []
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.11 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ontologies', '0002_auto_20210617_0824'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='species',
+            name='ontologyLabel',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='organ',
+            name='ontologyLabel',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='tissue',
+            name='ontologyLabel',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='sequencing',
+            name='ontologyLabel',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+    ]
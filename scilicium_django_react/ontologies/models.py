@@ -1,7 +1,7 @@
 from django.db import models
 
 class Species(models.Model):
-    ontologyLabel = models.CharField(max_length=200,blank=True, null=True)
+    ontologyLabel = models.CharField(max_length=200,blank=True, null=True, db_index=True)
     ontologyID = models.CharField(max_length=200,blank=True, null=True)
     displayLabel = models.CharField(max_length=200,blank=True, null=True)
     description =  models.TextField("Description", blank=True, default="")
@@ -11,7 +11,7 @@ class Species(models.Model):
         return self.ontologyLabel.capitalize()
 
 class Organ(models.Model):
-    ontologyLabel = models.CharField(max_length=200,blank=True, null=True)
+    ontologyLabel = models.CharField(max_length=200,blank=True, null=True, db_index=True)
     ontologyID = models.CharField(max_length=200,blank=True, null=True)
     displayLabel = models.CharField(max_length=200,blank=True, null=True)
     description =  models.TextField("Description", blank=True, default="")
@@ -21,7 +21,7 @@ class Organ(models.Model):
         return self.ontologyLabel.capitalize()
 
 class Tissue(models.Model):
-    ontologyLabel = models.CharField(max_length=200,blank=True, null=True)
+    ontologyLabel = models.CharField(max_length=200,blank=True, null=True, db_index=True)
     ontologyID = models.CharField(max_length=200,blank=True, null=True)
     displayLabel = models.CharField(max_length=200,blank=True, null=True)
     description =  models.TextField("Description", blank=True, default="")
@@ -81,7 +81,7 @@ class Omics(models.Model):
         return self.ontologyLabel.capitalize()
 
 class Sequencing(models.Model):
-    ontologyLabel = models.CharField(max_length=200,blank=True, null=True)
+    ontologyLabel = models.CharField(max_length=200,blank=True, null=True, db_index=True)
     ontologyID = models.CharField(max_length=200,blank=True, null=True)
     displayLabel = models.CharField(max_length=200,blank=True, null=True)
     description =  models.TextField("Description", blank=True, default="")
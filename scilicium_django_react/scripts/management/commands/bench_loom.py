@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scilicium_django_react.utils.loom_bench import (
+    BENCH_SIZES, BENCH_GENES, BENCH_CLASSES, BENCH_REDUCTIONS, run_benchmark, compare_results,
+)
+
+
+class Command(BaseCommand):
+    help = 'Time loom_reader charts, statistics and gene selection on synthetic loom files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cells', type=int, nargs='+', default=BENCH_SIZES, help='Number of cells of each synthetic loom')
+        parser.add_argument('--genes', type=int, default=BENCH_GENES)
+        parser.add_argument('--classes', nargs='+', default=['%s=%d' % c for c in BENCH_CLASSES.items()], help='Categorical attributes as name=values')
+        parser.add_argument('--reductions', nargs='+', default=BENCH_REDUCTIONS)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'loom_bench'), help='Directory of the generated looms, reused across runs')
+        parser.add_argument('--no-ingest', action='store_true', help='Do not build sidecars, time reads from the loom files only')
+        parser.add_argument('--select', default=None, help="Only run cases whose 'view/case/filter' name contains this")
+        parser.add_argument('--output', default=None, help='Write results as JSON to this file')
+        parser.add_argument('--compare', default=None, help='Previous JSON results to compare median times with')
+        parser.add_argument('--threshold', type=float, default=0.1, help='Relative change reported as slower/faster')
+
+    def handle(self, *args, **options):
+        try:
+            classes = {name: int(n) for name,n in (c.split('=') for c in options['classes'])}
+        except ValueError:
+            raise CommandError('classes must be given as name=number_of_values')
+        if len(classes) < 2:
+            raise CommandError('at least two classes are needed for the filter combinations')
+
+        results = run_benchmark(
+            options['workdir'], sizes=options['cells'], ngenes=options['genes'], classes=classes,
+            reductions=options['reductions'], repeat=options['repeat'], ingest=not options['no_ingest'],
+            select=options['select'], log=self.stdout.write)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=1)
+            self.stdout.write('Results written to %s' % options['output'])
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write('Compared with %s' % (baseline.get('commit') or options['compare']))
+            for cells,name,before,after,ratio,flag in compare_results(baseline, results, options['threshold']):
+                line = '%9d %-40s %8.3fs -> %8.3fs  x%.2f %s' % (cells, name, before, after, ratio, flag)
+                if flag == 'slower':
+                    line = self.style.ERROR(line)
+                elif flag == 'faster':
+                    line = self.style.SUCCESS(line)
+                self.stdout.write(line)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from scilicium_django_react.datasets.search import index_datasets, index_studies
+
+
+class Command(BaseCommand):
+    help = 'Recompute the full-text search vectors and facets of every dataset and study'
+
+    def handle(self, *args, **options):
+        index_datasets()
+        index_studies()
+        self.stdout.write('Search index rebuilt')
@@ -0,0 +1,95 @@
+from django.db.models import Count
+from rest_framework.pagination import CursorPagination
+
+from scilicium_django_react.ontologies.models import Species, Tissue, Organ, Sequencing
+
+# facet name -> (ontology model, dataset -> term lookup, term -> dataset lookup)
+FACETS = {
+    'species': (Species, 'bioMeta__species', 'as_species__dataset_biometa'),
+    'tissue': (Tissue, 'bioMeta__tissue', 'as_tissue__dataset_biometa'),
+    'organ': (Organ, 'bioMeta__organ', 'as_organ__dataset_biometa'),
+    'technology': (Sequencing, 'sop__technology', 'as_sequencing__dataset_sop'),
+}
+# query parameters switching catalogue listings from the full snapshot to pages
+PAGE_PARAMS = ['cursor', 'page_size', 'fields', 'facets'] + list(FACETS)
+
+class CatalogueCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+
+class FieldsMixin:
+    '''
+    Sparse fieldsets: only serialize the fields listed in the 'fields' context key
+
+    Only catalogue_page passes it (from ?fields=a,b,c), the viewsets using the
+    same serializers always read and write every field.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields', None)
+        if fields:
+            keep = set(f.strip() for f in fields.split(','))
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+def paginated_listing(request):
+    '''
+    Whether a catalogue request asks for pages, fields or facets instead of the full listing
+    '''
+    return any(p in request.query_params for p in PAGE_PARAMS)
+
+def filter_catalogue(queryset,params,prefix=''):
+    '''
+    Filter datasets (or studies through prefix='dataset_of__') on ontology labels
+
+    Each facet parameter is a comma separated list of labels, any of them matches.
+    '''
+    for name, (model, lookup, _) in FACETS.items():
+        labels = [v for v in params.get(name, '').split(',') if v]
+        if labels:
+            queryset = queryset.filter(**{prefix + lookup + '__ontologyLabel__in': labels})
+    return queryset.distinct()
+
+def catalogue_facets(queryset,suffix=''):
+    '''
+    Number of datasets (or studies through suffix='__study') of the queryset per ontology label
+
+    One aggregate query per facet, whatever the size of the catalogue.
+    '''
+    facets = dict()
+    for name, (model, _, reverse) in FACETS.items():
+        path = reverse + suffix
+        counts = (model.objects.filter(**{path + '__in': queryset.values('pk')})
+            .values('ontologyLabel')
+            .annotate(count=Count(path, distinct=True))
+            .order_by('-count', 'ontologyLabel'))
+        facets[name] = [{'label': c['ontologyLabel'], 'count': c['count']} for c in counts]
+    return facets
+
+def catalogue_page(request,queryset,serializer_class,facets_suffix=None):
+    '''
+    One page of a catalogue listing, with ontology facets if ?facets=1
+
+    Params
+    ------
+    request : Request
+    queryset : QuerySet
+        Filtered and eager loaded listing
+    serializer_class : Serializer
+    facets_suffix : str or None
+        Lookup from datasets to the listed model, None if the listing has no facets
+
+    Return
+    ------
+    Response
+    '''
+    paginator = CatalogueCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    context = {'request': request, 'fields': request.query_params.get('fields', None)}
+    serializer = serializer_class(page, many=True, context=context)
+    response = paginator.get_paginated_response(serializer.data)
+    if facets_suffix is not None and request.query_params.get('facets') in ('1', 'true'):
+        response.data['facets'] = catalogue_facets(queryset, facets_suffix)
+    return response
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from django.db.models import Prefetch
 from scilicium_django_react.studies.models import *
+from scilicium_django_react.datasets.models import Dataset
 from scilicium_django_react.datasets.api.serializers import DatasetSerializer, BasicDatasetSerializer
 from scilicium_django_react.users.api.serializers import GetFullUserSerializer
+from scilicium_django_react.studies.api.catalogue import FieldsMixin
 
 
 class AffiliationSerializer(serializers.ModelSerializer):
@@ -73,7 +76,7 @@ class ArticleSerializer(serializers.ModelSerializer):
 
         )
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(FieldsMixin, serializers.ModelSerializer):
     created_by = GetFullUserSerializer(many=False, read_only=True)
     class Meta:
         model = Project
@@ -126,7 +129,13 @@ class StudySerializer(serializers.ModelSerializer):
             'url': {'lookup_field': 'studyId'}
         }
 
-class StudyPublicSerializer(serializers.ModelSerializer):
+def unique_labels(values):
+    '''
+    Distinct values in order of first appearance
+    '''
+    return list(dict.fromkeys(values))
+
+class StudyPublicSerializer(FieldsMixin, serializers.ModelSerializer):
 
     authors = serializers.SerializerMethodField('get_authors')
     pub_date = serializers.SerializerMethodField('get_pub_date')
@@ -141,77 +150,60 @@ class StudyPublicSerializer(serializers.ModelSerializer):
     viewer = ViewerSerializer(many=True, read_only=True)
 
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        '''
+        Fetch everything the serializer reads in a fixed number of queries, whatever the number of studies
+        '''
+        datasets = Dataset.objects.select_related('sop','bioMeta').prefetch_related(
+            'sop__technology',
+            'bioMeta__tissue',
+            'bioMeta__organ',
+            'bioMeta__species',
+            'bioMeta__developmentStage',
+        )
+        return queryset.select_related('created_by').prefetch_related(
+            'created_by__groups',
+            'viewer',
+            'contributor',
+            Prefetch('article', queryset=Article.objects.prefetch_related('author')),
+            Prefetch('dataset_of', queryset=datasets),
+        )
+
+    def _datasets(self, study):
+        return study.dataset_of.all() # prefetched by setup_eager_loading
+
     def get_technology(self, study):
-        technology = []
-        for dataset in study.dataset_of.all():
-            for x in dataset.sop.technology.all():
-                if x.ontologyLabel not in technology:
-                    technology.append(x.ontologyLabel)
-        return technology
+        return unique_labels(x.ontologyLabel for dataset in self._datasets(study) if dataset.sop for x in dataset.sop.technology.all())
     
     def get_gender(self, study):
         genders = []
-        for dataset in study.dataset_of.all():
-            gender = dataset.bioMeta.sex
-            if gender not in genders:
+        for dataset in self._datasets(study):
+            gender = dataset.bioMeta.sex if dataset.bioMeta else None
+            if gender not in genders: # sex is a list, not hashable
                 genders.append(gender)
         return genders
     
     def get_tissues(self, study):
-        tissues = []
-        for dataset in study.dataset_of.all():
-            for x in dataset.bioMeta.tissue.all():
-                if x.ontologyLabel not in tissues:
-                    tissues.append(x.ontologyLabel)
-        return tissues
+        return unique_labels(x.ontologyLabel for dataset in self._datasets(study) if dataset.bioMeta for x in dataset.bioMeta.tissue.all())
     
     def get_organs(self, study):
-        organs = []
-        for dataset in study.dataset_of.all():
-            for x in dataset.bioMeta.organ.all():
-                if x.ontologyLabel not in organs:
-                    organs.append(x.ontologyLabel)
-        return organs
+        return unique_labels(x.ontologyLabel for dataset in self._datasets(study) if dataset.bioMeta for x in dataset.bioMeta.organ.all())
     
     def get_species(self, study):
-        species = []
-        for dataset in study.dataset_of.all():
-            for spe in dataset.bioMeta.species.all():
-                if spe.ontologyLabel not in species:
-                    species.append(spe.ontologyLabel)
-        return species
+        return unique_labels(x.ontologyLabel for dataset in self._datasets(study) if dataset.bioMeta for x in dataset.bioMeta.species.all())
     
     def get_dev_stage(self, study):
-        devstage = []
-        for dataset in study.dataset_of.all():
-            for dev in dataset.bioMeta.developmentStage.all():
-                if dev.ontologyLabel not in devstage:
-                    devstage.append(dev.ontologyLabel)
-        return devstage
+        return unique_labels(x.ontologyLabel for dataset in self._datasets(study) if dataset.bioMeta for x in dataset.bioMeta.developmentStage.all())
 
     def get_authors(self, study):
-        authors = []
-        for article in study.article.all():
-            for author in article.author.all() :
-                if author.fullName not in authors:
-                    authors.append(author.fullName)
-        return authors
+        return unique_labels(author.fullName for article in study.article.all() for author in article.author.all())
     
     def get_pub_date(self, study):
-        dates = [] 
-        for article in study.article.all():
-            date = article.releaseDate.year
-            if date not in dates:
-                dates.append(date)
-        return dates
+        return unique_labels(article.releaseDate.year for article in study.article.all() if article.releaseDate)
     
     def get_pub_pmids(self, study):
-        pmids = [] 
-        for article in study.article.all():
-            pmid = article.pmid
-            if pmid not in pmids:
-                pmids.append(pmid)
-        return pmids
+        return unique_labels(article.pmid for article in study.article.all())
 
     class Meta:
         model = Study
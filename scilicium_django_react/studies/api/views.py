@@ -10,6 +10,8 @@ from rest_framework import permissions
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
+from scilicium_django_react.studies.catalogue import snapshot_response, studies_key, PROJECTS_KEY
+from scilicium_django_react.studies.api.catalogue import paginated_listing, filter_catalogue, catalogue_page
 
 
 class ProjectViewSet(viewsets.ModelViewSet):
@@ -28,9 +30,10 @@ class ProjectViewSet(viewsets.ModelViewSet):
     def post(self, request, *args, **kwargs):
         viewer = request.GET.get('viewer', None)
         print(viewer)
-        public = self.queryset.filter(status="PUBLIC")
-        serializer = ProjectSerializer(public, many=True)
-        return Response(serializer.data)
+        if paginated_listing(request):
+            public = self.queryset.filter(status="PUBLIC").select_related('created_by').prefetch_related('created_by__groups')
+            return catalogue_page(request,public,ProjectSerializer)
+        return snapshot_response(request,PROJECTS_KEY)
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -80,9 +83,18 @@ class GetPublicStudies(APIView):
     permission_classes = (permissions.AllowAny,)
     authentication_classes = ()
 
+    def get(self, request, *args, **kwargs):
+        # cacheable form of the listing: GET ?viewer=<name> revalidates with ETag/Last-Modified
+        viewerobj = get_object_or_404(Viewer,name=request.GET.get('viewer', None))
+        return self.listing(request,viewerobj)
+
     def post(self, request, *args, **kwargs):
         post_data = request.data
         viewerobj = get_object_or_404(Viewer,name=post_data['viewer'])
-        public = self.queryset.filter(status="PUBLIC",viewer=viewerobj)
-        serializer = StudyPublicSerializer(public, many=True)
-        return Response(serializer.data) 
\ No newline at end of file
+        return self.listing(request,viewerobj)
+
+    def listing(self, request, viewerobj):
+        if paginated_listing(request): # ?cursor, page_size, fields, facets or ontology filters
+            public = filter_catalogue(self.queryset.filter(status="PUBLIC",viewer=viewerobj),request.query_params,prefix='dataset_of__')
+            return catalogue_page(request,StudyPublicSerializer.setup_eager_loading(public),StudyPublicSerializer,facets_suffix='__study')
+        return snapshot_response(request,studies_key(viewerobj.id)) # pre-encoded, rebuilt when studies change
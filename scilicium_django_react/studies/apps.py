@@ -5,3 +5,6 @@ from django.utils.translation import gettext_lazy as _
 class StudiesConfig(AppConfig):
     name = "scilicium_django_react.studies"
     verbose_name = _("Studies")
+
+    def ready(self):
+        import scilicium_django_react.studies.signals  # noqa F401 catalogue snapshots invalidation
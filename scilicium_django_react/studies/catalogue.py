@@ -0,0 +1,99 @@
+import hashlib
+
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag, parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from scilicium_django_react.studies.models import CatalogueSnapshot, Study, Project
+
+DATASETS_KEY = 'datasets'
+PROJECTS_KEY = 'projects'
+
+def studies_key(viewer_id):
+    return 'studies:%d' % viewer_id
+
+def _render_studies(viewer_id):
+    from scilicium_django_react.studies.api.serializers import StudyPublicSerializer
+    public = StudyPublicSerializer.setup_eager_loading(Study.objects.filter(status="PUBLIC",viewer__id=viewer_id))
+    return StudyPublicSerializer(public, many=True).data
+
+def _render_datasets():
+    from scilicium_django_react.datasets.models import Dataset
+    from scilicium_django_react.datasets.api.serializers import PublicDatasetSerializer
+    public = PublicDatasetSerializer.setup_eager_loading(Dataset.objects.filter(status="PUBLIC"))
+    return PublicDatasetSerializer(public, many=True).data
+
+def _render_projects():
+    from scilicium_django_react.studies.api.serializers import ProjectSerializer
+    public = Project.objects.filter(status="PUBLIC").select_related('created_by').prefetch_related('created_by__groups')
+    return ProjectSerializer(public, many=True).data
+
+def render_snapshot(key):
+    '''
+    Current JSON content of a catalogue listing
+    '''
+    if key == DATASETS_KEY:
+        data = _render_datasets()
+    elif key == PROJECTS_KEY:
+        data = _render_projects()
+    else:
+        data = _render_studies(int(key.split(':', 1)[1]))
+    return JSONRenderer().render(data)
+
+def get_snapshot(key):
+    '''
+    Snapshot of a catalogue listing, rebuilt first if it is missing or stale
+
+    A rebuild only clears the stale flag if no invalidation happened while
+    it was rendering; otherwise the next request renders it again.
+    '''
+    snapshot, _ = CatalogueSnapshot.objects.get_or_create(key=key)
+    if snapshot.stale:
+        generation = snapshot.generation
+        content = render_snapshot(key)
+        etag = hashlib.sha1(content).hexdigest()
+        updated_at = snapshot.updated_at if etag == snapshot.etag else timezone.now()
+        CatalogueSnapshot.objects.filter(id=snapshot.id, generation=generation).update(
+            content=content, etag=etag, updated_at=updated_at, stale=False)
+        snapshot.content, snapshot.etag, snapshot.updated_at = content, etag, updated_at
+    return snapshot
+
+def snapshot_response(request,key):
+    '''
+    Catalogue listing with ETag and Last-Modified, 304 when the client copy is current
+    '''
+    snapshot = get_snapshot(key)
+    etag = quote_etag(snapshot.etag)
+    last_modified = http_date(snapshot.updated_at.timestamp())
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_none_match is not None:
+        not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    else:
+        not_modified = if_modified_since is not None and int(snapshot.updated_at.timestamp()) <= if_modified_since
+    response = HttpResponseNotModified() if not_modified else HttpResponse(bytes(snapshot.content), content_type='application/json')
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
+
+def invalidate_snapshots(keys=None):
+    '''
+    Mark catalogue snapshots stale, all of them if keys is None
+    '''
+    snapshots = CatalogueSnapshot.objects.all()
+    if keys is not None:
+        keys = list(keys)
+        if not keys:
+            return
+        snapshots = snapshots.filter(key__in=keys)
+    snapshots.update(stale=True, generation=F('generation') + 1)
+
+def invalidate_studies(studies):
+    '''
+    Mark stale the snapshots of the viewers of some studies
+    '''
+    viewer_ids = Study.viewer.through.objects.filter(study__in=studies).values_list('viewer_id', flat=True)
+    invalidate_snapshots(studies_key(v) for v in set(viewer_ids))
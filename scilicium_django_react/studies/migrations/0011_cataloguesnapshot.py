@@ -0,0 +1,26 @@
+# Generated by Django 3.0.11 on 2026-10-17 10:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studies', '0010_auto_20220112_0733'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('content', models.BinaryField(default=b'')),
+                ('etag', models.CharField(blank=True, default='', max_length=64)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('stale', models.BooleanField(default=True)),
+                ('generation', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.11 on 2026-10-17 12:02
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studies', '0011_cataloguesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='study',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='study',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='study_search_vector_gin'),
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.utils import timezone
 # Create your models here.
 from django.contrib.auth.models import  User
 from django_better_admin_arrayfield.models.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 
 
@@ -118,6 +120,10 @@ class Study(models.Model):
     contributor = models.ManyToManyField(Contributor, related_name='as_study', blank=True)
     dataCurators = models.CharField(max_length=200,null=True,blank=True)
     externalID = models.TextField("externalIDs", blank=True, null=True)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False) # maintained by datasets.search
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='study_search_vector_gin')]
 
     def __str__(self):
         return self.title
@@ -128,3 +134,17 @@ class Study(models.Model):
         super(Study, self).save(*args, **kwargs)
         self.studyId = "hus" + str(self.id)
         super(Study, self).save()
+
+class CatalogueSnapshot(models.Model):
+    '''
+    Pre-encoded JSON of a public catalogue listing (studies of a viewer, public datasets, public projects)
+    '''
+    key = models.CharField(max_length=200, unique=True)
+    content = models.BinaryField(default=b'')
+    etag = models.CharField(max_length=64, blank=True, default="")
+    updated_at = models.DateTimeField(default=timezone.now)
+    stale = models.BooleanField(default=True)
+    generation = models.IntegerField(default=0) # bumped by every invalidation, guards concurrent rebuilds
+
+    def __str__(self):
+        return self.key
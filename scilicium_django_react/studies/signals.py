@@ -0,0 +1,148 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, pre_delete, m2m_changed
+
+from scilicium_django_react.studies.models import Study, Article, Author, Viewer, Project, Contributor, Institute
+from scilicium_django_react.datasets.models import Dataset, Loom, biomaterialMeta, sopMeta
+from scilicium_django_react.studies.catalogue import (
+    DATASETS_KEY, PROJECTS_KEY, studies_key, invalidate_snapshots, invalidate_studies,
+)
+
+M2M_ACTIONS = ('post_add', 'post_remove', 'pre_clear')
+
+def study_changed(sender, instance, **kwargs):
+    invalidate_studies([instance.pk])
+
+def study_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if reverse: # instance is an article, viewer or contributor, pk_set holds studies
+        field = STUDY_LINKS[sender]
+        invalidate_studies(pk_set if pk_set else Study.objects.filter(**{field: instance}))
+        if field == 'viewer':
+            invalidate_snapshots([studies_key(instance.pk)])
+        return
+    invalidate_studies([instance.pk])
+    if sender is Study.viewer.through and pk_set: # viewers just removed no longer list the study
+        invalidate_snapshots(studies_key(pk) for pk in pk_set)
+
+def article_changed(sender, instance, **kwargs):
+    invalidate_studies(instance.study_from.all())
+
+def article_authors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    articles = [instance.pk] if not reverse else instance.write_by.all()
+    invalidate_studies(Study.objects.filter(article__in=articles))
+
+def author_changed(sender, instance, **kwargs):
+    invalidate_studies(Study.objects.filter(article__author=instance))
+
+def author_affiliations_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if reverse: # instance is an institute
+        institute_changed(sender, instance)
+    else:
+        author_changed(sender, instance)
+
+def institute_changed(sender, instance, **kwargs):
+    invalidate_studies(Study.objects.filter(article__author__affiliation=instance))
+
+def contributor_changed(sender, instance, **kwargs):
+    if instance.contributor_dataset.exists():
+        invalidate_snapshots([DATASETS_KEY])
+    invalidate_studies(instance.as_study.all())
+
+def dataset_contributors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    invalidate_snapshots([DATASETS_KEY])
+    if reverse: # instance is a contributor, pk_set holds datasets
+        datasets = Dataset.objects.filter(pk__in=pk_set) if pk_set else instance.contributor_dataset.all()
+        invalidate_studies(datasets.values_list('study_id', flat=True))
+    elif instance.study_id:
+        invalidate_studies([instance.study_id])
+
+def user_changed(sender, instance, **kwargs):
+    # creators are shown in the studies and projects listings
+    invalidate_studies(Study.objects.filter(created_by=instance))
+    if Project.objects.filter(created_by=instance).exists():
+        invalidate_snapshots([PROJECTS_KEY])
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if not reverse:
+        user_changed(sender, instance)
+        return
+    for user in get_user_model().objects.filter(pk__in=pk_set) if pk_set else instance.user_set.all():
+        user_changed(sender, user)
+
+def dataset_changed(sender, instance, **kwargs):
+    invalidate_snapshots([DATASETS_KEY])
+    if instance.study_id:
+        invalidate_studies([instance.study_id])
+
+def loom_changed(sender, instance, **kwargs):
+    invalidate_snapshots([DATASETS_KEY])
+
+def dataset_meta_changed(sender, instance, **kwargs):
+    invalidate_snapshots([DATASETS_KEY])
+    if isinstance(instance, biomaterialMeta):
+        datasets = Dataset.objects.filter(bioMeta=instance)
+    else:
+        datasets = Dataset.objects.filter(sop=instance)
+    invalidate_studies(datasets.values_list('study_id', flat=True))
+
+def dataset_meta_links_changed(sender, instance, action, reverse, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if reverse: # an ontology term linked to many datasets
+        invalidate_snapshots()
+    else:
+        dataset_meta_changed(sender, instance)
+
+def project_changed(sender, instance, **kwargs):
+    invalidate_snapshots([PROJECTS_KEY])
+
+def viewer_changed(sender, instance, **kwargs):
+    invalidate_snapshots([studies_key(instance.pk)])
+
+def ontology_changed(sender, instance, **kwargs):
+    invalidate_snapshots() # labels appear in every listing
+
+for model, handler in [
+        (Study, study_changed),
+        (Article, article_changed),
+        (Author, author_changed),
+        (Institute, institute_changed),
+        (Contributor, contributor_changed),
+        (get_user_model(), user_changed),
+        (Dataset, dataset_changed),
+        (Loom, loom_changed),
+        (biomaterialMeta, dataset_meta_changed),
+        (sopMeta, dataset_meta_changed),
+        (Project, project_changed),
+        (Viewer, viewer_changed),
+    ]:
+    post_save.connect(handler, sender=model, dispatch_uid='catalogue_save_%s' % model._meta.label)
+    pre_delete.connect(handler, sender=model, dispatch_uid='catalogue_delete_%s' % model._meta.label)
+
+STUDY_LINKS = {getattr(Study, field).through: field for field in ['article', 'viewer', 'contributor']}
+for through, field in STUDY_LINKS.items():
+    m2m_changed.connect(study_links_changed, sender=through, dispatch_uid='catalogue_study_%s' % field)
+m2m_changed.connect(article_authors_changed, sender=Article.author.through, dispatch_uid='catalogue_article_author')
+m2m_changed.connect(author_affiliations_changed, sender=Author.affiliation.through, dispatch_uid='catalogue_author_affiliation')
+m2m_changed.connect(dataset_contributors_changed, sender=Dataset.contributor.through, dispatch_uid='catalogue_dataset_contributor')
+m2m_changed.connect(user_groups_changed, sender=get_user_model().groups.through, dispatch_uid='catalogue_user_groups')
+for model, fields in [
+        (biomaterialMeta, ['tissue', 'organ', 'species', 'developmentStage']),
+        (sopMeta, ['omics', 'resolution', 'technology', 'experimentalDesign', 'molecule_applied']),
+    ]:
+    for field in fields:
+        m2m_changed.connect(dataset_meta_links_changed, sender=getattr(model, field).through, dispatch_uid='catalogue_%s_%s' % (model._meta.label, field))
+
+for model in apps.get_app_config('ontologies').get_models():
+    post_save.connect(ontology_changed, sender=model, dispatch_uid='catalogue_save_%s' % model._meta.label)
+    pre_delete.connect(ontology_changed, sender=model, dispatch_uid='catalogue_delete_%s' % model._meta.label)
@@ -1,3 +1,233 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+import pytest
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from scilicium_django_react.datasets.models import Dataset, biomaterialMeta, sopMeta
+from scilicium_django_react.ontologies.models import Species, Tissue
+from scilicium_django_react.studies.api.serializers import StudyPublicSerializer
+from scilicium_django_react.studies import catalogue
+from scilicium_django_react.studies.catalogue import (
+    DATASETS_KEY, PROJECTS_KEY, studies_key, get_snapshot, invalidate_snapshots, snapshot_response,
+)
+from scilicium_django_react.studies.models import (
+    Article, Author, CatalogueSnapshot, Contributor, Institute, Project, Study, Viewer,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def make_public_study(viewer, n):
+    study = Study.objects.create(title="Study %d" % n, status="PUBLIC")
+    study.viewer.add(viewer)
+    for i in range(2):
+        article = Article.objects.create(title="Article %d.%d" % (n, i), pmid=str(n * 10 + i), releaseDate=timezone.make_aware(datetime.datetime(2020 + i, 1, 1)))
+        article.author.add(Author.objects.create(fullName="Author %d.%d" % (n, i)))
+        study.article.add(article)
+        bio = biomaterialMeta.objects.create(name="Bio %d.%d" % (n, i), sex=["male"])
+        bio.tissue.add(Tissue.objects.create(ontologyLabel="Tissue %d" % i))
+        bio.species.add(Species.objects.create(ontologyLabel="Species %d" % i))
+        sop = sopMeta.objects.create(name="Sop %d.%d" % (n, i))
+        Dataset.objects.create(title="Dataset %d.%d" % (n, i), study=study, bioMeta=bio, sop=sop)
+    return study
+
+
+def public_studies_queries(viewer):
+    queryset = StudyPublicSerializer.setup_eager_loading(Study.objects.filter(status="PUBLIC", viewer=viewer))
+    with CaptureQueriesContext(connection) as context:
+        data = StudyPublicSerializer(queryset, many=True).data
+    return len(context.captured_queries), data
+
+
+class TestStudyPublicSerializer:
+    def test_query_count_does_not_grow_with_studies(self):
+        viewer = Viewer.objects.create(name="viewer", url="http://viewer")
+        make_public_study(viewer, 0)
+        queries_one, data = public_studies_queries(viewer)
+        assert len(data) == 1
+
+        for n in range(1, 5):
+            make_public_study(viewer, n)
+        queries_many, data = public_studies_queries(viewer)
+        assert len(data) == 5
+        assert queries_many == queries_one
+
+    def test_fields_are_deduplicated(self):
+        viewer = Viewer.objects.create(name="viewer", url="http://viewer")
+        make_public_study(viewer, 0)
+        _, data = public_studies_queries(viewer)
+        study = data[0]
+        assert study["tissues"] == ["Tissue 0", "Tissue 1"]
+        assert study["species"] == ["Species 0", "Species 1"]
+        assert study["gender"] == [["male"]]
+        assert sorted(study["pub_date"]) == [2020, 2021]
+        assert sorted(study["authors"]) == ["Author 0.0", "Author 0.1"]
+
+
+def is_stale(key):
+    return CatalogueSnapshot.objects.get(key=key).stale
+
+
+@pytest.fixture
+def viewer():
+    return Viewer.objects.create(name="viewer", url="http://viewer")
+
+
+class TestSnapshotResponse:
+    def test_if_none_match(self, viewer):
+        make_public_study(viewer, 0)
+        request = RequestFactory().get("/")
+        response = snapshot_response(request, studies_key(viewer.id))
+        assert response.status_code == 200
+
+        request = RequestFactory().get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        assert snapshot_response(request, studies_key(viewer.id)).status_code == 304
+
+        request = RequestFactory().get("/", HTTP_IF_NONE_MATCH='"outdated"')
+        assert snapshot_response(request, studies_key(viewer.id)).status_code == 200
+
+    def test_if_modified_since(self, viewer):
+        make_public_study(viewer, 0)
+        response = snapshot_response(RequestFactory().get("/"), studies_key(viewer.id))
+
+        request = RequestFactory().get("/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        assert snapshot_response(request, studies_key(viewer.id)).status_code == 304
+
+        earlier = http_date(CatalogueSnapshot.objects.get(key=studies_key(viewer.id)).updated_at.timestamp() - 60)
+        request = RequestFactory().get("/", HTTP_IF_MODIFIED_SINCE=earlier)
+        assert snapshot_response(request, studies_key(viewer.id)).status_code == 200
+
+    def test_if_none_match_takes_precedence(self, viewer):
+        make_public_study(viewer, 0)
+        response = snapshot_response(RequestFactory().get("/"), studies_key(viewer.id))
+        request = RequestFactory().get("/", HTTP_IF_NONE_MATCH='"outdated"', HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        assert snapshot_response(request, studies_key(viewer.id)).status_code == 200
+
+
+class TestGetSnapshot:
+    def test_rebuild_clears_stale(self, viewer):
+        make_public_study(viewer, 0)
+        get_snapshot(studies_key(viewer.id))
+        assert not is_stale(studies_key(viewer.id))
+
+    def test_invalidation_during_rebuild_keeps_stale(self, viewer, monkeypatch):
+        make_public_study(viewer, 0)
+        key = studies_key(viewer.id)
+        render = catalogue.render_snapshot
+
+        def render_and_invalidate(k):
+            content = render(k)
+            invalidate_snapshots([k]) # an edit committed while rendering
+            return content
+
+        monkeypatch.setattr(catalogue, "render_snapshot", render_and_invalidate)
+        get_snapshot(key)
+        assert is_stale(key)
+
+        monkeypatch.setattr(catalogue, "render_snapshot", render)
+        get_snapshot(key)
+        assert not is_stale(key)
+
+
+class TestSnapshotInvalidation:
+    def test_dataset_contributors(self, viewer):
+        study = make_public_study(viewer, 0)
+        dataset = study.dataset_of.first()
+        contributor = Contributor.objects.create(name="contributor", email="c@example.org")
+        get_snapshot(DATASETS_KEY), get_snapshot(studies_key(viewer.id))
+
+        dataset.contributor.add(contributor)
+        assert is_stale(DATASETS_KEY)
+        assert is_stale(studies_key(viewer.id))
+
+        get_snapshot(DATASETS_KEY), get_snapshot(studies_key(viewer.id))
+        contributor.contributor_dataset.remove(dataset)
+        assert is_stale(DATASETS_KEY)
+        assert is_stale(studies_key(viewer.id))
+
+    def test_contributor_save_and_delete(self, viewer):
+        study = make_public_study(viewer, 0)
+        contributor = Contributor.objects.create(name="contributor", email="c@example.org")
+        study.contributor.add(contributor)
+        get_snapshot(studies_key(viewer.id))
+
+        contributor.name = "renamed"
+        contributor.save()
+        assert is_stale(studies_key(viewer.id))
+
+        get_snapshot(studies_key(viewer.id))
+        contributor.delete()
+        assert is_stale(studies_key(viewer.id))
+
+    def test_institute_save_and_affiliations(self, viewer):
+        study = make_public_study(viewer, 0)
+        author = Author.objects.filter(write_by__study_from=study).first()
+        institute = Institute.objects.create(name="institute")
+        get_snapshot(studies_key(viewer.id))
+
+        author.affiliation.add(institute)
+        assert is_stale(studies_key(viewer.id))
+
+        get_snapshot(studies_key(viewer.id))
+        institute.name = "renamed"
+        institute.save()
+        assert is_stale(studies_key(viewer.id))
+
+        get_snapshot(studies_key(viewer.id))
+        institute.delete()
+        assert is_stale(studies_key(viewer.id))
+
+    def test_study_creator(self, viewer, user):
+        study = make_public_study(viewer, 0)
+        study.created_by = user
+        study.save()
+        get_snapshot(studies_key(viewer.id))
+
+        user.name = "renamed"
+        user.save()
+        assert is_stale(studies_key(viewer.id))
+
+    def test_project_creator(self, user):
+        Project.objects.create(title="Project", status="PUBLIC", created_by=user)
+        get_snapshot(PROJECTS_KEY)
+
+        user.name = "renamed"
+        user.save()
+        assert is_stale(PROJECTS_KEY)
+
+    def test_unrelated_user(self, viewer, user):
+        make_public_study(viewer, 0)
+        get_snapshot(studies_key(viewer.id)), get_snapshot(PROJECTS_KEY)
+
+        user.name = "renamed"
+        user.save()
+        assert not is_stale(studies_key(viewer.id))
+        assert not is_stale(PROJECTS_KEY)
+
+
+class TestPublicStudiesPages:
+    def test_facets_count_studies(self, viewer):
+        make_public_study(viewer, 0)
+        make_public_study(viewer, 1)
+        other = Viewer.objects.create(name="other", url="http://other")
+        make_public_study(other, 2)
+
+        response = APIClient().get(reverse("api:public_studies"), {"viewer": "viewer", "facets": "1", "tissue": "Tissue 0"})
+
+        assert response.status_code == 200
+        assert len(response.data["results"]) == 2
+        # both studies have a dataset of each tissue
+        assert response.data["facets"]["tissue"] == [{"label": "Tissue 0", "count": 2}, {"label": "Tissue 1", "count": 2}]
+
+    def test_sparse_fields(self, viewer):
+        make_public_study(viewer, 0)
+
+        response = APIClient().get(reverse("api:public_studies"), {"viewer": "viewer", "fields": "title"})
+
+        assert response.data["results"] == [{"title": "Study 0"}]
@@ -0,0 +1,82 @@
+import json
+import struct
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+from scilicium_django_react.utils.tracing import traced
+
+CONTENT_TYPE = 'application/octet-stream'
+ALIGNMENT = 8
+
+def _buffer_dtype(arr):
+    '''
+    Little-endian typed array type used on the wire for a numpy array, None if not numeric
+    '''
+    if arr.dtype.kind == 'f':
+        return np.dtype('<f4')
+    if arr.dtype.kind in ('i','u'):
+        return np.dtype('<i4') if arr.size == 0 or (arr.min() >= -2**31 and arr.max() < 2**31) else np.dtype('<f8')
+    if arr.dtype.kind == 'b':
+        return np.dtype('u1')
+    return None
+
+def _extract(obj, buffers):
+    '''
+    Replace numeric arrays of a figure dictionary by {"$buffer": i} references
+    '''
+    if isinstance(obj, dict):
+        return {k: _extract(v, buffers) for k,v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_extract(v, buffers) for v in obj]
+    if isinstance(obj, np.ndarray) and obj.ndim == 1:
+        dtype = _buffer_dtype(obj)
+        if dtype is not None:
+            buffers.append(np.ascontiguousarray(obj, dtype=dtype))
+            return {'$buffer': len(buffers) - 1}
+    return obj
+
+@traced('serialize')
+def encode_binary_figure(fig, meta=None):
+    '''
+    Encode a Plotly figure as a JSON header followed by raw typed arrays
+
+    Layout:
+        uint32 little-endian length of the JSON header
+        JSON header (utf-8), padded with spaces to an 8 bytes boundary
+        concatenated array buffers, each starting on an 8 bytes boundary
+
+    The header holds the figure with every numeric 1D array replaced by
+    {"$buffer": i}, the list of buffers ({"dtype", "offset", "length"},
+    offsets relative to the end of the header) and the optional meta dict.
+    Browsers can wrap each buffer in a Float32Array/Int32Array without
+    parsing numbers.
+
+    Params
+    ------
+    fig: Plotly figure or figure dictionary
+    meta: dict
+        Extra JSON data sent with the figure
+
+    Return
+    ------
+    bytes
+    '''
+    if hasattr(fig, 'to_plotly_json'):
+        fig = fig.to_plotly_json()
+    buffers = []
+    figure = _extract(fig, buffers)
+    descriptors = []
+    offset = 0
+    chunks = []
+    for arr in buffers:
+        descriptors.append({'dtype': arr.dtype.name, 'offset': offset, 'length': len(arr)})
+        chunks.append(memoryview(arr).cast('B'))
+        offset += arr.nbytes
+        padding = -offset % ALIGNMENT
+        if padding:
+            chunks.append(b'\0' * padding)
+            offset += padding
+    header = json.dumps({'figure': figure, 'buffers': descriptors, 'meta': meta or {}}, cls=PlotlyJSONEncoder).encode('utf-8')
+    header += b' ' * (-(len(header) + 4) % ALIGNMENT)
+    return b''.join([struct.pack('<I', len(header)), header] + chunks)
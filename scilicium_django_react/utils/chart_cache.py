@@ -0,0 +1,127 @@
+import json
+import zlib
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from scilicium_django_react.utils.loom_pool import file_version
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU
+from scilicium_django_react.utils.tracing import traced
+
+DEFAULT_TIMEOUT = 24 * 3600
+DEFAULT_MAX_ITEM_BYTES = 8 * 1024 * 1024
+DEFAULT_LOCAL_BYTES = 64 * 1024 * 1024
+
+_local = None
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def local_cache():
+    '''
+    In-process tier of the chart cache, bounded by the size of the compressed responses
+    '''
+    global _local
+    if _local is None:
+        _local = ByteBudgetLRU(_setting('CHART_CACHE_LOCAL_BYTES', DEFAULT_LOCAL_BYTES))
+    return _local
+
+def shared_cache():
+    return caches[_setting('CHART_CACHE_ALIAS', 'default')]
+
+def _generation_key(loom_id):
+    return 'chart-generation:%s' % loom_id
+
+def loom_generation(loom_id):
+    '''
+    Counter bumped every time a Loom is saved, part of every chart cache key
+    '''
+    return shared_cache().get(_generation_key(loom_id), 0)
+
+def invalidate_chart_cache(loom_id):
+    '''
+    Make every cached chart of a Loom unreachable
+    '''
+    key = _generation_key(loom_id)
+    cache = shared_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError: # evicted in between
+        cache.set(key, 1, timeout=None)
+
+def _normalize(obj):
+    '''
+    Canonical form of a chart request: filter values are sets, so their order is
+    dropped, except for Symbol whose order is the order of the plotted genes
+    '''
+    obj = dict(obj)
+    filters = obj.get('filters')
+    if isinstance(filters, dict):
+        filters = dict(filters)
+        for axis in ('ca','ra'):
+            if isinstance(filters.get(axis), dict):
+                filters[axis] = {k: sorted(map(str, v)) if isinstance(v, list) and k != 'Symbol' else v for k,v in filters[axis].items()}
+        obj['filters'] = filters
+    return obj
+
+def chart_cache_key(loom,request_data):
+    '''
+    Content-addressed key of a chart request
+
+    Params
+    ------
+    loom: Loom
+        Loom the chart is computed from
+    request_data: dict
+        Chart request (id, style, attrs, symbols, filters...)
+
+    Return
+    ------
+    str
+    '''
+    content = {
+        'request': _normalize(request_data),
+        'loom': loom.id,
+        'version': list(file_version(loom.file.path)),
+        'generation': loom_generation(loom.id),
+    }
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return 'chart:' + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+@traced('cache')
+def get_cached_chart(key):
+    '''
+    Cached chart response, None on cache miss
+    '''
+    item = local_cache().get(key)
+    if item is None:
+        item = shared_cache().get(key)
+        if item is not None:
+            local_cache().set(key, item, len(item[1]))
+    if item is None:
+        return None
+    content_type, compressed = item
+    response = HttpResponse(zlib.decompress(compressed), content_type=content_type)
+    response['X-Chart-Cache'] = 'hit'
+    return response
+
+@traced('cache')
+def store_chart(key,response):
+    '''
+    Cache a successful chart response, compressed
+
+    Responses larger than CHART_CACHE_MAX_ITEM_BYTES once compressed are
+    not cached; the local tier evicts least recently used responses by size.
+    '''
+    if response.status_code != 200 or response.streaming:
+        return
+    compressed = zlib.compress(response.content, 6)
+    if len(compressed) > _setting('CHART_CACHE_MAX_ITEM_BYTES', DEFAULT_MAX_ITEM_BYTES):
+        return
+    item = (response['Content-Type'], compressed)
+    local_cache().set(key, item, len(compressed))
+    shared_cache().set(key, item, timeout=_setting('CHART_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    response['X-Chart-Cache'] = 'miss'
@@ -0,0 +1,109 @@
+import numpy as np
+
+from scilicium_django_react.utils.tracing import traced
+
+DENSITY_GRID = 100 # number of bins along each axis
+DENSITY_PADDING = 0.05 # margin around the points, fraction of their range
+
+def _extent(v, padding):
+    if len(v) == 0:
+        return -1.0, 1.0
+    vmin, vmax = float(np.min(v)), float(np.max(v))
+    margin = (vmax - vmin) * padding or 1.0
+    return vmin - margin, vmax + margin
+
+def _gaussian_kernel(sigma, size):
+    '''
+    Gaussian kernel in frequency space for a real FFT of the given padded size
+    '''
+    fy = np.fft.fftfreq(size[0])[:, None]
+    fx = np.fft.rfftfreq(size[1])[None, :]
+    return np.exp(-2 * np.pi ** 2 * ((sigma[0] * fy) ** 2 + (sigma[1] * fx) ** 2))
+
+class DensityGrid:
+    '''
+    Fixed grid over a point cloud, densities of any subset or weighting of the points
+
+    Every point is assigned to its bin once; a density is then one bincount
+    over the bin ids followed by a Gaussian smoothing done as a product in
+    Fourier space. The size of a density only depends on the grid.
+
+    Params
+    ------
+    x, y : arrays
+        Point coordinates
+    size : int
+        Number of bins along each axis
+    padding : float
+        Margin around the points, fraction of their range
+    '''
+    def __init__(self, x, y, size=DENSITY_GRID, padding=DENSITY_PADDING):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.size = int(size)
+        self.xrange = _extent(x, padding)
+        self.yrange = _extent(y, padding)
+        self.dx = (self.xrange[1] - self.xrange[0]) / self.size
+        self.dy = (self.yrange[1] - self.yrange[0]) / self.size
+        ix = np.clip(((x - self.xrange[0]) / self.dx).astype(np.int64), 0, self.size - 1)
+        iy = np.clip(((y - self.yrange[0]) / self.dy).astype(np.int64), 0, self.size - 1)
+        self.bins = iy * self.size + ix # row major, z[y][x] as Plotly expects
+        self.sigma = self._bandwidth(x, y)
+
+    def _bandwidth(self, x, y):
+        '''
+        Scott's rule bandwidth, in bins along (y, x)
+        '''
+        n = len(x)
+        if n < 2:
+            return (1.0, 1.0)
+        factor = n ** (-1. / 6)
+        return (max(np.std(y) * factor / self.dy, 0.5), max(np.std(x) * factor / self.dx, 0.5))
+
+    @property
+    def x(self):
+        return self.xrange[0] + (np.arange(self.size) + 0.5) * self.dx
+
+    @property
+    def y(self):
+        return self.yrange[0] + (np.arange(self.size) + 0.5) * self.dy
+
+    def smooth(self, hist):
+        '''
+        Gaussian smoothing of one or several (..., size, size) histograms
+
+        Histograms are zero padded by three standard deviations so that the
+        circular convolution does not wrap mass around the edges.
+        '''
+        pad = [int(np.ceil(3 * s)) for s in self.sigma]
+        shape = (self.size + pad[0], self.size + pad[1])
+        spectrum = np.fft.rfft2(hist, s=shape) * _gaussian_kernel(self.sigma, shape)
+        smoothed = np.fft.irfft2(spectrum, s=shape)[..., :self.size, :self.size]
+        return np.maximum(smoothed, 0) # round-off below zero in empty regions
+
+    def histogram(self, idx=None, weights=None):
+        '''
+        Binned counts, or sums of weights, of the points (subset idx if given)
+        '''
+        bins = self.bins if idx is None else self.bins[idx]
+        hist = np.bincount(bins, weights=weights, minlength=self.size * self.size)
+        return hist.reshape(self.size, self.size)
+
+    @traced('aggregate')
+    def density(self, idx=None, weights=None):
+        '''
+        Smoothed histogram of the points, float32 (size, size) array
+        '''
+        return self.smooth(self.histogram(idx, weights)).astype(np.float32)
+
+    @traced('aggregate')
+    def group_densities(self, codes, ngroups, idx=None):
+        '''
+        Densities of every group of points, (ngroups, size, size) float32 array
+
+        One bincount over (group, bin) pairs and one batched FFT.
+        '''
+        bins = self.bins if idx is None else self.bins[idx]
+        ncells = self.size * self.size
+        hist = np.bincount(np.asarray(codes, dtype=np.int64) * ncells + bins, minlength=ngroups * ncells)
+        return self.smooth(hist.reshape(ngroups, self.size, self.size)).astype(np.float32)
@@ -0,0 +1,104 @@
+import json
+import uuid
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from scilicium_django_react.utils.tracing import traced
+
+class RawJSON:
+    '''
+    Already encoded JSON document, spliced as is into API responses
+    '''
+    def __init__(self, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.content = content
+
+    def __len__(self):
+        return len(self.content)
+
+    def loads(self):
+        return json.loads(self.content)
+
+def plotly_validate():
+    return getattr(settings, 'PLOTLY_VALIDATE', False)
+
+_template = None
+
+def default_template():
+    '''
+    Default Plotly template as a dictionary, set on figures built without graph objects
+    '''
+    global _template
+    if _template is None:
+        _template = pio.templates[pio.templates.default].to_plotly_json()
+    return _template
+
+def figure_json(fig):
+    '''
+    Encode a Plotly figure (graph object or dictionary) once, as JSON bytes
+
+    Dictionaries are only validated against the Plotly schema when
+    PLOTLY_VALIDATE is set (debug and test settings).
+
+    Params
+    ------
+    fig: Plotly figure or figure dictionary
+
+    Return
+    ------
+    RawJSON
+    '''
+    validate = plotly_validate()
+    if isinstance(fig, dict) and validate:
+        fig = go.Figure(fig)
+    return RawJSON(pio.to_json(fig, validate=validate, pretty=False, remove_uids=True))
+
+@traced('serialize')
+def figure_output(fig,returnjson=True):
+    '''
+    Output of the figure builders: encoded JSON, or a Plotly figure object
+    '''
+    if returnjson:
+        return figure_json(fig)
+    if isinstance(fig, dict):
+        return go.Figure(fig)
+    return fig
+
+class _RawJSONEncoder(JSONEncoder):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.raw = dict()
+
+    def default(self, obj):
+        if isinstance(obj, RawJSON):
+            token = uuid.uuid4().hex
+            self.raw['"' + token + '"'] = obj.content
+            return token
+        return super().default(obj)
+
+@traced('serialize')
+def raw_json_response(data,status=200):
+    '''
+    JSON response whose RawJSON values are written without being parsed again
+
+    Params
+    ------
+    data: dict
+        Response data, may contain RawJSON values
+    status: int
+        HTTP status
+
+    Return
+    ------
+    HttpResponse
+    '''
+    encoder = _RawJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    content = encoder.encode(data).encode('utf-8')
+    for token,raw in encoder.raw.items():
+        content = content.replace(token.encode('utf-8'), raw, 1)
+    return HttpResponse(content, content_type='application/json', status=status)
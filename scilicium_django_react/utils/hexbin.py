@@ -0,0 +1,152 @@
+import math
+
+import numpy as np
+
+from scilicium_django_react.utils.tracing import traced
+
+HEXBIN_GRIDSIZE = 20
+HEXBIN_AGGREGATES = ('count', 'mean', 'sum')
+
+# unit hexagon, scaled by (sx, sy/3) around each bin center
+_HEXAGON = np.array([[.5, -.5], [.5, .5], [0., 1.], [-.5, .5], [-.5, -.5], [0., -1.]])
+
+def _nonsingular(vmin, vmax, expander=0.1):
+    '''
+    Widen a degenerate [vmin, vmax] range
+    '''
+    if not (np.isfinite(vmin) and np.isfinite(vmax)):
+        return -expander, expander
+    if vmax - vmin <= 1e-12 * max(abs(vmin), abs(vmax), 1):
+        if vmin == 0:
+            return -expander, expander
+        return vmin - expander * abs(vmin), vmax + expander * abs(vmax)
+    return vmin, vmax
+
+class HexBins:
+    '''
+    Non-empty hexagonal bins of a point cloud
+
+    Attributes
+    ------
+    centers: (k, 2) array of bin centers
+    counts: number of points in each bin
+    values: per-bin aggregate of the point values, None when only counting
+    sx, sy: size of the hexagon lattice
+    '''
+    def __init__(self, centers, counts, values, sx, sy):
+        self.centers = centers
+        self.counts = counts
+        self.values = values
+        self.sx = sx
+        self.sy = sy
+
+    def __len__(self):
+        return len(self.counts)
+
+    def vertices(self):
+        '''
+        (k, 6, 2) array of the hexagon corners
+        '''
+        return self.centers[:, None, :] + _HEXAGON[None, :, :] * [self.sx, self.sy / 3]
+
+    def paths(self):
+        '''
+        SVG paths of the hexagons, one per bin
+        '''
+        vertices = np.round(self.vertices(), 6).tolist()
+        return ['M' + 'L'.join('%r,%r' % (vx, vy) for vx, vy in hexagon) + 'Z' for hexagon in vertices]
+
+@traced('aggregate')
+def hexbin(x, y, gridsize=HEXBIN_GRIDSIZE, values=None, agg='mean'):
+    '''
+    Hexagonal binning of a point cloud, vectorized
+
+    Same lattice as matplotlib hexbin: gridsize hexagons along x, and
+    gridsize / sqrt(3) along y, on two interleaved rectangular lattices.
+    Each point goes to the closest center of either lattice.
+
+    Params
+    ------
+    x, y : arrays
+        Point coordinates
+    gridsize : int
+        Number of hexagons along the x axis
+    values : array or None
+        Value of each point, aggregated per bin
+    agg : str
+        'mean' or 'sum' of the values in each bin, or 'count' to ignore them
+
+    Return
+    ------
+    HexBins, empty bins dropped
+    '''
+    if agg not in HEXBIN_AGGREGATES:
+        raise Exception(f'{agg} is not a valid hexbin aggregate')
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    nx = max(int(gridsize), 1)
+    ny = max(int(nx / math.sqrt(3)), 1)
+    if len(x):
+        xmin, xmax = _nonsingular(np.min(x), np.max(x))
+        ymin, ymax = _nonsingular(np.min(y), np.max(y))
+    else:
+        xmin, xmax = _nonsingular(0, 0)
+        ymin, ymax = _nonsingular(0, 0)
+    padding = 1e-9 * (xmax - xmin) # avoid round-off at the edges
+    xmin -= padding
+    xmax += padding
+    sx = (xmax - xmin) / nx
+    sy = (ymax - ymin) / ny
+
+    px = (x - xmin) / sx
+    py = (y - ymin) / sy
+    ix1 = np.round(px).astype(np.int64)
+    iy1 = np.round(py).astype(np.int64)
+    ix2 = np.floor(px).astype(np.int64)
+    iy2 = np.floor(py).astype(np.int64)
+    nx1, ny1 = nx + 1, ny + 1
+    n1 = nx1 * ny1
+    d1 = (px - ix1) ** 2 + 3.0 * (py - iy1) ** 2
+    d2 = (px - ix2 - 0.5) ** 2 + 3.0 * (py - iy2 - 0.5) ** 2
+    first = d1 < d2
+    bins = np.where(first, ix1 * ny1 + iy1, n1 + ix2 * ny + iy2)
+    inside = np.where(first,
+        (ix1 >= 0) & (ix1 < nx1) & (iy1 >= 0) & (iy1 < ny1),
+        (ix2 >= 0) & (ix2 < nx) & (iy2 >= 0) & (iy2 < ny))
+    bins = bins[inside]
+
+    nbins = n1 + nx * ny
+    counts = np.bincount(bins, minlength=nbins)
+    keep = np.flatnonzero(counts)
+
+    centers = np.empty((len(keep), 2))
+    lattice1 = keep < n1
+    k1 = keep[lattice1]
+    k2 = keep[~lattice1] - n1
+    centers[lattice1, 0] = k1 // ny1
+    centers[lattice1, 1] = k1 % ny1
+    centers[~lattice1, 0] = k2 // ny + 0.5
+    centers[~lattice1, 1] = k2 % ny + 0.5
+    centers *= [sx, sy]
+    centers += [xmin, ymin]
+
+    aggregate = None
+    if values is not None and agg != 'count':
+        values = np.asarray(values, dtype=np.float64)[inside]
+        aggregate = np.bincount(bins, weights=values, minlength=nbins)[keep]
+        if agg == 'mean':
+            aggregate /= counts[keep]
+    return HexBins(centers, counts[keep], aggregate, sx, sy)
+
+def rgb_colors(cmap, values, vmin=None, vmax=None):
+    '''
+    Plotly rgb() colors of values through a matplotlib colormap, linear normalization
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return []
+    vmin = np.min(values) if vmin is None else vmin
+    vmax = np.max(values) if vmax is None else vmax
+    norm = (values - vmin) / ((vmax - vmin) or 1)
+    rgb = (cmap(np.clip(norm, 0, 1))[:, :3] * 255).astype(np.uint8)
+    return ['rgb(%d, %d, %d)' % tuple(c) for c in rgb.tolist()]
@@ -0,0 +1,301 @@
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import loompy
+import numpy as np
+from rest_framework.renderers import JSONRenderer
+
+BENCH_SIZES = [10000, 100000, 1000000]
+BENCH_GENES = 2000
+BENCH_CLASSES = {'cluster': 20, 'sample': 8, 'condition': 2}
+BENCH_REDUCTIONS = ['umap', 'tsne']
+BENCH_DENSITY = 0.05 # fraction of non zero expression values
+BENCH_CHROMOSOMES = 22
+GENERATE_CHUNK_CELLS = 10000
+
+# filter combinations of the chart requests, filled from the loom classes
+BENCH_FILTERS = {
+    'none': lambda c: {'ca': {}, 'ra': {}},
+    'one_class': lambda c: {'ca': {c[0][0]: [c[0][1][0]]}, 'ra': {}},
+    'two_classes': lambda c: {'ca': {c[0][0]: c[0][1][:3], c[1][0]: [c[1][1][0]]}, 'ra': {}},
+    'chromosome': lambda c: {'ca': {}, 'ra': {'Chromosome': ['1', '2']}},
+    'class_chromosome': lambda c: {'ca': {c[0][0]: [c[0][1][0]]}, 'ra': {'Chromosome': ['1']}},
+}
+
+def synthetic_loom(loom_path,ncells,ngenes=BENCH_GENES,classes=BENCH_CLASSES,reductions=BENCH_REDUCTIONS,density=BENCH_DENSITY,seed=0):
+    '''
+    Write a random loom file shaped like the uploaded ones
+
+    Cells are spread over gaussian blobs in every reduction, one blob per
+    value of the first class, and the matrix is written in chunks of
+    GENERATE_CHUNK_CELLS cells so large files fit in memory.
+
+    Params
+    ------
+    loom_path : str
+        Path of the file to create
+    ncells : int
+        Number of cells (columns)
+    ngenes : int
+        Number of genes (rows)
+    classes : dict
+        Categorical column attribute -> number of values
+    reductions : list
+        Names of the 2D reductions, stored as <name>_1, <name>_2 columns
+    density : float
+        Fraction of non zero expression values
+    seed : int
+        Random seed, the same arguments give the same file
+
+    Return
+    ------
+    str path of the loom file
+    '''
+    rng = np.random.RandomState(seed)
+    symbols = np.array(['Gene%d' % i for i in range(ngenes)])
+    chromosomes = np.array([str(1 + i % BENCH_CHROMOSOMES) for i in range(ngenes)])
+    gene_scale = rng.gamma(1.0, 2.0, ngenes).astype(np.float32) # a few highly variable genes
+    names = list(classes)
+    centers = {r: rng.uniform(-30, 30, (classes[names[0]], 2)) for r in reductions}
+    file_attrs = {
+        'reductions': json.dumps({r: ['%s_1' % r, '%s_2' % r] for r in reductions}),
+        'Classes': ','.join(names),
+        'most_variable_genes': ','.join(symbols[:10]),
+    }
+    if os.path.exists(loom_path):
+        os.remove(loom_path)
+    with loompy.new(loom_path) as ds:
+        for start in range(0, ncells, GENERATE_CHUNK_CELLS):
+            n = min(GENERATE_CHUNK_CELLS, ncells - start)
+            codes = {key: rng.randint(0, k, n) for key,k in classes.items()}
+            col_attrs = {key: np.char.add(key, codes[key].astype(str)) for key in names}
+            blob = codes[names[0]]
+            for r in reductions:
+                xy = centers[r][blob] + rng.normal(0, 3, (n, 2))
+                col_attrs['%s_1' % r] = xy[:, 0]
+                col_attrs['%s_2' % r] = xy[:, 1]
+            matrix = np.zeros((ngenes, n), dtype=np.float32)
+            positions = np.unique(rng.randint(0, ngenes * n, rng.binomial(ngenes * n, density))) # about density of the values, drawn without a dense mask
+            matrix.flat[positions] = rng.random_sample(len(positions))
+            matrix *= gene_scale[:, None]
+            ds.add_columns({'': matrix}, col_attrs, row_attrs={'Symbol': symbols, 'Chromosome': chromosomes})
+        for key,value in file_attrs.items():
+            ds.attrs[key] = value
+    return loom_path
+
+def bench_loom_model(loom_path):
+    '''
+    Stand-in for a Loom instance, with the attributes the views and ingest steps read
+    '''
+    from scilicium_django_react.utils.loom_reader import extract_attr_keys, get_classes
+    keys = extract_attr_keys(loom_path)
+    return SimpleNamespace(
+        id=loom_path, name=os.path.basename(loom_path), file=SimpleNamespace(path=loom_path),
+        classes=get_classes(loom_path), colEntity=keys['col_attr_keys'], rowEntity=keys['row_attr_keys'])
+
+def prepare_loom(loom):
+    '''
+    Build the sidecars of a benchmark loom with the ingest steps
+
+    Return
+    ------
+    dict step -> seconds
+    '''
+    from scilicium_django_react.datasets.tasks import INGEST_STEPS
+    timings = dict()
+    for name,step in INGEST_STEPS:
+        start = time.perf_counter()
+        step(loom)
+        timings[name] = time.perf_counter() - start
+    return timings
+
+def response_size(response):
+    '''
+    Number of bytes a view response sends
+    '''
+    if hasattr(response, 'data') and getattr(response, 'accepted_renderer', None) is None:
+        return len(JSONRenderer().render(response.data))
+    return len(response.content)
+
+def chart_cases(loom):
+    '''
+    Chart requests of GetLoomPlots, one per style and variant
+
+    Return
+    ------
+    list of (case name, post data without filters)
+    '''
+    from scilicium_django_react.utils.loom_reader import get_ra
+    attribute = loom.classes[0]
+    symbols = list(get_ra(loom.file.path, key='Symbol')[:5])
+    base = {'id': loom.id, 'attrs': attribute}
+    return [
+        ('scatter_class', dict(base, style='scatter')),
+        ('scatter_gene', dict(base, style='scatter', attrs=symbols[0])),
+        ('scatter_binary', dict(base, style='scatter', format='binary')),
+        ('scatter_lod', dict(base, style='scatter', max_points=50000)),
+        ('hexbin_count', dict(base, style='hexbin')),
+        ('hexbin_gene', dict(base, style='hexbin', symbol=symbols[0], gridsize=60)),
+        ('dot', dict(base, style='dot', symbols=symbols)),
+        ('violin', dict(base, style='violin', symbols=symbols)),
+        ('density_class', dict(base, style='density')),
+        ('density_genes', dict(base, style='density', symbols=symbols[:2])),
+        ('pie', dict(base, style='pie')),
+        ('bar', dict(base, style='bar')),
+        ('genes_menu', dict(base, style='pie', menu='genes')),
+    ]
+
+def bench_cases(loom):
+    '''
+    Every timed call of a benchmark loom
+
+    Return
+    ------
+    list of (view, case, filter name, callable returning a response)
+    '''
+    from scilicium_django_react.datasets.api.views import GetLoomPlots, GetLoomStatistics, GetLoomGenes
+    from scilicium_django_react.utils.loom_reader import get_ca
+    values = [(c, sorted(set(get_ca(loom.file.path, key=c, unique=True)))) for c in loom.classes[:2]]
+    filters = {name: make(values) for name,make in BENCH_FILTERS.items()}
+    plots, statistics_view, genes = GetLoomPlots(), GetLoomStatistics(), GetLoomGenes()
+    cases = []
+    for filter_name,filt in filters.items():
+        for case,post_data in chart_cases(loom):
+            post_data = dict(post_data, filters=json.loads(json.dumps(filt)))
+            cases.append(('plots', case, filter_name, lambda p=post_data: plots.render_chart(json.loads(json.dumps(p)), loom)))
+        post_data = {'id': loom.id, 'filters': filt}
+        cases.append(('statistics', 'shape', filter_name, lambda p=post_data: statistics_view.compute(json.loads(json.dumps(p)), loom)))
+        for method in ['first', 'variance', 'custom']:
+            post_data = {'id': loom.id, 'filters': filt, 'method': method}
+            cases.append(('genes', method, filter_name, lambda p=post_data: genes.compute(json.loads(json.dumps(p)), loom)))
+    return cases
+
+def time_case(fn,repeat):
+    '''
+    Run a case repeat times
+
+    The first run is reported apart: it fills the attribute and sidecar
+    caches that later runs hit. Peak memory is the largest Python heap
+    high-water mark (numpy buffers included) seen by tracemalloc.
+
+    Return
+    ------
+    dict
+    '''
+    seconds = []
+    peak = 0
+    size = None
+    error = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            response = fn()
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+            tracemalloc.stop()
+            break
+        seconds.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        size = response_size(response)
+        if getattr(response, 'status_code', 200) >= 400:
+            error = 'HTTP %d' % response.status_code
+            break
+    result = {'seconds': seconds, 'peak_bytes': peak, 'response_bytes': size, 'error': error}
+    if seconds:
+        warm = seconds[1:] or seconds
+        result.update(first=seconds[0], median=statistics.median(warm), min=min(warm))
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, cwd=os.path.dirname(__file__)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(workdir,sizes=BENCH_SIZES,ngenes=BENCH_GENES,classes=BENCH_CLASSES,reductions=BENCH_REDUCTIONS,repeat=3,ingest=True,select=None,log=None):
+    '''
+    Generate synthetic looms and time every chart, statistics and gene request on them
+
+    Params
+    ------
+    workdir : str
+        Directory of the generated loom files, reused when they already exist
+    sizes : list
+        Number of cells of each loom
+    repeat : int
+        Runs of each case
+    ingest : bool
+        Build the sidecars first, otherwise the views read the loom files only
+    select : str or None
+        Only run the cases whose 'view/case/filter' name contains it
+    log : callable or None
+        Progress messages
+
+    Return
+    ------
+    dict, JSON serializable
+    '''
+    log = log or (lambda msg: None)
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    looms = []
+    for ncells in sizes:
+        loom_path = os.path.join(workdir, 'bench_%d_%d.loom' % (ncells, ngenes))
+        if not os.path.exists(loom_path):
+            log('generating %s' % loom_path)
+            start = time.perf_counter()
+            synthetic_loom(loom_path, ncells, ngenes=ngenes, classes=classes, reductions=reductions)
+            log('generated in %.1fs' % (time.perf_counter() - start))
+        loom = bench_loom_model(loom_path)
+        ingest_timings = prepare_loom(loom) if ingest else {}
+        looms.append({'cells': ncells, 'genes': ngenes, 'path': loom_path, 'file_bytes': os.path.getsize(loom_path), 'ingest_seconds': ingest_timings})
+        for view,case,filter_name,fn in bench_cases(loom):
+            name = '%s/%s/%s' % (view, case, filter_name)
+            if select and select not in name:
+                continue
+            result = time_case(fn, repeat)
+            result.update(cells=ncells, view=view, case=case, filter=filter_name, name=name)
+            results.append(result)
+            log('%9d %-40s %s' % (ncells, name, result['error'] or '%.3fs' % result['median']))
+    return {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'loompy': loompy.__version__,
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'ingest': ingest,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'looms': looms,
+        'results': results,
+    }
+
+def compare_results(baseline,current,threshold=0.1):
+    '''
+    Median time ratios of the cases present in two benchmark results
+
+    Return
+    ------
+    list of (cells, name, baseline median, current median, ratio, flag) with flag
+    'slower' or 'faster' beyond threshold
+    '''
+    before = {(r['cells'], r['name']): r for r in baseline['results'] if r.get('median') is not None}
+    rows = []
+    for r in current['results']:
+        old = before.get((r['cells'], r['name']))
+        if old is None or r.get('median') is None:
+            continue
+        ratio = r['median'] / old['median'] if old['median'] else float('inf')
+        flag = 'slower' if ratio > 1 + threshold else 'faster' if ratio < 1 - threshold else ''
+        rows.append((r['cells'], r['name'], old['median'], r['median'], ratio, flag))
+    return rows
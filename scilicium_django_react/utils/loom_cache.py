@@ -0,0 +1,310 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from scilicium_django_react.utils.loom_pool import file_version, loom_connection
+from scilicium_django_react.utils.loom_sidecar import save_array, save_json, load_array, load_json
+
+DEFAULT_ATTRIBUTE_CACHE_BYTES = 256 * 1024 * 1024
+MAPPED_ATTRIBUTE_COST = 64 * 1024 # budget charged for a memory-mapped attribute, bounds the number of maps kept
+
+def object_nbytes(arr):
+    '''
+    Approximate memory held by a numpy array, including python objects it references
+
+    Params
+    ------
+    arr : numpy array
+
+    Return
+    ------
+    int (bytes)
+    '''
+    if isinstance(arr, np.memmap): # pages belong to the page cache, shared by every process
+        return 0
+    nbytes = arr.nbytes
+    if arr.dtype == object:
+        nbytes += sum(sys.getsizeof(x) for x in arr)
+    return nbytes
+
+class CachedAttribute:
+    '''
+    Decoded loom attribute kept in memory
+
+    String attributes with repeated values are stored as integer codes plus
+    the sorted array of their distinct values (categories), other attributes
+    are stored as is. Stored arrays are read-only.
+
+    values() decodes a new array at each call: readers over many entries
+    should use factorize() codes, or decode only the indices they need.
+    '''
+    def __init__(self, values):
+        values = np.asarray(values)
+        self.codes = None
+        self.categories = None
+        self.array = None
+        if values.dtype.kind in ('O','U','S') and values.ndim == 1:
+            categories, codes = np.unique(values, return_inverse=True)
+            if len(categories) < len(values): # worth encoding
+                self.categories = categories
+                self.codes = codes.astype(np.min_scalar_type(max(len(categories)-1,0)))
+        if self.codes is None:
+            self.array = values
+        self._freeze()
+
+    @classmethod
+    def from_arrays(cls, codes=None, categories=None, array=None):
+        '''
+        Attribute already decoded, e.g. memory-mapped from its sidecar
+        '''
+        attr = cls.__new__(cls)
+        attr.codes, attr.categories, attr.array = codes, categories, array
+        attr._freeze()
+        return attr
+
+    def _freeze(self):
+        for arr in (self.codes, self.categories, self.array):
+            if arr is not None and arr.flags.writeable:
+                arr.flags.writeable = False
+        self.nbytes = sum(object_nbytes(arr) for arr in (self.codes, self.categories, self.array) if arr is not None)
+
+    @property
+    def is_categorical(self):
+        return self.codes is not None
+
+    def __len__(self):
+        if self.is_categorical:
+            return len(self.codes)
+        return len(self.array)
+
+    def values(self, idx=None):
+        '''
+        Decoded attribute values, optionally restricted to some indices
+        '''
+        if self.is_categorical:
+            codes = self.codes if idx is None else self.codes[idx]
+            return self.categories[codes]
+        if idx is None:
+            return self.array
+        return self.array[idx]
+
+    def factorize(self, idx=None):
+        '''
+        Integer codes and sorted distinct values of the attribute, optionally restricted to some indices
+
+        Codes always refer to the full list of distinct values, so values
+        absent from idx keep their position.
+        '''
+        if self.is_categorical:
+            codes = self.codes if idx is None else self.codes[idx]
+            return codes, self.categories
+        categories, codes = np.unique(self.array, return_inverse=True)
+        if idx is not None:
+            codes = codes[idx]
+        return codes, categories
+
+    def unique(self, idx=None):
+        '''
+        Sorted distinct attribute values, optionally restricted to some indices
+        '''
+        if self.is_categorical:
+            if idx is None:
+                return self.categories
+            return self.categories[np.unique(self.codes[idx])]
+        return np.unique(self.values(idx))
+
+def _attribute_name(axis, key):
+    return 'attribute_%s_%s' % (axis, hashlib.sha1(key.encode('utf-8')).hexdigest()[:12])
+
+def _storable(arr):
+    # .npy files are written without pickle, python strings become fixed width unicode
+    if arr.dtype == object:
+        return np.asarray(arr.tolist(), dtype=str)
+    return arr
+
+def build_attribute_sidecar(loom_path, axis, key):
+    '''
+    Store a decoded attribute in the sidecar of a loom file
+
+    Processes then memory-map it read-only instead of each decoding its own copy.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    axis : str
+        'ca' or 'ra'
+    key : str
+        Attribute name
+
+    Return
+    ------
+    int, bytes written
+    '''
+    with loom_connection(loom_path) as df:
+        attrs = df.ca if axis == 'ca' else df.ra
+        attr = CachedAttribute(attrs[key])
+    name = _attribute_name(axis, key)
+    parts = {'codes': attr.codes, 'categories': attr.categories, 'array': attr.array}
+    nbytes = 0
+    for part,arr in parts.items():
+        if arr is not None:
+            arr = _storable(arr)
+            save_array(loom_path, name + '_' + part, arr)
+            nbytes += arr.nbytes
+    save_json(loom_path, name, {'axis': axis, 'key': key, 'parts': [p for p,arr in parts.items() if arr is not None]}) # written last, marks the attribute as complete
+    attribute_cache.invalidate(loom_path)
+    return nbytes
+
+def load_attribute_sidecar(loom_path, axis, key):
+    '''
+    Memory-mapped attribute from the sidecar of a loom file
+
+    Return
+    ------
+    CachedAttribute or None if it was not built for the current file version
+    '''
+    name = _attribute_name(axis, key)
+    d = load_json(loom_path, name)
+    if d is None or d['axis'] != axis or d['key'] != key:
+        return None
+    parts = {part: load_array(loom_path, name + '_' + part) for part in d['parts']}
+    if any(arr is None for arr in parts.values()):
+        return None
+    return CachedAttribute.from_arrays(**parts)
+
+class ByteBudgetLRU:
+    '''
+    Thread-safe LRU mapping bounded by the total size of its values
+
+    Each item is stored with its size in bytes; least recently used items are
+    dropped once the total exceeds max_bytes. Items larger than the whole
+    budget are not stored.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict() # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, nbytes):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            if nbytes > self.max_bytes:
+                return
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, size) = self._items.popitem(last=False) # oldest first
+                self.nbytes -= size
+
+    def discard(self, match):
+        '''
+        Drop every item whose key satisfies match(key)
+        '''
+        with self._lock:
+            for key in [k for k in self._items if match(k)]:
+                self.nbytes -= self._items.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+class AttributeCache:
+    '''
+    Process-wide, memory-bounded cache of decoded loom attributes
+
+    Entries are keyed by loom path, file version, axis ('ca' or 'ra') and
+    attribute name, so a replaced file never serves stale values.
+    '''
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._lru = None
+        self._lock = threading.Lock()
+
+    @property
+    def lru(self):
+        if self._lru is None:
+            with self._lock:
+                if self._lru is None:
+                    max_bytes = self._max_bytes
+                    if max_bytes is None:
+                        max_bytes = getattr(settings, 'LOOM_ATTRIBUTE_CACHE_BYTES', DEFAULT_ATTRIBUTE_CACHE_BYTES)
+                    self._lru = ByteBudgetLRU(max_bytes)
+        return self._lru
+
+    def get(self, loom_path, axis, key):
+        '''
+        Get a cached attribute, reading it from the loom file if needed
+
+        Params
+        ------
+        loom_path : str
+            Path to a .loom file
+        axis : str
+            'ca' for column attributes, 'ra' for row attributes
+        key : str
+            Attribute name
+
+        Return
+        ------
+        CachedAttribute
+        '''
+        path = os.path.abspath(loom_path)
+        cache_key = (path, file_version(path), axis, key)
+        attr = self.lru.get(cache_key)
+        if attr is None:
+            attr = load_attribute_sidecar(path, axis, key) # shared memory map when the ingest stored it
+            if attr is None:
+                with loom_connection(path) as df:
+                    attrs = df.ca if axis == 'ca' else df.ra
+                    attr = CachedAttribute(attrs[key])
+            self.lru.set(cache_key, attr, max(attr.nbytes, MAPPED_ATTRIBUTE_COST))
+        return attr
+
+    def invalidate(self, loom_path=None):
+        '''
+        Drop cached attributes of a loom file, or of every file if no path is given
+        '''
+        if loom_path is None:
+            self.lru.clear()
+        else:
+            path = os.path.abspath(loom_path)
+            self.lru.discard(lambda k: k[0] == path)
+
+attribute_cache = AttributeCache()
+
+def cached_attribute(loom_path, axis, key):
+    '''
+    Shortcut to attribute_cache.get
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    axis : str
+        'ca' or 'ra'
+    key : str
+        Attribute name
+
+    Return
+    ------
+    CachedAttribute
+    '''
+    return attribute_cache.get(loom_path, axis, key)
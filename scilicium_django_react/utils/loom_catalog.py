@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+from scilicium_django_react.utils.loom_pool import file_version
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU, cached_attribute
+from scilicium_django_react.utils.loom_sidecar import save_json, load_json
+from scilicium_django_react.utils.loom_reader import extract_attr_keys
+
+ROW_CATALOGS = ['Chromosome','Symbol'] # row attributes offered as filters when present
+
+_catalogs = ByteBudgetLRU(256) # (path, version) -> AttributeCatalogs
+
+def catalog_version(loom_path):
+    '''
+    Version stamp of the catalogs of a loom file, changes with the file
+    '''
+    return '%d:%d' % file_version(loom_path)
+
+def attribute_catalog(loom_path,axis,key):
+    '''
+    Distinct values of an attribute and their number of occurrences
+
+    Return
+    ------
+    dict with 'values' and 'counts' lists, values sorted
+    '''
+    codes, categories = cached_attribute(loom_path,axis,key).factorize()
+    counts = np.bincount(codes, minlength=len(categories))
+    return {'values': np.asarray(categories).tolist(), 'counts': counts.tolist()}
+
+class AttributeCatalogs:
+    '''
+    Unique-value catalogs of the attributes of a loom file
+
+    Catalogs missing from the sidecar (attributes that became classes after
+    the ingest) are computed on first access and kept in memory.
+    '''
+    def __init__(self, loom_path, version, catalogs):
+        self.path = loom_path
+        self.version = version
+        self.catalogs = catalogs # 'axis/key' -> catalog
+
+    def get(self, axis, key):
+        name = axis + '/' + key
+        catalog = self.catalogs.get(name)
+        if catalog is None:
+            catalog = self.catalogs[name] = attribute_catalog(self.path,axis,key)
+        return catalog
+
+    def has(self, axis, key):
+        return (axis + '/' + key) in self.catalogs
+
+def build_catalogs(loom_path,classes):
+    '''
+    Compute and store the catalogs of the classes and of the row attributes used as filters
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    classes : list
+        Column attributes
+    '''
+    path = os.path.abspath(loom_path)
+    version = catalog_version(path)
+    keys = extract_attr_keys(path)
+    catalogs = dict()
+    for col in classes:
+        if col in keys['col_attr_keys']:
+            catalogs['ca/' + col] = attribute_catalog(path,'ca',col)
+    for row in ROW_CATALOGS:
+        if row in keys['row_attr_keys']:
+            catalogs['ra/' + row] = attribute_catalog(path,'ra',row)
+    save_json(path, 'catalogs', {'version': version, 'catalogs': catalogs})
+    _catalogs.discard(lambda k: k[0] == path)
+    return AttributeCatalogs(path, version, catalogs)
+
+def get_catalogs(loom_path):
+    '''
+    Catalogs of a loom file, from its sidecar or computed when it is missing
+
+    Return
+    ------
+    AttributeCatalogs
+    '''
+    path = os.path.abspath(loom_path)
+    version = catalog_version(path)
+    key = (path, version)
+    catalogs = _catalogs.get(key)
+    if catalogs is None:
+        d = load_json(path, 'catalogs')
+        if d is not None and d.get('version') == version:
+            catalogs = AttributeCatalogs(path, version, d['catalogs'])
+        else: # ingest not run yet, catalogs are computed as they are asked for
+            keys = extract_attr_keys(path)
+            catalogs = AttributeCatalogs(path, version, dict())
+            for row in ROW_CATALOGS:
+                if row in keys['row_attr_keys']:
+                    catalogs.get('ra', row)
+        _catalogs.set(key, catalogs, 1) # same content whatever its source, for a given file version
+    return catalogs
+
+def invalidate_catalogs(loom_path):
+    path = os.path.abspath(loom_path)
+    _catalogs.discard(lambda k: k[0] == path)
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from scilicium_django_react.utils.loom_pool import file_version, loom_connection
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU, cached_attribute
+from scilicium_django_react.utils.loom_sidecar import save_array, save_json, load_array, load_json
+from scilicium_django_react.utils.tracing import traced
+
+EMBEDDING_DTYPE = np.float32
+
+_embeddings = ByteBudgetLRU(1024) # memory maps, their pages are shared through the page cache
+
+def _embedding_name(reduction):
+    return 'embedding_' + hashlib.sha1(reduction.encode('utf-8')).hexdigest()[:12]
+
+def _reductions(loom_path):
+    with loom_connection(loom_path) as df:
+        return json.loads(df.attrs['reductions'])
+
+def build_embeddings(loom_path):
+    '''
+    Store every reduction of a loom file as a float32 cells x dimensions array
+
+    Arrays are column-major, so the coordinates of each axis are contiguous
+    in the file and in its memory map.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    list of reductions stored
+    '''
+    stored = []
+    for reduction,labels in _reductions(loom_path).items():
+        with loom_connection(loom_path) as df:
+            ncells = df.shape[1]
+            if not all(label in df.ca.keys() for label in labels):
+                continue
+            coords = np.empty((ncells, len(labels)), dtype=EMBEDDING_DTYPE, order='F')
+            for i,label in enumerate(labels):
+                coords[:, i] = df.ca[label]
+        name = _embedding_name(reduction)
+        save_array(loom_path, name, coords)
+        save_json(loom_path, name, {'reduction': reduction, 'labels': list(labels)}) # written last, marks the embedding as complete
+        stored.append(reduction)
+    invalidate_embeddings(loom_path)
+    return stored
+
+def get_embedding(loom_path,reduction):
+    '''
+    Memory-mapped coordinates of a reduction
+
+    Return
+    ------
+    Read-only cells x dimensions float32 array, or None if it was not built for the current file version
+    '''
+    path = os.path.abspath(loom_path)
+    key = (path, file_version(path), reduction)
+    coords = _embeddings.get(key)
+    if coords is None:
+        name = _embedding_name(reduction)
+        d = load_json(path, name)
+        if d is not None and d['reduction'] == reduction:
+            coords = load_array(path, name)
+        if coords is not None: # missing ones are looked up again, the ingest task may still be running
+            _embeddings.set(key, coords, 1)
+    return coords
+
+def invalidate_embeddings(loom_path):
+    path = os.path.abspath(loom_path)
+    _embeddings.discard(lambda k: k[0] == path)
+
+@traced('read')
+def reduction_coordinates(loom_path,reduction,labels,cidx_filter=None):
+    '''
+    X and Y coordinates of the (filtered) cells in a reduction
+
+    Without a filter the coordinates are views of the memory map, no copy
+    is made. Looms ingested before embeddings existed are read from their
+    column attributes.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    reduction : str
+        Name of the reduction
+    labels : list
+        Column attributes of the reduction, used when there is no embedding
+    cidx_filter : array or None
+        Column indices filter
+
+    Return
+    ------
+    Tuple of x, y arrays
+    '''
+    coords = get_embedding(loom_path, reduction)
+    filtered = isinstance(cidx_filter, np.ndarray)
+    if coords is None:
+        attrs = [cached_attribute(loom_path, 'ca', label) for label in labels[:2]]
+        return tuple(a.values(cidx_filter) if filtered else a.values() for a in attrs)
+    if filtered:
+        return coords[cidx_filter, 0], coords[cidx_filter, 1]
+    return coords[:, 0], coords[:, 1]
@@ -0,0 +1,297 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+
+from scilicium_django_react.utils.loom_pool import file_version, loom_connection
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU, cached_attribute, object_nbytes
+from scilicium_django_react.utils.loom_sidecar import save_json, load_json, save_array, load_array
+
+ALIAS_KEYS = ['Ensembl_ID','Entrez_ID'] # row attributes usable as gene aliases
+INDEX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_BITMAP_CATEGORIES = 1024 # attributes with more distinct values are filtered without bitmaps
+
+_symbol_indexes = ByteBudgetLRU(INDEX_CACHE_BYTES)
+_bitmaps = ByteBudgetLRU(INDEX_CACHE_BYTES)
+
+def _usable(value):
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value) # numeric Entrez ids
+    value = str(value)
+    if value in ('', 'nan', 'None'):
+        return None
+    return value
+
+class SymbolIndex:
+    '''
+    Hash map from gene symbol (or alias) to row index of a loom file
+
+    Lookups try, in order, the exact symbol, the case-insensitive symbol and
+    the Ensembl/Entrez identifiers. When a name appears on several rows,
+    the first row wins.
+    '''
+    def __init__(self, exact, lower, aliases):
+        self.exact = exact
+        self.lower = lower
+        self.aliases = aliases
+
+    @classmethod
+    def from_arrays(cls, symbols, aliases=()):
+        '''
+        Build the index from the Symbol row attribute and optional alias attributes
+        '''
+        exact = dict()
+        lower = dict()
+        for i,s in enumerate(symbols):
+            s = _usable(s)
+            if s is None:
+                continue
+            exact.setdefault(s, i)
+            lower.setdefault(s.lower(), i)
+        alias_map = dict()
+        for values in aliases:
+            for i,a in enumerate(values):
+                a = _usable(a)
+                if a is not None:
+                    alias_map.setdefault(a.lower(), i)
+        return cls(exact, lower, alias_map)
+
+    @classmethod
+    def from_json(cls, d):
+        return cls(d['exact'], d['lower'], d['aliases'])
+
+    def to_json(self):
+        return {'exact': self.exact, 'lower': self.lower, 'aliases': self.aliases}
+
+    @property
+    def nbytes(self):
+        return sum(sys.getsizeof(d) + 100 * len(d) for d in (self.exact, self.lower, self.aliases))
+
+    def lookup(self, symbol):
+        '''
+        Row index of a symbol or alias, None if unknown
+        '''
+        symbol = str(symbol)
+        idx = self.exact.get(symbol)
+        if idx is None:
+            key = symbol.lower()
+            idx = self.lower.get(key)
+            if idx is None:
+                idx = self.aliases.get(key)
+        return idx
+
+    def lookup_many(self, symbols):
+        '''
+        Row indices of a list of symbols, None for unknown ones
+        '''
+        return [self.lookup(s) for s in symbols]
+
+    def __contains__(self, symbol):
+        return self.lookup(symbol) is not None
+
+def build_symbol_index(loom_path):
+    '''
+    Build the symbol index of a loom file and store it in its sidecar
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    SymbolIndex or None if the loom has no Symbol row attribute
+    '''
+    with loom_connection(loom_path) as df:
+        if 'Symbol' not in df.ra:
+            return None
+        symbols = df.ra['Symbol']
+        aliases = [df.ra[key] for key in ALIAS_KEYS if key in df.ra]
+    index = SymbolIndex.from_arrays(symbols, aliases)
+    save_json(loom_path, 'symbol_index', index.to_json())
+    return index
+
+def get_symbol_index(loom_path):
+    '''
+    Symbol index of a loom file, loaded from its sidecar or built on first access
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    SymbolIndex
+    '''
+    path = os.path.abspath(loom_path)
+    key = (path, file_version(path))
+    index = _symbol_indexes.get(key)
+    if index is None:
+        d = load_json(path, 'symbol_index')
+        if d is not None:
+            index = SymbolIndex.from_json(d)
+        else:
+            index = build_symbol_index(path)
+            if index is None:
+                raise Exception('loom file has no Symbol row attribute')
+        _symbol_indexes.set(key, index, index.nbytes)
+    return index
+
+def invalidate_symbol_index(loom_path):
+    path = os.path.abspath(loom_path)
+    _symbol_indexes.discard(lambda k: k[0] == path)
+
+def symbol_rows(loom_path,symbols):
+    '''
+    Row indices of a list of gene symbols
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    symbols : list
+        Gene symbols or Ensembl/Entrez identifiers
+
+    Return
+    ------
+    numpy array of row indices, in the order of symbols
+    '''
+    index = get_symbol_index(loom_path)
+    rows = index.lookup_many(symbols)
+    for s,i in zip(symbols, rows):
+        if i is None:
+            raise Exception(f'{s} is not a valid symbol name')
+    return np.asarray(rows, dtype=np.int64)
+
+class AttributeBitmaps:
+    '''
+    Inverted index from the values of a categorical attribute to packed bitmaps
+
+    Row i of bitmaps is the np.packbits mask of the cells (or genes) whose
+    attribute equals categories[i].
+    '''
+    def __init__(self, categories, bitmaps, length):
+        self.positions = {c: i for i,c in enumerate(categories)}
+        self.bitmaps = bitmaps
+        self.length = length
+
+    @property
+    def nbytes(self):
+        # packed masks (nothing for a memory map) and the category lookup
+        return object_nbytes(self.bitmaps) + sys.getsizeof(self.positions) + 100 * len(self.positions)
+
+    def mask(self, values):
+        '''
+        Packed mask of the entries whose attribute is one of values (bitwise OR of their bitmaps)
+        '''
+        rows = [self.positions[v] for v in values if isinstance(v, str) and v in self.positions]
+        if len(rows) == 0:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[sorted(rows)], axis=0)
+
+def _bitmap_name(axis,key):
+    return 'bitmaps_' + axis + '_' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+def build_attribute_bitmaps(loom_path,axis,key):
+    '''
+    Build the bitmaps of a categorical attribute and store them in the loom sidecar
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    axis : str
+        'ca' or 'ra'
+    key : str
+        Attribute name
+
+    Return
+    ------
+    AttributeBitmaps or None if the attribute is not categorical or has too many values
+    '''
+    attr = cached_attribute(loom_path,axis,key)
+    if not attr.is_categorical or len(attr.categories) > MAX_BITMAP_CATEGORIES:
+        return None
+    if not all(isinstance(c, str) for c in attr.categories):
+        return None
+    n = len(attr)
+    bitmaps = np.empty((len(attr.categories), (n + 7) // 8), dtype=np.uint8)
+    for i in range(len(attr.categories)):
+        bitmaps[i] = np.packbits(attr.codes == i)
+    name = _bitmap_name(axis,key)
+    save_array(loom_path, name, bitmaps)
+    save_json(loom_path, name, {'key': key, 'categories': [str(c) for c in attr.categories], 'length': n})
+    return AttributeBitmaps(list(attr.categories), bitmaps, n)
+
+def get_attribute_bitmaps(loom_path,axis,key):
+    '''
+    Bitmaps of an attribute, memory-mapped from the loom sidecar or built on first access
+
+    Return
+    ------
+    AttributeBitmaps or None if the attribute can not be indexed
+    '''
+    path = os.path.abspath(loom_path)
+    cache_key = (path, file_version(path), axis, key)
+    bitmaps = _bitmaps.get(cache_key, False)
+    if bitmaps is False:
+        name = _bitmap_name(axis,key)
+        d = load_json(path, name)
+        arr = load_array(path, name) if d is not None and d['key'] == key else None
+        if arr is not None:
+            bitmaps = AttributeBitmaps(d['categories'], arr, d['length'])
+        else:
+            bitmaps = build_attribute_bitmaps(path,axis,key)
+        _bitmaps.set(cache_key, bitmaps, bitmaps.nbytes if bitmaps is not None else 0)
+    return bitmaps
+
+def invalidate_bitmaps(loom_path):
+    path = os.path.abspath(loom_path)
+    _bitmaps.discard(lambda k: k[0] == path)
+
+def attribute_mask(loom_path,axis,key,values):
+    '''
+    Packed mask of the entries whose attribute is one of values
+
+    Uses the attribute bitmaps when available, np.isin otherwise.
+    '''
+    if isinstance(values, str):
+        values = [values]
+    bitmaps = get_attribute_bitmaps(loom_path,axis,key)
+    if bitmaps is not None:
+        return bitmaps.mask(values)
+    attr = cached_attribute(loom_path,axis,key)
+    if attr.is_categorical: # match the categories, then look up each code
+        return np.packbits(np.isin(attr.categories, values)[attr.codes])
+    return np.packbits(np.isin(attr.values(), values))
+
+def resolve_filter(loom_path,axis,conditions):
+    '''
+    Indices matching every condition of a filter
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    axis : str
+        'ca' or 'ra'
+    conditions : dict
+        Attribute name -> list of accepted values. Values are OR-ed within
+        an attribute, attributes are AND-ed.
+
+    Return
+    ------
+    Sorted numpy array of indices
+    '''
+    if len(conditions) == 0:
+        raise Exception('empty filter')
+    mask = None
+    length = None
+    for key,values in conditions.items():
+        if length is None:
+            length = len(cached_attribute(loom_path,axis,key))
+        m = attribute_mask(loom_path,axis,key,values)
+        mask = m if mask is None else np.bitwise_and(mask, m)
+    return np.flatnonzero(np.unpackbits(mask, count=length))
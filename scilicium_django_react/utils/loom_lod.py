@@ -0,0 +1,90 @@
+import numpy as np
+
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU
+
+LOD_SEED = 0
+LOD_GRID = 64 # viewport is split in LOD_GRID x LOD_GRID bins to keep sparse regions visible
+
+_ranks = ByteBudgetLRU(256 * 1024 * 1024)
+
+def lod_rank(n, seed=LOD_SEED):
+    '''
+    Deterministic sampling priority of n cells
+
+    Cells with a lower rank are kept first. Ranks only depend on n, so the
+    same cells stay visible across requests and zoom levels.
+
+    Params
+    ------
+    n : int
+        Number of cells
+    seed : int
+        Seed of the permutation
+
+    Return
+    ------
+    Read-only array of ranks
+    '''
+    key = (n, seed)
+    rank = _ranks.get(key)
+    if rank is None:
+        perm = np.random.RandomState(seed).permutation(n)
+        rank = np.empty(n, dtype=np.int64)
+        rank[perm] = np.arange(n)
+        rank.flags.writeable = False
+        _ranks.set(key, rank, rank.nbytes)
+    return rank
+
+def select_points(x, y, rank, viewport=None, max_points=None, grid=LOD_GRID):
+    '''
+    Indices of the points to draw at a given zoom level
+
+    Points outside the viewport are dropped. If more than max_points remain,
+    the viewport is binned on a grid and every non-empty bin keeps a share of
+    the budget proportional to its population (at least one point), taking
+    the points of lowest rank. Dense regions are thinned while sparse ones stay
+    visible.
+
+    Params
+    ------
+    x, y : arrays
+        Point coordinates
+    rank : array
+        Sampling priority of each point (see lod_rank)
+    viewport : list or None
+        [xmin, xmax, ymin, ymax] bounding box, whole data if None
+    max_points : int or None
+        Maximum number of points returned, no limit if None or 0
+    grid : int
+        Number of bins along each axis
+
+    Return
+    ------
+    Sorted array of indices, total number of points in the viewport
+    '''
+    if viewport is not None:
+        x0, x1, y0, y1 = [float(v) for v in viewport]
+        idx = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+    else:
+        idx = np.arange(len(x))
+        if len(x):
+            x0, x1, y0, y1 = np.min(x), np.max(x), np.min(y), np.max(y)
+    total = len(idx)
+    if not max_points or total <= max_points:
+        return idx, total
+
+    xs, ys = x[idx], y[idx]
+    gx = np.clip(((xs - x0) / ((x1 - x0) or 1) * grid).astype(np.int64), 0, grid - 1)
+    gy = np.clip(((ys - y0) / ((y1 - y0) or 1) * grid).astype(np.int64), 0, grid - 1)
+    bins = gx * grid + gy
+    counts = np.bincount(bins, minlength=grid * grid)
+    quota = np.where(counts > 0, np.maximum(1, counts * max_points // total), 0)
+
+    order = np.lexsort((rank[idx], bins)) # by bin, then priority
+    sorted_bins = bins[order]
+    starts = np.cumsum(counts) - counts
+    position = np.arange(total) - starts[sorted_bins] # position of each point within its bin
+    keep = order[position < quota[sorted_bins]]
+    if len(keep) > max_points: # minimum of one point per bin may overshoot the budget
+        keep = keep[np.argsort(rank[idx][keep], kind='stable')[:max_points]]
+    return idx[np.sort(keep)], total
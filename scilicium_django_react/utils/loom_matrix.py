@@ -0,0 +1,420 @@
+import os
+
+import numpy as np
+from django.conf import settings
+
+from scilicium_django_react.utils.loom_pool import file_version, loom_connection
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU
+from scilicium_django_react.utils.loom_sidecar import ensure_sidecar_dir, save_json, load_json, save_array, load_array
+from scilicium_django_react.utils.plot_executor import check_cancelled
+from scilicium_django_react.utils.tracing import traced
+
+DEFAULT_BUILD_BYTES = 256 * 1024 * 1024 # memory of the gene blocks read at once when building the sidecar
+BUILD_ENTRY_BYTES = 48 # index arrays built per non-zero value of a block (nonzero, lexsort, positions...)
+VARIANCE_CHUNK_ROWS = 256 # genes read at once when computing variances
+VARIANCE_CHUNK_COLS = 65536 # cells read at once when computing variances
+VARIANCE_CHUNK_NNZ = 4 * 1024 * 1024 # non-zero values gathered at once from the by-cell sidecar
+ARRAYS = ['csr_indptr','csr_indices','csr_data','csc_indptr','csc_indices','csc_data']
+
+_sidecars = ByteBudgetLRU(1024) # small python objects wrapping memory maps
+
+def expression_sidecar_enabled():
+    return getattr(settings, 'LOOM_EXPRESSION_SIDECAR', False)
+
+def build_bytes():
+    return getattr(settings, 'LOOM_EXPRESSION_BUILD_BYTES', DEFAULT_BUILD_BYTES)
+
+def _segments(indptr, idx):
+    '''
+    Positions of the stored values of the rows (or columns) idx of a compressed matrix
+
+    Return
+    ------
+    positions, and for each position the rank of its row (or column) in idx
+    '''
+    starts = np.asarray(indptr[idx], dtype=np.int64)
+    lengths = np.asarray(indptr[np.asarray(idx) + 1], dtype=np.int64) - starts
+    total = int(lengths.sum())
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.cumsum(lengths) - lengths # first output position of each segment
+    positions = np.arange(total, dtype=np.int64) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+    return positions, owner
+
+def _nnz_chunks(indptr, idx, max_nnz):
+    '''
+    Consecutive slices of idx whose rows (or columns) hold about max_nnz stored values each
+    '''
+    lengths = np.asarray(indptr[np.asarray(idx) + 1], dtype=np.int64) - np.asarray(indptr[idx], dtype=np.int64)
+    bounds = np.searchsorted(np.cumsum(lengths), np.arange(max_nnz, int(lengths.sum()), max_nnz), side='right')
+    edges = np.unique(np.concatenate([[0], bounds, [len(idx)]]))
+    return [slice(a, b) for a,b in zip(edges[:-1], edges[1:])]
+
+class _Subset:
+    '''
+    Output position of each index of a subset (cells or genes), looked up by binary search
+    '''
+    def __init__(self, idx):
+        idx = np.asarray(idx)
+        self.order = np.argsort(idx, kind='stable')
+        self.sorted = idx[self.order]
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def lookup(self, indices):
+        '''
+        Mask of the indices in the subset and their output positions
+        '''
+        if not len(self.sorted):
+            return np.zeros(len(indices), dtype=bool), np.empty(0, dtype=np.intp)
+        p = np.minimum(np.searchsorted(self.sorted, indices), len(self.sorted) - 1)
+        found = self.sorted[p] == indices
+        return found, self.order[p[found]]
+
+class ExpressionSidecar:
+    '''
+    Sparse copies of a loom main matrix, memory-mapped from the loom sidecar
+
+    CSR arrays give the non-zero values of each gene, CSC arrays the non-zero
+    values of each cell. Reads only gather the stored values of the requested
+    genes (or cells) that fall in the requested cells (or genes): the only
+    dense array allocated is the output, of the requested shape. Subsets must
+    not repeat an index.
+    '''
+    def __init__(self, shape, dtype, arrays):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def row(self, i, cidx=None):
+        '''
+        Dense expression values of gene i, optionally restricted to cells cidx
+        '''
+        return self.rows([i], cidx)[0]
+
+    def rows(self, ridx, cidx=None):
+        '''
+        Dense genes x cells matrix of the genes ridx, optionally restricted to cells cidx
+        '''
+        positions, owner = _segments(self.csr_indptr, np.asarray(ridx))
+        cells = self.csr_indices[positions]
+        if cidx is None:
+            out = np.zeros((len(ridx), self.shape[1]), dtype=self.dtype)
+            out[owner, cells] = self.csr_data[positions]
+            return out
+        subset = _Subset(cidx)
+        found, columns = subset.lookup(cells)
+        out = np.zeros((len(ridx), len(subset)), dtype=self.dtype)
+        out[owner[found], columns] = self.csr_data[positions[found]]
+        return out
+
+    def columns(self, cidx, ridx=None):
+        '''
+        Dense genes x cells matrix of the cells cidx, optionally restricted to genes ridx
+        '''
+        positions, owner = _segments(self.csc_indptr, np.asarray(cidx))
+        genes = self.csc_indices[positions]
+        if ridx is None:
+            out = np.zeros((self.shape[0], len(cidx)), dtype=self.dtype)
+            out[genes, owner] = self.csc_data[positions]
+            return out
+        subset = _Subset(ridx)
+        found, rows = subset.lookup(genes)
+        out = np.zeros((len(subset), len(cidx)), dtype=self.dtype)
+        out[rows, owner[found]] = self.csc_data[positions[found]]
+        return out
+
+    def nnz(self, ridx=None, cidx=None):
+        '''
+        Number of stored values of the genes ridx (or of the cells cidx)
+        '''
+        if ridx is not None:
+            ridx = np.asarray(ridx)
+            return int((np.asarray(self.csr_indptr[ridx + 1]) - np.asarray(self.csr_indptr[ridx])).sum())
+        cidx = np.asarray(cidx)
+        return int((np.asarray(self.csc_indptr[cidx + 1]) - np.asarray(self.csc_indptr[cidx])).sum())
+
+def _build_chunks(ngenes, ncells, itemsize, budget, row_nnz=None):
+    '''
+    Ranges of genes read at once when building the sidecar, within a memory budget
+
+    A block costs its dense values and non-zero mask, plus the index arrays
+    built for its non-zero values once they are counted (row_nnz).
+    '''
+    dense = ncells * (itemsize + 1)
+    start = 0
+    while start < ngenes:
+        stop, used = start, 0
+        while stop < ngenes:
+            cost = dense + (int(row_nnz[stop]) * BUILD_ENTRY_BYTES if row_nnz is not None else 0)
+            if stop > start and used + cost > budget:
+                break
+            used += cost
+            stop += 1
+        yield start, stop
+        start = stop
+
+def build_expression_sidecar(loom_path, budget=None):
+    '''
+    Write CSR (by gene) and CSC (by cell) copies of the loom main matrix to its sidecar
+
+    The matrix is read twice by chunks of genes: once to count the non-zero
+    values of every gene and cell, once to fill the memory-mapped arrays.
+    Chunks are sized from the number of cells (and non-zero values) so a
+    block stays within the budget whatever the size of the loom.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    budget : int or None
+        Bytes of the blocks read at once, LOOM_EXPRESSION_BUILD_BYTES if None
+
+    Return
+    ------
+    ExpressionSidecar
+    '''
+    budget = build_bytes() if budget is None else budget
+    directory = ensure_sidecar_dir(loom_path)
+    with loom_connection(loom_path) as df:
+        ngenes, ncells = df.shape
+        dtype = df.layers[''].dtype
+        itemsize = np.dtype(dtype).itemsize
+        row_nnz = np.zeros(ngenes, dtype=np.int64)
+        col_nnz = np.zeros(ncells, dtype=np.int64)
+        for start, stop in _build_chunks(ngenes, ncells, itemsize, budget):
+            block = df[start:stop, :]
+            nz = block != 0
+            del block
+            row_nnz[start:stop] = nz.sum(axis=1)
+            col_nnz += nz.sum(axis=0)
+            del nz
+
+        csr_indptr = np.concatenate([[0], np.cumsum(row_nnz)])
+        csc_indptr = np.concatenate([[0], np.cumsum(col_nnz)])
+        nnz = int(csr_indptr[-1])
+        tmp = lambda name: os.path.join(directory, '.tmp_' + name + '.npy')
+        open_memmap = np.lib.format.open_memmap
+        csr_indices = open_memmap(tmp('csr_indices'), mode='w+', dtype=np.int32, shape=(nnz,))
+        csr_data = open_memmap(tmp('csr_data'), mode='w+', dtype=dtype, shape=(nnz,))
+        csc_indices = open_memmap(tmp('csc_indices'), mode='w+', dtype=np.int32, shape=(nnz,))
+        csc_data = open_memmap(tmp('csc_data'), mode='w+', dtype=dtype, shape=(nnz,))
+        fill = np.zeros(ncells, dtype=np.int64) # values already written for each cell
+
+        for start, stop in _build_chunks(ngenes, ncells, itemsize, budget, row_nnz):
+            block = df[start:stop, :]
+            rows, cols = np.nonzero(block) # sorted by gene, then cell
+            vals = block[rows, cols]
+            del block
+            a,b = csr_indptr[start], csr_indptr[stop]
+            csr_indices[a:b] = cols
+            csr_data[a:b] = vals
+            order = np.lexsort((rows, cols)) # sorted by cell, then gene
+            cols = cols[order]
+            counts = np.bincount(cols, minlength=ncells)
+            rank = np.arange(len(cols)) - np.repeat(np.cumsum(counts) - counts, counts)
+            positions = csc_indptr[cols] + fill[cols] + rank
+            csc_indices[positions] = rows[order] + start
+            csc_data[positions] = vals[order]
+            fill += counts
+
+    for arr in (csr_indices, csr_data, csc_indices, csc_data):
+        arr.flush()
+    del csr_indices, csr_data, csc_indices, csc_data
+    np.save(tmp('csr_indptr'), csr_indptr)
+    np.save(tmp('csc_indptr'), csc_indptr)
+    for name in ARRAYS:
+        os.replace(tmp(name), os.path.join(directory, name + '.npy'))
+    save_json(loom_path, 'expression', {'shape': [ngenes, ncells], 'dtype': np.dtype(dtype).str, 'nnz': nnz}) # marks the sidecar as complete
+    invalidate_expression_sidecar(loom_path)
+    return get_expression_sidecar(loom_path)
+
+def get_expression_sidecar(loom_path):
+    '''
+    Memory-mapped expression sidecar of a loom file
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    ExpressionSidecar or None if it was not built for the current file version
+    '''
+    path = os.path.abspath(loom_path)
+    key = (path, file_version(path))
+    sidecar = _sidecars.get(key)
+    if sidecar is None:
+        sidecar = None
+        d = load_json(path, 'expression')
+        if d is not None:
+            arrays = {name: load_array(path, name) for name in ARRAYS}
+            if all(arr is not None for arr in arrays.values()):
+                sidecar = ExpressionSidecar(d['shape'], d['dtype'], arrays)
+        if sidecar is not None: # not built yet, the ingest pipeline may write it from another process
+            _sidecars.set(key, sidecar, 1)
+    return sidecar
+
+def invalidate_expression_sidecar(loom_path):
+    path = os.path.abspath(loom_path)
+    _sidecars.discard(lambda k: k[0] == path)
+
+def _combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    '''
+    Merge two (count, mean, sum of squared deviations) accumulators (Chan et al.)
+    '''
+    n = n_a + n_b
+    if n == 0:
+        return n, mean_a, m2_a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta**2 * (n_a * n_b / n)
+    return n, mean, m2
+
+def _variance_block(loom_path, start, stop, rows, cidx, chunk_cols):
+    '''
+    Variances of the genes rows (absolute indices within [start, stop)) over the cells cidx
+
+    The genes are read by blocks of chunk_cols cells; per-block statistics are
+    merged with Welford/Chan accumulators so memory stays bounded.
+    '''
+    local = rows - start
+    n = 0
+    mean = np.zeros(len(rows))
+    m2 = np.zeros(len(rows))
+    with loom_connection(loom_path) as df:
+        ncells = df.shape[1]
+        for c in range(0, ncells, chunk_cols):
+            cstop = min(c + chunk_cols, ncells)
+            if cidx is not None:
+                cols = cidx[(cidx >= c) & (cidx < cstop)] - c
+                if len(cols) == 0:
+                    continue
+            block = df[start:stop, c:cstop][local].astype(np.float64)
+            if cidx is not None:
+                block = block[:, cols]
+            n_b = block.shape[1]
+            mean_b = block.mean(axis=1)
+            m2_b = ((block - mean_b[:, None])**2).sum(axis=1)
+            n, mean, m2 = _combine(n, mean, m2, n_b, mean_b, m2_b)
+    if n == 0:
+        return np.full(len(rows), np.nan)
+    return m2 / n
+
+def _sidecar_cell_variances(sidecar, ridx, cidx):
+    '''
+    Variances of the genes ridx over a subset of cells, from the values stored by cell (CSC)
+
+    Cheaper than the by-gene path when the cells hold fewer stored values
+    than the genes; cells are gathered by chunks of VARIANCE_CHUNK_NNZ values.
+    '''
+    ngenes = sidecar.shape[0]
+    sums = np.zeros(ngenes)
+    squares = np.zeros(ngenes)
+    for chunk in _nnz_chunks(sidecar.csc_indptr, cidx, VARIANCE_CHUNK_NNZ):
+        check_cancelled()
+        positions, _ = _segments(sidecar.csc_indptr, cidx[chunk])
+        genes = sidecar.csc_indices[positions]
+        vals = np.asarray(sidecar.csc_data[positions], dtype=np.float64)
+        sums += np.bincount(genes, weights=vals, minlength=ngenes)
+        squares += np.bincount(genes, weights=vals**2, minlength=ngenes)
+    n = len(cidx)
+    if n == 0:
+        return np.full(len(ridx), np.nan)
+    mean = sums[ridx] / n
+    return np.maximum(squares[ridx] / n - mean**2, 0)
+
+def _sidecar_variances(sidecar, ridx, cidx, chunk_rows):
+    '''
+    Variances computed from the non-zero values stored in the CSR sidecar
+    '''
+    ncells = sidecar.shape[1]
+    if cidx is None:
+        mask = None
+        n = ncells
+    else:
+        mask = np.zeros(ncells, dtype=bool)
+        mask[cidx] = True
+        n = len(cidx)
+    v = np.empty(len(ridx))
+    for start in range(0, len(ridx), chunk_rows):
+        rows = ridx[start:start+chunk_rows]
+        positions, owner = _segments(sidecar.csr_indptr, rows)
+        vals = np.asarray(sidecar.csr_data[positions], dtype=np.float64)
+        if mask is not None:
+            keep = mask[sidecar.csr_indices[positions]]
+            vals = vals[keep]
+            owner = owner[keep]
+        sums = np.bincount(owner, weights=vals, minlength=len(rows))
+        squares = np.bincount(owner, weights=vals**2, minlength=len(rows))
+        mean = sums / n if n else np.full(len(rows), np.nan)
+        v[start:start+len(rows)] = np.maximum(squares / n - mean**2, 0) if n else mean
+    return v
+
+@traced('aggregate')
+def gene_variances(loom_path, ridx_filter=None, cidx_filter=None, chunk_rows=VARIANCE_CHUNK_ROWS, chunk_cols=VARIANCE_CHUNK_COLS):
+    '''
+    Expression variance of every gene, computed by chunks
+
+    Chunks are computed in the calling thread: it runs in the plot executor
+    or in Celery prefork workers, where starting processes is not possible
+    or would fork a process with live threads.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    ridx_filter : array or None
+        Row indices of the genes to use
+    cidx_filter : array or None
+        Column indices of the cells to use
+    chunk_rows : int
+        Number of genes read at once
+    chunk_cols : int
+        Number of cells read at once
+
+    Return
+    ------
+    Array of variances, in the order of ridx_filter (or of the rows)
+    '''
+    ridx = np.sort(ridx_filter) if isinstance(ridx_filter, np.ndarray) else None
+    cidx = np.sort(cidx_filter) if isinstance(cidx_filter, np.ndarray) else None
+    sidecar = get_expression_sidecar(loom_path)
+    with loom_connection(loom_path) as df:
+        ngenes = df.shape[0]
+    rows_all = ridx if ridx is not None else np.arange(ngenes)
+    if sidecar is not None and cidx is not None and sidecar.nnz(cidx=cidx) < sidecar.nnz(ridx=rows_all):
+        v = _sidecar_cell_variances(sidecar, rows_all, cidx) # few cells: read them by cell
+    elif sidecar is not None:
+        v = _sidecar_variances(sidecar, rows_all, cidx, chunk_rows)
+    else:
+        tasks = []
+        for start in range(0, ngenes, chunk_rows):
+            stop = min(start + chunk_rows, ngenes)
+            lo, hi = np.searchsorted(rows_all, [start, stop])
+            if hi > lo:
+                tasks.append((start, stop, rows_all[lo:hi]))
+        parts = []
+        for start, stop, rows in tasks:
+            check_cancelled() # blocks are read serially, stop early if the request gave up
+            parts.append(_variance_block(loom_path, start, stop, rows, cidx, chunk_cols))
+        v = np.concatenate(parts) if parts else np.empty(0)
+    if ridx is not None: # back to the order of ridx_filter
+        v = v[np.searchsorted(ridx, ridx_filter)]
+    return v
+
+def build_variance_ranking(loom_path):
+    '''
+    Store the order of the genes by decreasing variance over every cell
+    '''
+    order = np.argsort(gene_variances(loom_path))[::-1]
+    save_array(loom_path, 'variance_order', order.astype(np.int64))
+    return order
+
+def get_variance_ranking(loom_path):
+    '''
+    Gene indices by decreasing variance over every cell, None if not built for the current file version
+    '''
+    return load_array(loom_path, 'variance_order')
@@ -0,0 +1,152 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import loompy
+from django.conf import settings
+
+DEFAULT_MAX_CONNECTIONS = 16
+
+def file_version(loom_path):
+    '''
+    Identify the current content of a loom file on disk
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    Tuple of (mtime in ns, size in bytes)
+    '''
+    stat = os.stat(loom_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+class PooledConnection:
+    '''
+    Read-only loom connection shared by every request of the process
+    '''
+    def __init__(self, loom_path, version):
+        self.path = loom_path
+        self.version = version
+        self.ds = loompy.connect(loom_path,'r')
+        self.users = 0 # number of callers currently holding the connection
+        self.stale = False # file replaced or evicted, close as soon as nobody uses it
+
+    def close(self):
+        try:
+            self.ds.close()
+        except Exception:
+            pass
+
+class LoomConnectionPool:
+    '''
+    Process-wide pool of read-only loom connections, keyed by path and file version
+
+    Connections are kept open between requests and reused as long as the file
+    mtime and size do not change. Least recently used idle connections are
+    closed once more than max_connections files are open.
+    '''
+    def __init__(self, max_connections=None):
+        self._max_connections = max_connections
+        self._entries = OrderedDict() # absolute path -> PooledConnection
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    @property
+    def max_connections(self):
+        if self._max_connections is None:
+            return getattr(settings, 'LOOM_MAX_OPEN_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)
+        return self._max_connections
+
+    def _check_fork(self):
+        # HDF5 handles must not be shared with a forked worker (gunicorn, celery prefork)
+        if self._pid != os.getpid():
+            self._entries = OrderedDict()
+            self._lock = threading.RLock()
+            self._pid = os.getpid()
+
+    def _discard(self, entry):
+        entry.stale = True
+        if entry.users == 0:
+            entry.close()
+
+    def _evict(self):
+        for path in list(self._entries.keys()): # oldest first
+            if len(self._entries) <= self.max_connections:
+                break
+            entry = self._entries[path]
+            if entry.users == 0:
+                del self._entries[path]
+                self._discard(entry)
+
+    def acquire(self, loom_path):
+        '''
+        Get a pooled connection for a loom file, opening it if needed
+
+        Every acquire must be followed by a release of the returned entry.
+        '''
+        self._check_fork()
+        path = os.path.abspath(loom_path)
+        version = file_version(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.version != version: # file replaced on disk
+                del self._entries[path]
+                self._discard(entry)
+                entry = None
+            if entry is None:
+                entry = PooledConnection(path,version)
+                self._entries[path] = entry
+            self._entries.move_to_end(path)
+            entry.users += 1
+            self._evict()
+            return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.stale and entry.users == 0:
+                entry.close()
+
+    @contextmanager
+    def connect(self, loom_path):
+        entry = self.acquire(loom_path)
+        try:
+            yield entry.ds
+        finally:
+            self.release(entry)
+
+    def invalidate(self, loom_path=None):
+        '''
+        Drop pooled connections of a loom file, or of every file if no path is given
+        '''
+        self._check_fork()
+        with self._lock:
+            if loom_path is None:
+                paths = list(self._entries.keys())
+            else:
+                paths = [os.path.abspath(loom_path)]
+            for path in paths:
+                entry = self._entries.pop(path, None)
+                if entry is not None:
+                    self._discard(entry)
+
+loom_pool = LoomConnectionPool()
+
+def loom_connection(loom_path):
+    '''
+    Context manager yielding a shared read-only connection to a loom file
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    loompy.LoomConnection (must not be closed by the caller)
+    '''
+    return loom_pool.connect(loom_path)
@@ -1,14 +1,25 @@
 import loompy
 import pandas as pd
-from matplotlib import pyplot as plt
+from matplotlib import cm
 import plotly.graph_objects as go
 import plotly.express as px
 import plotly.io as pio
 import numpy as np
 import json
-import time
 from copy import copy
 
+from scilicium_django_react.utils.loom_pool import loom_connection
+from scilicium_django_react.utils.loom_cache import cached_attribute
+from scilicium_django_react.utils.loom_index import get_symbol_index, symbol_rows, resolve_filter
+from scilicium_django_react.utils.loom_matrix import get_expression_sidecar, gene_variances, get_variance_ranking
+from scilicium_django_react.utils.loom_summary import get_group_summary, group_reduce
+from scilicium_django_react.utils.loom_lod import lod_rank, select_points
+from scilicium_django_react.utils.figure_json import figure_output, default_template
+from scilicium_django_react.utils.density import DensityGrid
+from scilicium_django_react.utils.hexbin import hexbin, rgb_colors, HEXBIN_GRIDSIZE
+from scilicium_django_react.utils.loom_embedding import reduction_coordinates
+from scilicium_django_react.utils.tracing import traced
+
 def get_available_reductions(loom_path):
     '''
     Return labels of available reduction as list
@@ -22,9 +33,8 @@ def get_available_reductions(loom_path):
     ------
     list
     '''
-    df = loompy.connect(loom_path,'r')
-    red_json = json.loads(df.attrs['reductions'])
-    df.close()
+    with loom_connection(loom_path) as df:
+        red_json = json.loads(df.attrs['reductions'])
     return list(red_json.keys())
 
 def get_reduction_x_y(loom_path,reduction):
@@ -42,9 +52,8 @@ def get_reduction_x_y(loom_path,reduction):
     ------
     Tuple of X,Y labels
     '''
-    df = loompy.connect(loom_path,'r')
-    red_json = json.loads(df.attrs['reductions'])
-    df.close()
+    with loom_connection(loom_path) as df:
+        red_json = json.loads(df.attrs['reductions'])
     return red_json[reduction]
 
 def dict_to_json(d):
@@ -75,9 +84,8 @@ def extract_attr_keys(loom_path):
     ------
     dictionary
     '''
-    df = loompy.connect(loom_path,'r') # open loom connection
-    attr_keys = {'col_attr_keys':df.ca.keys(),'row_attr_keys':df.ra.keys()}
-    df.close() # close loom connection
+    with loom_connection(loom_path) as df: # shared loom connection
+        attr_keys = {'col_attr_keys':df.ca.keys(),'row_attr_keys':df.ra.keys()}
     return attr_keys
 
 def extract_attrs(loom_path):
@@ -96,16 +104,15 @@ def extract_attrs(loom_path):
     col_attrs = dict() # empty dictionary to populate future column attributes dataframe
     row_attrs = dict() # empty dictionary to populate future gene attributes dataframe
     
-    df = loompy.connect(loom_path,'r') # open loom connection
-    for key in df.ca.keys(): # for each column attribute
-        col_attrs[key] = df.ca[key] # store attribute array
-        
-    for key in ['Entrez_ID','Ensembl_ID','Symbol']: # for each potential gene attribute
-        try:
-            row_attrs[key] = df.ra[key] # store attribute array
-        except:
-            row_attrs[key] = None # or define it as None
-    df.close() # close loom connection
+    with loom_connection(loom_path) as df: # shared loom connection
+        for key in df.ca.keys(): # for each column attribute
+            col_attrs[key] = df.ca[key] # store attribute array
+            
+        for key in ['Entrez_ID','Ensembl_ID','Symbol']: # for each potential gene attribute
+            try:
+                row_attrs[key] = df.ra[key] # store attribute array
+            except:
+                row_attrs[key] = None # or define it as None
     
     return {'col_attrs': col_attrs, 'row_attrs': row_attrs}
 
@@ -124,20 +131,14 @@ def is_valid_attrs_list(loom_path,attrs):
     ------
     bool
     '''
-    df = loompy.connect(loom_path,'r')
-    valid = df.ca.keys()
-    df.close()
+    with loom_connection(loom_path) as df:
+        valid = df.ca.keys()
     for attr in attrs:
         if attr not in valid:
             return False
     return True
 
-def multiple_intersect(arr):
-    tmp = arr[0]
-    for a in arr[1:]:
-        tmp = np.intersect1d(tmp,a)
-    return tmp
-
+@traced('filter')
 def get_filter_indices(loom_path,filt):
     '''
     Extract column indices, row indices matching filter
@@ -154,27 +155,19 @@ def get_filter_indices(loom_path,filt):
     column indices, row indices matching filter
     '''
     
-    df = loompy.connect(loom_path,'r') # open loom file
-
     try:
-        cidx_filter = [] # empty list to store indices of columns
-        for k in filt['ca'].keys(): # for each column attribute key 
-            cidx_filter.append(np.where(np.isin(df.ca[k], filt['ca'][k])==True)[0])
-        cidx_filter = multiple_intersect(cidx_filter)
+        cidx_filter = resolve_filter(loom_path,'ca',filt['ca']) # bitmaps OR-ed within a key, AND-ed across keys
     except:
         cidx_filter = None
     
     try:
-        ridx_filter = [] # epmty list to store indices of rows
-        for k in filt['ra'].keys(): # for each row attribute key
-            ridx_filter.append(np.where(np.isin(df.ra[k],filt['ra'][k])==True)[0])
-        ridx_filter = multiple_intersect(ridx_filter)
+        ridx_filter = resolve_filter(loom_path,'ra',filt['ra'])
     except:
         ridx_filter = None
         
-    df.close() # close loom file
     return cidx_filter,ridx_filter
 
+@traced('read')
 def get_dataframe(loom_path,attrs,cidx_filter=None):
     '''
     Extract column attributes from a Loom file and return them as a Pandas DataFrame
@@ -188,16 +181,18 @@ def get_dataframe(loom_path,attrs,cidx_filter=None):
         
     Return
     ------
-    Pandas DataFrame
+    Pandas DataFrame, categorical attributes as pandas Categorical columns (codes, no decoded strings)
     '''
+    if not isinstance(cidx_filter, np.ndarray):
+        cidx_filter = None
     d = dict()
-    df = loompy.connect(loom_path,'r')
     for attr in attrs:
-        if isinstance(cidx_filter, np.ndarray):
-            d[attr] = df.ca[attr][cidx_filter]
+        cached = cached_attribute(loom_path,'ca',attr)
+        if cached.is_categorical:
+            codes, categories = cached.factorize(cidx_filter)
+            d[attr] = pd.Categorical.from_codes(codes.astype(np.int64), categories=categories)
         else:
-            d[attr] = df.ca[attr]
-    df.close()
+            d[attr] = cached.values(cidx_filter)
     return pd.DataFrame(d)
 
 def n_colors(n):
@@ -205,6 +200,7 @@ def n_colors(n):
 
     return l[:n]
 
+@traced('figure')
 def json_component_chartjs(loom_path,style='pie',attrs=[],cidx_filter=None):
     '''
     Compute JSON for ChartJs figure
@@ -231,9 +227,12 @@ def json_component_chartjs(loom_path,style='pie',attrs=[],cidx_filter=None):
     if not is_valid_attrs_list(loom_path,attrs):
         raise Exception('attributes list must only contain valid attributes')
         
-    df = get_dataframe(loom_path,attrs,cidx_filter=cidx_filter)
-    col = attrs[0]
-    lbls,vals = np.unique(df[col].values,return_counts=True)
+    if not isinstance(cidx_filter, np.ndarray):
+        cidx_filter = None
+    codes, categories = cached_attribute(loom_path,'ca',attrs[0]).factorize(cidx_filter) # counted on codes, values are never decoded
+    counts = np.bincount(codes, minlength=len(categories))
+    present = np.flatnonzero(counts)
+    lbls,vals = categories[present],counts[present]
     idx = np.argsort(vals)[::-1]
     lbls = lbls[idx]
     vals = vals[idx]
@@ -258,6 +257,82 @@ def json_component_chartjs(loom_path,style='pie',attrs=[],cidx_filter=None):
 
     return json.dumps(res)
 
+@traced('read')
+def get_expression_row(loom_path,i,cidx_filter=None):
+    '''
+    Expression values of a gene, read from the expression sidecar when available
+    
+    Params
+    ------
+    loom_path: str
+        path to Loom file
+    i: int
+        Row index of the gene
+    cidx_filter: array
+        Column indices to filter cells
+        
+    Return
+    ------
+    arr
+    '''
+    if not isinstance(cidx_filter, np.ndarray):
+        cidx_filter = None
+    sidecar = get_expression_sidecar(loom_path)
+    if sidecar is not None:
+        return sidecar.row(i,cidx_filter)
+    with loom_connection(loom_path) as df:
+        if cidx_filter is not None:
+            return df[i,:][cidx_filter]
+        return df[i,:]
+
+@traced('read')
+def get_expression_matrix(loom_path,ridx_filter=None,cidx_filter=None):
+    '''
+    Expression matrix (genes x cells), read from the expression sidecar when available
+
+    With both filters, the sidecar is read by gene or by cell, whichever
+    stores fewer values for the requested subsets.
+    
+    Params
+    ------
+    loom_path: str
+        path to Loom file
+    ridx_filter: array or None
+        Row indices to filter genes
+    cidx_filter: array or None
+        Column indices to filter cells
+        
+    Return
+    ------
+    2D arr
+    '''
+    if not isinstance(ridx_filter, np.ndarray):
+        ridx_filter = None
+    if not isinstance(cidx_filter, np.ndarray):
+        cidx_filter = None
+    sidecar = get_expression_sidecar(loom_path)
+    if sidecar is not None:
+        if ridx_filter is not None and cidx_filter is not None:
+            if sidecar.nnz(cidx=cidx_filter) < sidecar.nnz(ridx=ridx_filter):
+                return sidecar.columns(cidx_filter,ridx_filter)
+            return sidecar.rows(ridx_filter,cidx_filter)
+        if ridx_filter is not None:
+            return sidecar.rows(ridx_filter)
+        if cidx_filter is not None:
+            return sidecar.columns(cidx_filter)
+        return sidecar.rows(np.arange(sidecar.shape[0]))
+    with loom_connection(loom_path) as df:
+        if ridx_filter is not None:
+            rows, inverse = np.unique(ridx_filter, return_inverse=True) # loom rows must be read in increasing order
+            block = df[rows,:][inverse]
+            if cidx_filter is not None:
+                return block[:,cidx_filter] # can't slice both axes at once
+            return block
+        elif cidx_filter is not None:
+            return df[:,cidx_filter]
+        return df[:,:]
+
+@traced('read')
 def get_symbol_values(loom_path,symbol,cidx_filter=None):
     '''
     Attempt to retrieve gene expression values
@@ -269,26 +344,14 @@ def get_symbol_values(loom_path,symbol,cidx_filter=None):
     symbol: str
         Potential symbol
     '''
-    df = loompy.connect(loom_path,'r')
-    symbols = df.ra['Symbol']
-    set_symbols = set(symbols)
-    if symbol in set_symbols:
-        idx = np.where(symbols==symbol)[0][0]
-        if isinstance(cidx_filter, np.ndarray):
-            symbol_values = df[idx,:][cidx_filter]
-        else:
-            symbol_values = df[idx,:]
-        df.close()
-        return symbol_values
-    df.close()
+    idx = get_symbol_index(loom_path).lookup(symbol)
+    if idx is not None:
+        return get_expression_row(loom_path,idx,cidx_filter=cidx_filter)
     raise Exception('Input not a valid symbol name')
         
 def continuous_scatter_gl(x,y,color,tracename=''):
-    if tracename=='All cells':
-        hoverinfo='skip'
-    else:
-        hoverinfo=None
-    trace=go.Scattergl(
+    trace=dict(
+        type='scattergl',
         x = x, 
         y = y, 
         mode='markers',
@@ -298,23 +361,30 @@ def continuous_scatter_gl(x,y,color,tracename=''):
             size=4
         ),
         name=tracename,
-        hoverinfo=hoverinfo
     )
+    if tracename=='All cells':
+        trace['hoverinfo']='skip'
     return trace
 
-def discrete_scatter_gl(x,y,color):
-    unique_classes = np.unique(color)
+def discrete_scatter_gl(x,y,codes,categories):
+    '''
+    One trace per class present, points grouped by their integer codes into categories
+    '''
+    order = np.argsort(codes, kind='stable') # points sorted by class, in their order within a class
+    bounds = np.searchsorted(codes[order], np.arange(len(categories)+1))
+    present = np.flatnonzero(bounds[1:] > bounds[:-1])
     traces=[]
-    color_seq = n_colors(len(unique_classes))
-    for i,unique_class_ in enumerate(unique_classes):
-        idx = np.where(color==unique_class_)[0]
+    color_seq = n_colors(len(present))
+    for i,g in enumerate(present):
+        idx = order[bounds[g]:bounds[g+1]]
         subX = x[idx]
         subY = y[idx]
-        traces.append(go.Scattergl(
+        traces.append(dict(
+                type='scattergl',
                 x=subX,
                 y=subY,
                 mode='markers',
-                name=unique_class_,
+                name=categories[g],
                 marker=dict(
                     color=color_seq[i],
                     size=4
@@ -325,17 +395,26 @@ def discrete_scatter_gl(x,y,color):
     return traces
 
 def check_color(loom_path,color,cidx_filter=None):
+    '''
+    Colors of the (filtered) cells: a default color if None, numeric values,
+    or (codes, categories) for a discrete column attribute
+    '''
     if color==None:
         return '#dddddd'
     elif is_valid_attrs_list(loom_path,[color]): # if color is a valid column attribute
-        return get_ca(loom_path,key=color,unique=False,cidx_filter=cidx_filter)
+        attr = cached_attribute(loom_path,'ca',color)
+        if not isinstance(cidx_filter, np.ndarray):
+            cidx_filter = None
+        if attr.is_categorical or not np.issubdtype(attr.array.dtype, np.number):
+            return attr.factorize(cidx_filter) # labels are only decoded once per class
+        return attr.values(cidx_filter)
     else: # supposed to be a gene symbol
         try:
             return get_symbol_values(loom_path,color,cidx_filter=cidx_filter)
         except:
             raise Exception(f'color must be None, a valid gene symbol or a valid data attribute')
             
-def json_scatter(loom_path,color=None,reduction=None,returnjson=True,cidx_filter=None):
+def json_scatter(loom_path,color=None,reduction=None,returnjson=True,cidx_filter=None,viewport=None,max_points=None):
     '''
     Compute JSON from Plotly figure
     
@@ -345,48 +424,85 @@ def json_scatter(loom_path,color=None,reduction=None,returnjson=True,cidx_filter
         path to Loom file
     color: str or None
         column attribute or gene symbol
-    attrs: list
-        List of up to two attributes to plot
     returnjson: bool
         return figure or its JSON form
     cidx_filter: array
         column indices filter
+    viewport: list or None
+        [xmin, xmax, ymin, ymax] bounding box of the points to draw
+    max_points: int or None
+        Maximum number of points per trace group, cells are subsampled beyond
         
     Return
     ------
     Plotly figure or its JSON form
     '''
-    start = time.time()
+    fig = scatter_figure(loom_path,color=color,reduction=reduction,cidx_filter=cidx_filter,viewport=viewport,max_points=max_points)
+    return figure_output(fig,returnjson)
+
+@traced('figure')
+def scatter_figure(loom_path,color=None,reduction=None,cidx_filter=None,viewport=None,max_points=None):
+    '''
+    Build the scatter plot figure dictionary
+    
+    Params
+    ------
+    loom_path: str
+        path to Loom file
+    color: str or None
+        column attribute or gene symbol
+    cidx_filter: array
+        column indices filter
+    viewport: list or None
+        [xmin, xmax, ymin, ymax] bounding box of the points to draw
+    max_points: int or None
+        Maximum number of points per trace group, cells are subsampled beyond
+        
+    Return
+    ------
+    Plotly figure dictionary
+    '''
     if reduction==None:
         reduction = get_available_reductions(loom_path)[0] # first reduction available
     X,Y = get_reduction_x_y(loom_path,reduction)
+    rank = lod_rank(get_shape(loom_path)[1]) # sampling priority of each cell
+    lod = dict()
     
-    fig = go.Figure()
+    traces = [] # figure is built as a dictionary, no graph object validation of the arrays
     if isinstance(cidx_filter, np.ndarray): # if filter exists, draw all points first as background
-        df = get_dataframe(loom_path,[X,Y],cidx_filter=None) # all points
-        x = df[X].values
-        y = df[Y].values
+        x,y = reduction_coordinates(loom_path,reduction,[X,Y]) # all points, memory-mapped float32
+        keep, lod['background_total'] = select_points(x,y,rank,viewport=viewport,max_points=max_points)
+        lod['background_shown'] = len(keep)
         tmpcolor = check_color(loom_path,None,cidx_filter=None) # None means default background color
-        fig.add_trace(continuous_scatter_gl(x,y,tmpcolor,tracename='All cells'))
+        traces.append(continuous_scatter_gl(x[keep],y[keep],tmpcolor,tracename='All cells'))
 
-    df = get_dataframe(loom_path,[X,Y],cidx_filter=cidx_filter) # pandas dataframe
-    x = df[X].values
-    y = df[Y].values
-    tmpcolor = check_color(loom_path,color,cidx_filter=cidx_filter) # numpy array
+    x,y = reduction_coordinates(loom_path,reduction,[X,Y],cidx_filter=cidx_filter)
+    tmpcolor = check_color(loom_path,color,cidx_filter=cidx_filter) # numpy array, or codes and categories
+    cells = cidx_filter if isinstance(cidx_filter, np.ndarray) else slice(None)
+    keep, lod['total'] = select_points(x,y,rank[cells],viewport=viewport,max_points=max_points)
+    lod['shown'] = len(keep)
+    x = x[keep]
+    y = y[keep]
+    if isinstance(tmpcolor, tuple):
+        codes, categories = tmpcolor
+        tmpcolor = (codes[keep], categories)
+    elif isinstance(tmpcolor, np.ndarray):
+        tmpcolor = tmpcolor[keep]
 
     if color!=None:
-        if np.issubdtype(tmpcolor.dtype, np.number): # if color is None or type of color array is numerical
+        if isinstance(tmpcolor, tuple): # discrete
+            traces.extend(discrete_scatter_gl(x,y,*tmpcolor))
+        else: # numerical
             idx = np.argsort(tmpcolor)
             tmpcolor = tmpcolor[idx]
             x = x[idx]
             y = y[idx]
-            fig.add_trace(continuous_scatter_gl(x,y,tmpcolor,tracename=color))
-        else: # discrete
-            fig.add_traces(discrete_scatter_gl(x,y,tmpcolor))
+            traces.append(continuous_scatter_gl(x,y,tmpcolor,tracename=color))
     elif color==None and not isinstance(cidx_filter, np.ndarray): # fallback case
-        fig.add_trace(continuous_scatter_gl(x,y,tmpcolor))
+        traces.append(continuous_scatter_gl(x,y,tmpcolor))
 
-    fig.update_layout(
+    layout = dict(
+        template=default_template(),
         # background color white
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
@@ -395,63 +511,13 @@ def json_scatter(loom_path,color=None,reduction=None,returnjson=True,cidx_filter
             r=0,
             b=0,
             t=0
-        )
+        ),
+        meta={'lod':lod}, # points shown out of points in the viewport
+        xaxis=dict(showticklabels=False),
+        yaxis=dict(showticklabels=False),
     )
-    fig.update_yaxes(showticklabels=False)
-    fig.update_xaxes(showticklabels=False)
-    end = time.time()
-    if returnjson:
-        print('#######################')
-        print(end - start)
-        print('#######################')
-        return json.loads(pio.to_json(fig, validate=True, pretty=False, remove_uids=True))
-    else:
-        print('#######################')
-        print(end - start)
-        print('#######################')
-        return fig
+    return dict(data=traces,layout=layout)
     
-def get_hexbin_attributes(hexbin):
-    '''
-    Extract hexagons attributes from Matplotlib hexbin object
-    
-    Params
-    ------
-    hexbin: Matplotlib hexbin
-    
-    Return
-    ------
-    hexagon, offsets, facecolors, values
-    '''
-    paths = hexbin.get_paths()
-    points_codes = list(paths[0].iter_segments())#path[0].iter_segments() is a generator 
-    prototypical_hexagon = [item[0] for item in points_codes]
-    return prototypical_hexagon, hexbin.get_offsets(), hexbin.get_facecolors(), hexbin.get_array()
-
-def make_hexagon(prototypical_hex, offset, fillcolor, linecolor=None):
-    new_hex_vertices = [vertex + offset for vertex in prototypical_hex]
-    vertices = np.asarray(new_hex_vertices[:-1])
-    # hexagon center
-    center=np.mean(vertices, axis=0)
-    if linecolor is None:
-        linecolor = fillcolor
-    #define the SVG-type path:    
-    path = 'M '
-    for vert in new_hex_vertices:
-        path +=  f'{vert[0]}, {vert[1]} L' 
-    return  dict(type='path',
-                 line=dict(color=linecolor, 
-                           width=0.5),
-                 path=  path[:-2],
-                 fillcolor=fillcolor, 
-                ), center 
-
-def pl_cell_color(mpl_facecolors):
-    '''
-    From matplotlib facecolors to plotly cell colors
-    '''
-    return [ f'rgb({int(R*255)}, {int(G*255)}, {int(B*255)})' for (R, G, B, A) in mpl_facecolors]
-
 def mpl_to_plotly(cmap, N):
     h = 1.0/(N-1)
     pl_colorscale = []
@@ -460,7 +526,33 @@ def mpl_to_plotly(cmap, N):
         pl_colorscale.append([round(k*h,2), f'rgb({C[0]}, {C[1]}, {C[2]})'])
     return pl_colorscale
 
-def json_hexbin(loom_path,reduction=None,cmap=plt.cm.Greys,background='white',returnjson=True,cidx_filter=None):
+def hexbin_traces(bins,colors,levels):
+    '''
+    Hexagons as filled scatter traces, one per color level, polygons separated by None
+    '''
+    vertices = bins.vertices()
+    traces = []
+    for level in np.unique(levels):
+        xs = []
+        ys = []
+        for hexagon in vertices[levels == level].tolist():
+            xs += [vx for vx, vy in hexagon] + [hexagon[0][0], None]
+            ys += [vy for vx, vy in hexagon] + [hexagon[0][1], None]
+        traces.append(dict(
+            type='scatter',
+            x=xs,
+            y=ys,
+            mode='lines',
+            fill='toself',
+            fillcolor=colors[level],
+            line=dict(color=colors[level], width=0.5),
+            hoverinfo='skip',
+            showlegend=False,
+        ))
+    return traces
+
+@traced('figure')
+def json_hexbin(loom_path,reduction=None,cmap=cm.Greys,background='white',returnjson=True,cidx_filter=None,gridsize=HEXBIN_GRIDSIZE,symbol=None,agg='mean',shapes=True):
     '''
     Generate hexbin plot from X,Y scatter coordinates
     
@@ -468,12 +560,20 @@ def json_hexbin(loom_path,reduction=None,cmap=plt.cm.Greys,background='white',re
     ------
     loom_path: str
         Path to a loom file
-    cmap: Matplotlib Pyplot colormap
-        Colormap from pyplot.cm collection
+    cmap: Matplotlib colormap
+        Colormap from matplotlib.cm collection
     background: str
         background of hexbin plot
     returnjson: bool
         Return Plotly figure or its JSON form
+    gridsize: int
+        Number of hexagons along the x axis
+    symbol: str or None
+        Gene whose expression is aggregated in each hexagon, cell counts if None
+    agg: str
+        'mean' or 'sum' of the expression in each hexagon, 'count' for cell counts whatever the symbol
+    shapes: bool
+        Draw hexagons as layout shapes, or as a few filled traces (one per color level)
     
     Return
     ------
@@ -483,44 +583,59 @@ def json_hexbin(loom_path,reduction=None,cmap=plt.cm.Greys,background='white',re
         reduction = get_available_reductions(loom_path)[0] # first reduction available
     X,Y = get_reduction_x_y(loom_path,reduction)
     
-    df = get_dataframe(loom_path,[X,Y],cidx_filter=cidx_filter)
-    x = df[X].values
-    y = df[Y].values
-    HB = plt.hexbin(x,y,gridsize=20,cmap=cmap)
-    xx = plt.draw()
-
-    hexagon_vertices, offsets, mpl_facecolors, counts = get_hexbin_attributes(HB)
-    cell_color = pl_cell_color(mpl_facecolors)
-
-    shapes = []
-    centers = []
-    for k in range(len(offsets)):
-        shape, center = make_hexagon(hexagon_vertices, offsets[k], cell_color[k])
-        shapes.append(shape)
-        centers.append(center)
-
-    xlocs, ylocs = zip(*centers)
-    cmapp = mpl_to_plotly(cmap, 11)
-    text = [f'x: {round(xlocs[k],2)}<br>y: {round(ylocs[k],2)}<br>counts: {int(counts[k])}' for k in range(len(xlocs))]
-    
-    fig = go.Figure()
-    fig.add_trace(
-        go.Scatter(
-             x=xlocs, 
-             y=ylocs, 
-             mode='markers',
-             marker=dict(size=0.5, 
-                         color=counts, 
-                         colorscale=cmapp, 
-                         showscale=True,
-                         colorbar=dict(
-                                     thickness=20,  
-                                     ticklen=4
-                                     )),
-           text=text,
-           hoverinfo='text'
-          )
-    )
+    x,y = reduction_coordinates(loom_path,reduction,[X,Y],cidx_filter=cidx_filter)
+    values = None
+    if symbol is not None and agg != 'count':
+        values = get_symbol_values(loom_path,symbol,cidx_filter=cidx_filter)
+    bins = hexbin(x,y,gridsize=gridsize,values=values,agg=agg)
+
+    if bins.values is None:
+        color = bins.counts
+        vmin = 0
+        title = 'counts'
+    else:
+        color = bins.values
+        vmin = None
+        title = f'{symbol} ({agg})'
+    nlevels = 11
+    cmapp = mpl_to_plotly(cmap, nlevels)
+    xlocs = bins.centers[:,0]
+    ylocs = bins.centers[:,1]
+    text = [f'x: {round(cx,2)}<br>y: {round(cy,2)}<br>counts: {n}' for cx,cy,n in zip(xlocs.tolist(),ylocs.tolist(),bins.counts.tolist())]
+    if bins.values is not None:
+        text = [f'{t}<br>{title}: {round(v,3)}' for t,v in zip(text,bins.values.tolist())]
+
+    data = []
+    layout_shapes = []
+    if shapes:
+        cell_color = rgb_colors(cmap,color,vmin=vmin)
+        layout_shapes = [dict(type='path',path=path,fillcolor=c,line=dict(color=c,width=0.5)) for path,c in zip(bins.paths(),cell_color)]
+    elif len(bins):
+        # quantize colors on the colorbar levels to keep the number of traces small
+        lo = np.min(color) if vmin is None else vmin
+        norm = (color - lo) / ((np.max(color) - lo) or 1)
+        levels = np.rint(norm * (nlevels - 1)).astype(np.int64)
+        data += hexbin_traces(bins,[c for _,c in cmapp],levels)
+
+    data.append(dict(
+        type='scatter',
+        x=xlocs, 
+        y=ylocs, 
+        mode='markers',
+        marker=dict(size=0.5, 
+                    color=color, 
+                    colorscale=cmapp, 
+                    cmin=vmin,
+                    showscale=True,
+                    colorbar=dict(
+                                title=title,
+                                thickness=20,  
+                                ticklen=4
+                                )),
+        text=text,
+        hoverinfo='text',
+        showlegend=False,
+    ))
 
     axis = dict(
         showgrid=False,
@@ -529,20 +644,18 @@ def json_hexbin(loom_path,reduction=None,cmap=plt.cm.Greys,background='white',re
         ticklen=4 
     )
 
-    fig.update_layout(
-        width=530, height=550,
-        xaxis=axis,
-        yaxis=axis,
-        xaxis_title='UMAP1',
-        yaxis_title='UMAP2',
-        hovermode='closest',
-        shapes=shapes,
-        plot_bgcolor=background)
+    fig = dict(
+        data=data,
+        layout=dict(
+            template=default_template(),
+            width=530, height=550,
+            xaxis=dict(axis,title=dict(text='UMAP1')),
+            yaxis=dict(axis,title=dict(text='UMAP2')),
+            hovermode='closest',
+            shapes=layout_shapes,
+            plot_bgcolor=background))
     
-    if returnjson:
-        return json.loads(pio.to_json(fig, validate=True, pretty=False, remove_uids=True))
-    else:
-        return fig
+    return figure_output(fig,returnjson)
     
 def get_classes(loom_path):
     '''
@@ -557,9 +670,8 @@ def get_classes(loom_path):
     ------
     list
     '''
-    df = loompy.connect(loom_path,'r') # open loom connection
-    classes = df.attrs.Classes.split(',')
-    df.close()
+    with loom_connection(loom_path) as df: # shared loom connection
+        classes = df.attrs.Classes.split(',')
     return classes
 
 def get_most_variable_genes(loom_path):
@@ -575,9 +687,8 @@ def get_most_variable_genes(loom_path):
     ------
     list
     '''
-    df = loompy.connect(loom_path,'r') # open loom connection
-    genes = df.attrs.most_variable_genes.split(',')
-    df.close()
+    with loom_connection(loom_path) as df: # shared loom connection
+        genes = df.attrs.most_variable_genes.split(',')
     return genes
 
 def check_ra(loom_path,key):
@@ -596,11 +707,10 @@ def check_ra(loom_path,key):
     ------
     True or False
     '''
-    df = loompy.connect(loom_path,'r')
-    if key in df.ra :
-        return True
-    return False
+    with loom_connection(loom_path) as df:
+        return key in df.ra
 
+@traced('read')
 def get_ra(loom_path,key='Symbol',unique=False,ridx_filter=None):
     '''
     Extract row attribute data from loom file
@@ -616,17 +726,15 @@ def get_ra(loom_path,key='Symbol',unique=False,ridx_filter=None):
     ------
     arr
     '''
-    df = loompy.connect(loom_path,'r') # open loom connection
-    if isinstance(ridx_filter, np.ndarray):
-        labels = df.ra[key][ridx_filter]
-    else:
-        labels = df.ra[key]
-    df.close()
+    attr = cached_attribute(loom_path,'ra',key) # decoded attribute kept in memory
+    if not isinstance(ridx_filter, np.ndarray):
+        ridx_filter = None
     if unique:
-        return np.unique(labels)
+        return attr.unique(ridx_filter)
     else:
-        return labels
+        return attr.values(ridx_filter)
 
+@traced('read')
 def get_ca(loom_path,key='Sample',unique=False,cidx_filter=None):
     '''
     Extract column attribute data from loom file
@@ -640,18 +748,15 @@ def get_ca(loom_path,key='Sample',unique=False,cidx_filter=None):
 
     Return
     ------
-    arr
+    arr, decoded for the filtered cells only (use cached_attribute(...).factorize() to avoid decoding)
     '''
-    df = loompy.connect(loom_path,'r') # open loom connection
-    if isinstance(cidx_filter, np.ndarray):
-        labels = df.ca[key][cidx_filter]
-    else:
-        labels = df.ca[key]
-    df.close()
+    attr = cached_attribute(loom_path,'ca',key) # encoded attribute kept in memory
+    if not isinstance(cidx_filter, np.ndarray):
+        cidx_filter = None
     if unique:
-        return np.unique(labels)
+        return attr.unique(cidx_filter)
     else:
-        return labels
+        return attr.values(cidx_filter)
 
 def get_shape(loom_path):
     '''
@@ -666,11 +771,11 @@ def get_shape(loom_path):
     ------
     tuple
     '''
-    df = loompy.connect(loom_path,'r') # open loom connection
-    shape = df.shape
-    df.close()
+    with loom_connection(loom_path) as df: # shared loom connection
+        shape = df.shape
     return shape
 
+@traced('aggregate')
 def most_variable_symbols(loom_path,n=10,ridx_filter=None,cidx_filter=None):
     '''
     Find the most variable genes
@@ -683,28 +788,25 @@ def most_variable_symbols(loom_path,n=10,ridx_filter=None,cidx_filter=None):
         Number of genes to return
     ridx_filter : array or None
         Row indices to filter genes to use
+    cidx_filter : array or None
+        Column indices to filter cells to use
         
     Return
     ------
     Array of symbols
     '''
-    
-    df = loompy.connect(loom_path)
-    if cidx_filter==None and ridx_filter==None and df.attrs.most_variable_genes:
-        return df.attrs.most_variable_genes.split(',')
-            
+    if cidx_filter is None and ridx_filter is None:
+        with loom_connection(loom_path) as df:
+            stored = df.attrs['most_variable_genes'] if 'most_variable_genes' in df.attrs else None
+        if stored:
+            return stored.split(',')
+        order = get_variance_ranking(loom_path) # built by the ingest pipeline
+        if order is not None:
+            labels = get_ra(loom_path,key='Symbol',unique=False)[np.asarray(order[:n])]
+            return np.delete(labels, np.where(labels == 'nan'))
+                
     labels = get_ra(loom_path,key='Symbol',unique=False,ridx_filter=ridx_filter) # get symbols (filter applied)
-    if isinstance(ridx_filter, np.ndarray) and isinstance(cidx_filter, np.ndarray):
-        tmp = df[ridx_filter,:] # can't slice both axes at once
-        tmp = tmp[:,cidx_filter]
-        v = np.var(tmp,axis=1) # computer variance
-    elif isinstance(ridx_filter, np.ndarray):
-        v = np.var(df[ridx_filter, :],axis=1) # compute variances
-    elif isinstance(cidx_filter, np.ndarray):
-        v = np.var(df[:, cidx_filter],axis=1) # compute variances
-    else:
-        v = np.var(df[:, :],axis=1)
-    df.close()
+    v = gene_variances(loom_path,ridx_filter=ridx_filter,cidx_filter=cidx_filter) # streamed by chunks
     idx = np.argsort(v)[::-1][:n] # sort and select in descending order
     labels = labels[idx] # trim synbol array
     return np.delete(labels, np.where(labels == 'nan')) # remove potential nan values and return
@@ -757,6 +859,7 @@ def auto_get_symbols(loom_path,n=10,ridx_filter=None,cidx_filter=None,method='fi
     else:
         raise Exception('method not recognized')
 
+@traced('figure')
 def dotplot_json(loom_path,attribute='',symbols=[],cidx_filter=None,ridx_filter=None,returnjson=True,log=False,scale=False):
     '''
     Create dotplot figure
@@ -785,29 +888,32 @@ def dotplot_json(loom_path,attribute='',symbols=[],cidx_filter=None,ridx_filter=
     if symbols == []: # if empty symbol list
         symbols = most_variable_symbols(loom_path,n=10,ridx_filter=ridx_filter) # retrive
         
-    allsymbols = get_ra(loom_path,key='Symbol') # symbol list
-    vals = dict()
-    vals[attribute] = get_ca(loom_path,key=attribute,unique=False,cidx_filter=cidx_filter) # get column attribute values
-    
-    df = loompy.connect(loom_path,'r')
-    for s in symbols:
-        i = np.where(allsymbols==s)[0][0]
-        if isinstance(cidx_filter, np.ndarray):
-            vals[s] = df[i,cidx_filter]
-        else:
-            vals[s] = df[i,:]
-    if log==True:
-        for s in symbols:
-            vals[s] = np.log(vals[s]+1)
-    df.close()
+    rows = symbol_rows(loom_path,symbols) # row index of each symbol
+    summary = None
+    if not isinstance(cidx_filter, np.ndarray):
+        summary = get_group_summary(loom_path,attribute) # precomputed at upload
     
-    df = pd.DataFrame(vals)
-    colors = df.groupby([attribute]).mean() # average value for each gene grouped by attribute
-    sizes = df.groupby([attribute]).agg(lambda x: x.ne(0).sum()/len(x)) # percentage of non-zeros for each gene grouped by attribute
+    if summary is not None:
+        colors = (summary.logmean if log==True else summary.mean)[rows].T.astype(np.float64) # groups x genes
+        sizes = summary.frac[rows].T # fraction of non-zeros, groups x genes
+        labels = summary.categories
+    else:
+        if not isinstance(cidx_filter, np.ndarray):
+            cidx_filter = None
+        codes, categories = cached_attribute(loom_path,'ca',attribute).factorize(cidx_filter) # group of each cell
+        vals = get_expression_matrix(loom_path,ridx_filter=rows,cidx_filter=cidx_filter) # genes x cells
+        if log==True:
+            vals = np.log(vals+1)
+        counts, sums, nonzeros = group_reduce(vals,codes,len(categories))
+        present = counts > 0 # only groups with cells left by the filter
+        colors = (sums[:,present] / counts[present]).T # average value for each gene grouped by attribute
+        sizes = (nonzeros[:,present] / counts[present]).T # percentage of non-zeros for each gene grouped by attribute
+        labels = categories[present]
     
     if scale==True:
-        colors -= colors.min() # minimum becomes 0
-        colors /= colors.max() # maximum becomes 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            colors = colors - colors.min(axis=0) # minimum becomes 0
+            colors = colors / colors.max(axis=0) # maximum becomes 1
     
     r,c = colors.shape
     i_coords, j_coords = np.meshgrid(range(c), range(r), indexing='ij')
@@ -815,9 +921,31 @@ def dotplot_json(loom_path,attribute='',symbols=[],cidx_filter=None,ridx_filter=
     y = j_coords.flatten()
     cs = [[0.0, "#EBC89B"], [0.5,"#FB6404"],[1, "#67000C"]]
     #cs = [[0.0,"#ebe7e1"],[0.5, "#c27a67"],[1, "#c27a67"]]
-    fig = px.scatter(x=x, y=y,size=sizes.values.T.flatten(),color=colors.values.T.flatten(),color_continuous_scale=cs)
-    
-    fig.update_layout(
+    size = sizes.T.flatten()
+    size_max = 20 # largest dot diameter in pixels, as plotly express
+    sizeref = 2.0 * (np.nanmax(size) if len(size) else 0) / size_max**2 or 1
+
+    # figure is built as a dictionary, same figure as px.scatter without graph object validation
+    trace = dict(
+        type='scatter',
+        mode='markers',
+        x=x,
+        y=y,
+        marker=dict(
+            color=colors.T.flatten(),
+            coloraxis='coloraxis',
+            size=size,
+            sizemode='area',
+            sizeref=sizeref,
+            symbol='circle',
+        ),
+        hovertemplate='x=%{x}<br>y=%{y}<br>size=%{marker.size}<br>color=%{marker.color}<extra></extra>',
+        showlegend=False,
+    )
+    layout = dict(
+        template=default_template(),
+        coloraxis=dict(colorscale=cs, colorbar=dict(title=dict(text='color'))),
+        legend=dict(itemsizing='constant', tracegroupgap=0),
         # background color white
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
@@ -826,34 +954,23 @@ def dotplot_json(loom_path,attribute='',symbols=[],cidx_filter=None,ridx_filter=
             r=0,
             b=0,
             t=0
-        )
-    )
-    
-    fig.update_layout(
+        ),
         xaxis = dict(
+            title=dict(text=''),
             tickmode = 'array',
             tickvals = i_coords[:,0],
             ticktext = symbols
         ),
         yaxis = dict(
+            title=dict(text=attribute),
             tickmode = 'array',
             tickvals = j_coords[0,:],
-            ticktext = colors.index.values,
+            ticktext = labels,
         )
     )
+    return figure_output(dict(data=[trace],layout=layout),returnjson)
     
-    # hide subplot y-axis titles and x-axis titles
-    for axis in fig.layout:
-        if type(fig.layout[axis]) == go.layout.YAxis:
-            fig.layout[axis].title.text = attribute
-        if type(fig.layout[axis]) == go.layout.XAxis:
-            fig.layout[axis].title.text = ''
-
-    if returnjson:
-        return json.loads(pio.to_json(fig, validate=True, pretty=False, remove_uids=True))
-    else:
-        return fig
-    
+@traced('figure')
 def violin_json(loom_path,attribute='',symbols=[],cidx_filter=None,returnjson=True,log=False):
     '''
     Create violin plot figure
@@ -877,35 +994,40 @@ def violin_json(loom_path,attribute='',symbols=[],cidx_filter=None,returnjson=Tr
     ------
     JSON
     '''
-    allsymbols = get_ra(loom_path,key='Symbol') # symbol list
-    attr_values = get_ca(loom_path,key=attribute,unique=False,cidx_filter=cidx_filter) # get column attribute values
+    if not isinstance(cidx_filter, np.ndarray):
+        cidx_filter = None
+    codes, categories = cached_attribute(loom_path,'ca',attribute).factorize(cidx_filter) # group of each cell
     symbol = symbols[0]
-    
-    df = loompy.connect(loom_path,'r')
-    i = np.where(allsymbols==symbol)[0][0]
-    if isinstance(cidx_filter, np.ndarray):
-        symbol_values = df[i,cidx_filter]
-    else:
-        symbol_values = df[i,:]
-    df.close()
+    i = symbol_rows(loom_path,[symbol])[0]
+    symbol_values = get_expression_row(loom_path,i,cidx_filter=cidx_filter)
     if log==True:
         symbol_values = np.log(symbol_values+1)
 
-    fig = go.Figure()
-    unique_values = np.unique(attr_values)
+    traces = [] # figure is built as a dictionary, no graph object validation of the arrays
+    order = np.argsort(codes, kind='stable') # cells sorted by group
+    bounds = np.searchsorted(codes[order], np.arange(len(categories)+1))
+    present = np.flatnonzero(bounds[1:] > bounds[:-1]) # groups with cells left by the filter
+    unique_values = categories[present]
     colors = n_colors(len(unique_values))
     for i,value in enumerate(unique_values):
-        idx = np.where(attr_values==value)[0]
+        g = present[i]
+        idx = order[bounds[g]:bounds[g+1]]
         # name are visible so no need to show legend
-        fig.add_trace(go.Violin(x=symbol_values[idx],
-                                name=value,
-                                showlegend=False,
-                                box_visible=True,
-                                meanline_visible=True,
-                                line=dict(color=colors[i])))
+        traces.append(dict(
+            type='violin',
+            x=symbol_values[idx],
+            name=value,
+            showlegend=False,
+            box=dict(visible=True),
+            meanline=dict(visible=True),
+            line=dict(color=colors[i]),
+            orientation='h',
+            width=0.8,
+            points=False,
+        ))
 
-
-    fig.update_layout(
+    layout = dict(
+        template=default_template(),
         # background color white
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
@@ -914,102 +1036,123 @@ def violin_json(loom_path,attribute='',symbols=[],cidx_filter=None,returnjson=Tr
             r=0,
             b=0,
             t=0
-        )
+        ),
+        xaxis=dict(showgrid=False, zeroline=True, showticklabels=False),
     )
-    fig.update_traces(orientation='h', width=0.8, points=False)
-    fig.update_layout(xaxis_showgrid=False, xaxis_zeroline=True)
-    fig.update_xaxes(showticklabels=False)
-    
-    if returnjson:
-        return json.loads(pio.to_json(fig, validate=True, pretty=False, remove_uids=True))
-    else:
-        return fig
-    
-def density_ca(loom_path,X,Y,cidx_filter=None,ca=None):
-    df = get_dataframe(loom_path,[X,Y],cidx_filter=None) # pandas dataframe
-    fig = px.density_contour(df, x=X, y=Y)
-    fig['data'][0]['line']['color'] = '#D3D3D3'
-    
-    if isinstance(cidx_filter, np.ndarray):
-        df = get_dataframe(loom_path,[X,Y],cidx_filter=cidx_filter) # pandas dataframe    
+    return figure_output(dict(data=traces,layout=layout),returnjson)
     
+def density_contour(grid,z,name='',color='#D3D3D3'):
+    '''
+    Contour lines of a density grid
+    '''
+    return dict(
+        type='contour',
+        x=grid.x,
+        y=grid.y,
+        z=z,
+        name=name,
+        ncontours=20,
+        contours=dict(coloring='none'),
+        line=dict(color=color),
+        showscale=False,
+        hoverinfo='none',
+    )
+
+def density_ca(loom_path,X,Y,cidx_filter=None,ca=None,grid=None):
+    '''
+    Density of all cells, and of the (filtered) cells of each class of a column attribute
+    '''
+    if grid is None:
+        df = get_dataframe(loom_path,[X,Y]) # grid covers every cell, filtered or not
+        grid = DensityGrid(df[X].values,df[Y].values)
+    idx = cidx_filter if isinstance(cidx_filter, np.ndarray) else None
+    traces = [density_contour(grid,grid.density())]
+
     if ca!=None:
-        df[ca] = get_ca(loom_path,key=ca,cidx_filter=cidx_filter)
-        color_seq = n_colors(len(df[ca].unique()))
-        traces = px.density_contour(df, x=X, y=Y, color=ca, color_discrete_sequence=color_seq).data
-        fig.add_traces(traces)
-        lgd = {trace['name']:trace['line']['color'] for trace in traces}
+        codes, categories = cached_attribute(loom_path,'ca',ca).factorize(idx)
+        present, codes = np.unique(codes, return_inverse=True)
+        color_seq = n_colors(len(present))
+        densities = grid.group_densities(codes,len(present),idx=idx)
+        lgd = dict()
+        for k,name in enumerate(categories[present]):
+            name = str(name)
+            color = color_seq[k] if k < len(color_seq) else None
+            traces.append(density_contour(grid,densities[k],name=name,color=color))
+            lgd[name] = color
     else:
-        traces = px.density_contour(df, x=X, y=Y).data
-        fig.add_traces(traces)
+        traces.append(density_contour(grid,grid.density(idx),color=None))
         lgd = {}
-    
-    for i,trace in enumerate(fig['data']):
-        fig['data'][i]['ncontours'] = 20
-    return fig,lgd
+    return traces,lgd
 
-def density_symbols(loom_path,X,Y,symbols,cidx_filter=None):
-    df = get_dataframe(loom_path,[X,Y],cidx_filter=None) # pandas dataframe
-
-    fig = px.density_contour(df, x=X, y=Y)
-    fig['data'][0]['line']['color'] = '#D3D3D3'
-    for i,trace in enumerate(fig['data']):
-        fig['data'][i]['ncontours'] = 20
+def density_symbols(loom_path,X,Y,symbols,cidx_filter=None,grid=None):
+    '''
+    Density of all cells, and expression weighted density of each gene
+    '''
+    if grid is None:
+        df = get_dataframe(loom_path,[X,Y])
+        grid = DensityGrid(df[X].values,df[Y].values)
+    idx = cidx_filter if isinstance(cidx_filter, np.ndarray) else None
+    traces = [density_contour(grid,grid.density())]
     
     lgd = dict()
     gene_colors = ['rgba(214,121,5,1)','rgba(239, 122, 4,1)','rgba(239, 239, 4,1)','rgba(122, 239, 4,1)','rgba(4, 239, 239,1)','rgba(4, 122, 239,1)','rgba(122, 4, 239,1)','rgba(239, 4, 239,1)','rgba(239, 4, 122,1)','rgba(4, 239, 4,1)']
 
-    traces=[]
-    if isinstance(cidx_filter, np.ndarray): # if filter exists
-        df = get_dataframe(loom_path,[X,Y],cidx_filter=cidx_filter) # pandas dataframe
     for i,symbol in enumerate(symbols):
         gene_color = gene_colors[i]
         lgd[symbol] = gene_color
         exp = get_symbol_values(loom_path,symbol,cidx_filter=cidx_filter)
-        trace = go.Histogram2dContour(
-            x = df[X].values,
-            y = df[Y].values,
-            z=exp,
+        traces.append(dict(
+            type='contour',
+            x=grid.x,
+            y=grid.y,
+            z=grid.density(idx,weights=exp),
+            name=symbol,
             colorscale=[[0,'rgba(255,255,255,0)'],[1,gene_color]],
-            histfunc='sum',
             ncontours = 20,
             contours = dict(
                 showlines=False
             ),
+            showscale=False,
             hoverinfo='none'
-        )
-
-        traces.append(trace)
-    fig.add_traces(traces)
+        ))
         
-    return fig,lgd
+    return traces,lgd
 
+@traced('figure')
 def json_density(loom_path,reduction=None,ca=None,symbols=[],returnjson=True,cidx_filter=None):
+    '''
+    Density contours computed on a fixed grid, of classes of a column attribute or of gene expression
+
+    The response holds DENSITY_GRID x DENSITY_GRID arrays per trace, whatever the number of cells.
+    '''
     if reduction==None:
         reduction = get_available_reductions(loom_path)[0] # first reduction available
     X,Y = get_reduction_x_y(loom_path,reduction)
+    grid = DensityGrid(*reduction_coordinates(loom_path,reduction,[X,Y]))
     
     if symbols==[]: # if no gene list provided
-        fig,lgd = density_ca(loom_path,X,Y,cidx_filter=cidx_filter,ca=ca) # plot simple density contour or with categorical column attribute
+        traces,lgd = density_ca(loom_path,X,Y,cidx_filter=cidx_filter,ca=ca,grid=grid) # plot simple density contour or with categorical column attribute
     else:
-        fig,lgd = density_symbols(loom_path,X,Y,symbols,cidx_filter=cidx_filter)
+        traces,lgd = density_symbols(loom_path,X,Y,symbols,cidx_filter=cidx_filter,grid=grid)
 
-    fig.update_layout(
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        margin=dict(
-            l=0,
-            r=0,
-            b=0,
-            t=0
-        ),
-        xaxis_title='',
-        yaxis_title='',
-    )
-    fig.update_yaxes(showticklabels=False)
-    fig.update_xaxes(showticklabels=False)
+    axis = dict(title=dict(text=''),showticklabels=False)
+    fig = dict(
+        data=traces,
+        layout=dict(
+            template=default_template(),
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            margin=dict(
+                l=0,
+                r=0,
+                b=0,
+                t=0
+            ),
+            xaxis=axis,
+            yaxis=axis,
+        ))
     
     if returnjson:
-        return json.loads(pio.to_json(fig, validate=True, pretty=False, remove_uids=True)),lgd
+        return figure_output(fig),lgd
     else:
-        return fig
+        return figure_output(fig,returnjson)
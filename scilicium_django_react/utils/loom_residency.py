@@ -0,0 +1,187 @@
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+
+from scilicium_django_react.utils.loom_sidecar import valid_sidecar_dir
+
+DEFAULT_RESIDENT_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_DECAY = 0.5 # weight of the previous score at each coordinator run
+WARM_READ_BYTES = 1024 * 1024
+STATE_KEY = 'loom-residency'
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def _cache():
+    return caches[_setting('LOOM_RESIDENCY_CACHE_ALIAS', 'default')]
+
+def _access_key(loom_id):
+    return 'loom-access:%s' % loom_id
+
+def record_access(loom_id):
+    '''
+    Count a request on a loom, shared by every worker process
+    '''
+    key = _access_key(loom_id)
+    cache = _cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError: # evicted in between
+        cache.set(key, 1, timeout=None)
+
+def _take_accesses(cache, loom_id):
+    key = _access_key(loom_id)
+    hits = cache.get(key) or 0
+    if hits:
+        try:
+            cache.decr(key, hits) # requests counted meanwhile are kept for the next run
+        except ValueError:
+            pass
+    return hits
+
+def sidecar_files(loom_path):
+    '''
+    Memory-mapped files of a loom sidecar: attributes, embeddings, indexes, expression
+
+    Return
+    ------
+    list of (path, bytes)
+    '''
+    directory = valid_sidecar_dir(loom_path)
+    if directory is None:
+        return []
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith('.npy') and not name.startswith('.tmp'):
+            path = os.path.join(directory, name)
+            files.append((path, os.path.getsize(path)))
+    return files
+
+def plan_residency(scores, sizes, budget):
+    '''
+    Looms to keep resident: the most requested first, as long as they fit in the budget
+
+    Params
+    ------
+    scores : dict
+        Loom id -> decayed number of requests
+    sizes : dict
+        Loom id -> bytes of its sidecar files
+    budget : int
+        Bytes of memory given to resident looms
+
+    Return
+    ------
+    set of loom ids
+    '''
+    resident = set()
+    total = 0
+    for loom_id in sorted(scores, key=lambda i: (-scores[i], i)):
+        if scores[loom_id] <= 0:
+            break
+        size = sizes.get(loom_id, 0)
+        if size and total + size <= budget:
+            resident.add(loom_id)
+            total += size
+    return resident
+
+def _advise(path, advice):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    with open(path, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, advice)
+
+def load_files(paths, read=True):
+    '''
+    Bring files into the page cache, where every worker mapping them shares the same pages
+    '''
+    for path in paths:
+        if read:
+            with open(path, 'rb') as f:
+                while f.read(WARM_READ_BYTES):
+                    pass
+        elif hasattr(os, 'POSIX_FADV_WILLNEED'):
+            _advise(path, os.POSIX_FADV_WILLNEED)
+
+def evict_files(paths):
+    '''
+    Tell the kernel the pages of files can go, pages still mapped by a worker stay
+    '''
+    if hasattr(os, 'POSIX_FADV_DONTNEED'):
+        for path in paths:
+            _advise(path, os.POSIX_FADV_DONTNEED)
+
+def warm_loom(loom_id, loom_path, budget=None):
+    '''
+    Read the sidecar of a freshly ingested loom, if the residency plan keeps it
+
+    Only looms resident at the last coordinator run are warmed, e.g. a
+    requested loom whose file was replaced; the others wait for the
+    coordinator to rank them.
+
+    Params
+    ------
+    loom_id : int
+        Loom primary key
+    loom_path : str
+        Path to the .loom file
+    budget : int or None
+        Bytes, LOOM_RESIDENT_BYTES by default
+
+    Return
+    ------
+    bool, whether the sidecar was read
+    '''
+    budget = _setting('LOOM_RESIDENT_BYTES', DEFAULT_RESIDENT_BYTES) if budget is None else budget
+    state = _cache().get(STATE_KEY) or {'scores': {}, 'resident': []}
+    if loom_id not in state['resident']:
+        return False
+    files = sidecar_files(loom_path)
+    if sum(size for _,size in files) > budget:
+        return False
+    load_files([path for path,_ in files])
+    return True
+
+def update_residency(looms, budget=None, decay=None):
+    '''
+    Coordinator run: rank looms by recent requests and load or evict their sidecars
+
+    Scores decay at every run, so looms that stop being requested leave the
+    resident set. Newly resident looms are read in full, already resident
+    ones only get a readahead hint in case the kernel reclaimed some pages.
+
+    Params
+    ------
+    looms : iterable
+        (loom id, loom path) of the ingested looms
+    budget : int or None
+        Bytes, LOOM_RESIDENT_BYTES by default
+    decay : float or None
+        LOOM_RESIDENCY_DECAY by default
+
+    Return
+    ------
+    dict with the resident and evicted loom ids and the resident bytes
+    '''
+    budget = _setting('LOOM_RESIDENT_BYTES', DEFAULT_RESIDENT_BYTES) if budget is None else budget
+    decay = _setting('LOOM_RESIDENCY_DECAY', DEFAULT_DECAY) if decay is None else decay
+    cache = _cache()
+    state = cache.get(STATE_KEY) or {'scores': {}, 'resident': []}
+    scores, files = dict(), dict()
+    for loom_id,loom_path in looms:
+        scores[loom_id] = state['scores'].get(loom_id, 0) * decay + _take_accesses(cache, loom_id)
+        files[loom_id] = sidecar_files(loom_path)
+    sizes = {loom_id: sum(size for _,size in f) for loom_id,f in files.items()}
+    resident = plan_residency(scores, sizes, budget)
+    previous = set(state['resident'])
+
+    for loom_id in resident:
+        load_files([path for path,_ in files[loom_id]], read=loom_id not in previous)
+    evicted = (previous - resident) & set(files)
+    for loom_id in evicted:
+        evict_files([path for path,_ in files[loom_id]])
+
+    cache.set(STATE_KEY, {'scores': {i: s for i,s in scores.items() if s > 0.01}, 'resident': sorted(resident)}, timeout=None)
+    return {'resident': sorted(resident), 'evicted': sorted(evicted), 'bytes': sum(sizes[i] for i in resident)}
@@ -0,0 +1,182 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from scilicium_django_react.utils.loom_pool import file_version
+
+VERSION_FILE = 'version.json'
+
+def sidecar_root():
+    root = getattr(settings, 'LOOM_SIDECAR_ROOT', None)
+    if root is None: # next to the media folder, not in it: sidecars are not public files
+        root = os.path.join(os.path.dirname(os.path.abspath(settings.MEDIA_ROOT)), 'loom_sidecars')
+    return root
+
+def sidecar_dir(loom_path):
+    '''
+    Directory holding the precomputed structures of a loom file
+
+    Sidecars live outside of the loom upload folder so they are never
+    shipped with dataset archives.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+
+    Return
+    ------
+    str
+    '''
+    path = os.path.abspath(loom_path)
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(sidecar_root(), digest + '_' + os.path.basename(path))
+
+def _read_version(directory):
+    try:
+        with open(os.path.join(directory, VERSION_FILE)) as f:
+            return tuple(json.load(f)['version'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def valid_sidecar_dir(loom_path):
+    '''
+    Sidecar directory of a loom file if it matches the current file version, else None
+    '''
+    directory = sidecar_dir(loom_path)
+    if _read_version(directory) == file_version(loom_path):
+        return directory
+    return None
+
+@contextmanager
+def _sidecar_lock(directory):
+    '''
+    Exclusive lock on a sidecar directory, across worker processes
+    '''
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    with open(directory + '.lock', 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _swap_out(directory):
+    '''
+    Move a sidecar directory aside and delete it, readers still mapping its files keep them
+    '''
+    if not os.path.exists(directory):
+        return
+    trash = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix='.old')
+    os.rename(directory, os.path.join(trash, 'sidecar'))
+    shutil.rmtree(trash, ignore_errors=True)
+
+def ensure_sidecar_dir(loom_path):
+    '''
+    Sidecar directory of a loom file, replaced by an empty one first if it belongs to an older version of the file
+
+    The new directory is prepared under a temporary name and renamed into
+    place under a lock: other processes see the old directory or the new
+    one, never a half deleted one, and only one of them replaces it.
+    '''
+    directory = sidecar_dir(loom_path)
+    version = file_version(loom_path)
+    if _read_version(directory) == version:
+        return directory
+    with _sidecar_lock(directory):
+        if _read_version(directory) != version: # not replaced by another process meanwhile
+            fresh = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix='.tmp')
+            try:
+                _atomic_write(os.path.join(fresh, VERSION_FILE), json.dumps({'version': list(version)}).encode('utf-8'))
+                _swap_out(directory)
+                os.rename(fresh, directory)
+            except BaseException:
+                shutil.rmtree(fresh, ignore_errors=True)
+                raise
+    return directory
+
+def remove_sidecar(loom_path):
+    directory = sidecar_dir(loom_path)
+    with _sidecar_lock(directory):
+        _swap_out(directory)
+
+def _atomic_write(path, content):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def save_json(loom_path, name, obj):
+    '''
+    Store a JSON document in the sidecar of a loom file
+    '''
+    directory = ensure_sidecar_dir(loom_path)
+    _atomic_write(os.path.join(directory, name + '.json'), json.dumps(obj).encode('utf-8'))
+
+def load_json(loom_path, name):
+    '''
+    Load a JSON document from the sidecar of a loom file, None if missing or outdated
+    '''
+    directory = valid_sidecar_dir(loom_path)
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, name + '.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_array(loom_path, name, arr):
+    '''
+    Store a numpy array as .npy in the sidecar of a loom file
+    '''
+    directory = ensure_sidecar_dir(loom_path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp', suffix='.npy')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(arr), allow_pickle=False)
+        os.replace(tmp, os.path.join(directory, name + '.npy'))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def load_array(loom_path, name, mmap=True):
+    '''
+    Load a .npy array from the sidecar of a loom file, None if missing or outdated
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    name : str
+        Array name
+    mmap : bool
+        Memory-map the file read-only instead of reading it
+
+    Return
+    ------
+    numpy array or None
+    '''
+    directory = valid_sidecar_dir(loom_path)
+    if directory is None:
+        return None
+    path = os.path.join(directory, name + '.npy')
+    if not os.path.exists(path):
+        return None
+    try:
+        return np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    except ValueError: # empty arrays can not be memory-mapped
+        return np.load(path, allow_pickle=False)
@@ -0,0 +1,152 @@
+import os
+import hashlib
+
+import numpy as np
+
+from scilicium_django_react.utils.loom_pool import file_version, loom_connection
+from scilicium_django_react.utils.loom_cache import ByteBudgetLRU, cached_attribute
+from scilicium_django_react.utils.loom_sidecar import save_array, save_json, load_array, load_json
+from scilicium_django_react.utils.tracing import traced
+
+SUMMARY_CHUNK_BYTES = 256 * 1024 * 1024 # memory of the gene blocks read at once when building summaries
+SUMMARY_ENTRY_BYTES = 40 # arrays built per non-zero value of a block (gene, cell, value, group index)
+STATISTICS = ['mean','logmean','frac']
+
+_summaries = ByteBudgetLRU(1024)
+
+@traced('aggregate')
+def group_reduce(values,codes,ngroups):
+    '''
+    Per-group statistics of expression values, computed with np.bincount
+
+    Params
+    ------
+    values : 2D array
+        Expression values, genes x cells
+    codes : array
+        Group code of each cell
+    ngroups : int
+        Number of groups
+
+    Return
+    ------
+    counts (cells per group), sums and non-zero counts (genes x groups)
+    '''
+    values = np.atleast_2d(values)
+    counts = np.bincount(codes, minlength=ngroups)
+    sums = np.empty((values.shape[0], ngroups))
+    nonzeros = np.empty((values.shape[0], ngroups))
+    for g,row in enumerate(values): # one pass per gene keeps memory at one row of weights
+        sums[g] = np.bincount(codes, weights=row, minlength=ngroups)
+        nonzeros[g] = np.bincount(codes, weights=row != 0, minlength=ngroups)
+    return counts, sums, nonzeros
+
+class GroupSummary:
+    '''
+    Precomputed per-(gene, group) statistics of a column attribute
+
+    mean is the average expression, logmean the average of log(x+1) and frac
+    the fraction of cells with a non-zero expression; all are genes x groups.
+    '''
+    def __init__(self, categories, arrays):
+        self.categories = np.asarray(categories, dtype=object)
+        for name in STATISTICS:
+            setattr(self, name, arrays[name])
+
+def _summary_name(attribute):
+    return 'summary_' + hashlib.sha1(attribute.encode('utf-8')).hexdigest()[:12]
+
+def _sparse_reduce(rows,groups,vals,nrows,ngroups):
+    '''
+    Per-(gene, group) sums and non-zero counts of the non-zero values of a block
+    '''
+    flat = rows * ngroups + groups
+    sums = np.bincount(flat, weights=vals, minlength=nrows*ngroups).reshape(nrows, ngroups)
+    nonzeros = np.bincount(flat, minlength=nrows*ngroups).reshape(nrows, ngroups)
+    return sums, nonzeros
+
+def build_group_summaries(loom_path,attributes,budget=SUMMARY_CHUNK_BYTES):
+    '''
+    Compute per-group expression statistics of column attributes and store them in the loom sidecar
+
+    The matrix is read once, by chunks of genes, for all attributes. Chunks
+    are sized from the number of cells so a block, with its non-zero values,
+    stays within the budget. Zeros add nothing to the sums (log(0+1) == 0),
+    so statistics are reduced from the non-zero values only.
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    attributes : list
+        Column attributes (classes) to summarize
+    budget : int
+        Bytes of the blocks read at once
+    '''
+    groups = dict()
+    for attribute in attributes:
+        codes, categories = cached_attribute(loom_path,'ca',attribute).factorize()
+        groups[attribute] = (codes, categories)
+    if len(groups) == 0:
+        return
+    with loom_connection(loom_path) as df:
+        ngenes, ncells = df.shape
+        itemsize = df.layers[''].dtype.itemsize
+        chunk_rows = max(1, budget // (ncells * (itemsize + 1 + SUMMARY_ENTRY_BYTES))) # a dense block at worst
+        results = {a: {name: np.empty((ngenes, len(c)), dtype=np.float32) for name in STATISTICS} for a,(_,c) in groups.items()}
+        for start in range(0, ngenes, chunk_rows):
+            block = df[start:start+chunk_rows, :]
+            stop = start + len(block)
+            rows, cols = np.nonzero(block)
+            vals = block[rows, cols].astype(np.float64)
+            logvals = np.log1p(vals)
+            del block
+            for attribute,(codes,categories) in groups.items():
+                counts = np.bincount(codes, minlength=len(categories))
+                cell_groups = codes[cols]
+                sums, nonzeros = _sparse_reduce(rows, cell_groups, vals, stop-start, len(categories))
+                logsums, _ = _sparse_reduce(rows, cell_groups, logvals, stop-start, len(categories))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    results[attribute]['mean'][start:stop] = sums / counts
+                    results[attribute]['logmean'][start:stop] = logsums / counts
+                    results[attribute]['frac'][start:stop] = nonzeros / counts
+    for attribute,(_,categories) in groups.items():
+        name = _summary_name(attribute)
+        for stat in STATISTICS:
+            save_array(loom_path, name + '_' + stat, results[attribute][stat])
+        save_json(loom_path, name, {'attribute': attribute, 'categories': [str(c) for c in categories]}) # written last, marks the summary as complete
+    invalidate_group_summaries(loom_path)
+
+def get_group_summary(loom_path,attribute):
+    '''
+    Precomputed per-group statistics of a column attribute
+
+    Params
+    ------
+    loom_path : str
+        Path to a .loom file
+    attribute : str
+        Column attribute
+
+    Return
+    ------
+    GroupSummary or None if it was not built for the current file version
+    '''
+    path = os.path.abspath(loom_path)
+    key = (path, file_version(path), attribute)
+    summary = _summaries.get(key)
+    if summary is None:
+        summary = None
+        name = _summary_name(attribute)
+        d = load_json(path, name)
+        if d is not None and d['attribute'] == attribute:
+            arrays = {stat: load_array(path, name + '_' + stat) for stat in STATISTICS}
+            if all(arr is not None for arr in arrays.values()):
+                summary = GroupSummary(d['categories'], arrays)
+        if summary is not None: # missing ones are looked up again, the ingest task may still be running
+            _summaries.set(key, summary, 1)
+    return summary
+
+def invalidate_group_summaries(loom_path):
+    path = os.path.abspath(loom_path)
+    _summaries.discard(lambda k: k[0] == path)
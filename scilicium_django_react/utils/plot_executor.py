@@ -0,0 +1,227 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+
+from django.conf import settings
+
+from scilicium_django_react.utils.tracing import current_trace, bind_trace, span
+
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+DEFAULT_DATASET_CONCURRENCY = 2
+DEFAULT_QUEUE_TIMEOUT = 10 # seconds waiting for a slot on a busy dataset
+DEFAULT_TIMEOUT = 120 # seconds before a plot job is abandoned
+
+class DatasetBusy(Exception):
+    '''
+    Too many plot jobs already running on the dataset
+    '''
+
+class JobTimeout(Exception):
+    '''
+    Plot job did not finish in time, it has been asked to stop
+    '''
+
+class JobCancelled(Exception):
+    '''
+    Raised inside a plot job by check_cancelled once its request gave up on it
+    '''
+
+_current = threading.local()
+
+def check_cancelled():
+    '''
+    Stop the current plot job if its request gave up on it
+
+    Long loops call this between chunks; outside of a plot job it does nothing.
+    '''
+    event = getattr(_current, 'cancelled', None)
+    if event is not None and event.is_set():
+        raise JobCancelled()
+
+def _run(event, trace, fn, args, kwargs):
+    _current.cancelled = event
+    try:
+        check_cancelled() # abandoned while queued
+        with bind_trace(trace): # spans of the job go to the request that waits for it
+            return fn(*args, **kwargs)
+    finally:
+        _current.cancelled = None
+
+class PlotExecutor:
+    '''
+    Bounded pool running loom reads and figure building off the request threads
+
+    At most `workers` jobs run at once in the process and at most
+    `dataset_concurrency` on the same dataset, so one large dataset cannot
+    take every worker. A request waits queue_timeout seconds for a slot
+    (DatasetBusy) and timeout seconds for its result (JobTimeout); an
+    abandoned job is cancelled if still queued, or stopped at its next
+    check_cancelled call. A dataset slot is only given back once its job
+    really finished.
+    '''
+    def __init__(self, workers=None, dataset_concurrency=None, queue_timeout=None, timeout=None):
+        self._workers = workers
+        self._dataset_concurrency = dataset_concurrency
+        self._queue_timeout = queue_timeout
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._pool = None
+        self._semaphores = dict() # dataset key -> BoundedSemaphore
+        self._pid = os.getpid()
+
+    def _setting(self, value, name, default):
+        if value is None:
+            return getattr(settings, name, default)
+        return value
+
+    @property
+    def workers(self):
+        return self._setting(self._workers, 'PLOT_EXECUTOR_WORKERS', DEFAULT_WORKERS)
+
+    @property
+    def dataset_concurrency(self):
+        return self._setting(self._dataset_concurrency, 'PLOT_DATASET_CONCURRENCY', DEFAULT_DATASET_CONCURRENCY)
+
+    @property
+    def queue_timeout(self):
+        return self._setting(self._queue_timeout, 'PLOT_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT)
+
+    @property
+    def timeout(self):
+        return self._setting(self._timeout, 'PLOT_TIMEOUT', DEFAULT_TIMEOUT)
+
+    def _check_fork(self):
+        # threads of the parent do not exist in a forked worker
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._pool = None
+            self._semaphores = dict()
+            self._pid = os.getpid()
+
+    def _executor(self):
+        with self._lock:
+            self._check_fork()
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='plot')
+            return self._pool
+
+    def _semaphore(self, dataset_key):
+        with self._lock:
+            self._check_fork()
+            semaphore = self._semaphores.get(dataset_key)
+            if semaphore is None:
+                semaphore = self._semaphores[dataset_key] = threading.BoundedSemaphore(self.dataset_concurrency)
+            return semaphore
+
+    def run(self, dataset_key, fn, *args, **kwargs):
+        '''
+        Run fn(*args, **kwargs) in the pool and wait for its result
+
+        Params
+        ------
+        dataset_key : hashable
+            Dataset the job reads, concurrency is limited per key
+        fn : callable
+            Job
+
+        Return
+        ------
+        Result of fn, exceptions raised by fn are raised again
+        '''
+        executor = self._executor()
+        semaphore = self._semaphore(dataset_key)
+        with span('queue'):
+            acquired = semaphore.acquire(timeout=self.queue_timeout)
+        if not acquired:
+            raise DatasetBusy(f'Too many requests on dataset {dataset_key}')
+        event = threading.Event()
+        try:
+            future = executor.submit(_run, event, current_trace(), fn, args, kwargs)
+        except Exception:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda f: semaphore.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            event.set()
+            future.cancel()
+            raise JobTimeout(f'Plot job on dataset {dataset_key} took more than {self.timeout}s')
+
+    def imap_unordered(self, dataset_key, calls):
+        '''
+        Run several jobs on a dataset in the pool, yielding them as they finish
+
+        At most dataset_concurrency of them run at once; the others start as
+        slots free up. Each job gets timeout seconds from its start. Jobs
+        still running when the generator is closed (client gone) are
+        cancelled.
+
+        Params
+        ------
+        dataset_key : hashable
+            Dataset the jobs read
+        calls : list
+            (fn, args) of each job
+
+        Return
+        ------
+        Generator of (index in calls, result, exception or None)
+        '''
+        executor = self._executor()
+        semaphore = self._semaphore(dataset_key)
+        trace = current_trace()
+        queue = list(enumerate(calls))
+        pending = dict() # future -> (index, cancel event, deadline)
+        try:
+            while queue or pending:
+                while queue:
+                    if pending: # take free slots only, running jobs will free more
+                        acquired = semaphore.acquire(blocking=False)
+                    else:
+                        with span('queue'):
+                            acquired = semaphore.acquire(timeout=self.queue_timeout)
+                        if not acquired:
+                            for i,_ in queue:
+                                yield i, None, DatasetBusy(f'Too many requests on dataset {dataset_key}')
+                            queue = []
+                    if not acquired:
+                        break
+                    i,(fn,args) = queue.pop(0)
+                    event = threading.Event()
+                    try:
+                        future = executor.submit(_run, event, trace, fn, args, {})
+                    except Exception:
+                        semaphore.release()
+                        raise
+                    future.add_done_callback(lambda f: semaphore.release())
+                    pending[future] = (i, event, time.monotonic() + self.timeout)
+                if not pending:
+                    continue
+                timeout = max(min(d for _,_,d in pending.values()) - time.monotonic(), 0)
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i,_,_ = pending.pop(future)
+                    try:
+                        yield i, future.result(), None
+                    except Exception as e:
+                        yield i, None, e
+                now = time.monotonic()
+                for future in [f for f,(_,_,d) in pending.items() if d <= now and f not in done]:
+                    i,event,_ = pending.pop(future)
+                    event.set()
+                    future.cancel()
+                    yield i, None, JobTimeout(f'Plot job on dataset {dataset_key} took more than {self.timeout}s')
+        finally:
+            for future,(_,event,_) in pending.items():
+                event.set()
+                future.cancel()
+
+plot_executor = PlotExecutor()
+
+def run_plot_job(dataset_key, fn, *args, **kwargs):
+    return plot_executor.run(dataset_key, fn, *args, **kwargs)
+
+def run_plot_jobs(dataset_key, calls):
+    return plot_executor.imap_unordered(dataset_key, calls)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from scilicium_django_react.utils.density import DensityGrid
+
+
+@pytest.fixture
+def points():
+    rng = np.random.RandomState(0)
+    return rng.normal(size=300), rng.normal(size=300), rng.exponential(size=300)
+
+
+def test_histograms_sum_to_cells_and_expression(points):
+    x, y, expression = points
+    grid = DensityGrid(x, y, size=50)
+
+    assert grid.histogram().sum() == len(x)
+    assert grid.histogram(weights=expression).sum() == pytest.approx(expression.sum())
+    assert grid.histogram(idx=np.arange(10)).sum() == 10
+
+
+def test_smoothing_keeps_the_mass(points):
+    x, y, expression = points
+    grid = DensityGrid(x, y, size=50, padding=1.0) # wide margin, no mass smoothed past the edges
+
+    assert grid.density().sum() == pytest.approx(len(x), rel=1e-3)
+    assert grid.density(weights=expression).sum() == pytest.approx(expression.sum(), rel=1e-3)
+
+
+def test_smoothing_does_not_wrap_around(points):
+    x, y, _ = points
+    grid = DensityGrid(x, y, size=60)
+    grid.sigma = (3.0, 3.0)
+    hist = np.zeros((60, 60))
+    hist[0, 0] = 1 # unit mass in the bottom left corner
+
+    smoothed = grid.smooth(hist)
+
+    peak = smoothed[0, 0]
+    assert smoothed[0, 3] == pytest.approx(peak * np.exp(-0.5), rel=1e-2) # one standard deviation away
+    assert smoothed[0, -1] < 1e-2 * peak # right edge, next to the corner on a circular grid
+    assert smoothed[-1, 0] < 1e-2 * peak # top edge
+
+
+def test_group_densities_match_single_densities(points):
+    x, y, _ = points
+    grid = DensityGrid(x, y, size=40)
+    codes = np.arange(len(x)) % 3
+
+    densities = grid.group_densities(codes, 3)
+
+    assert densities.shape == (3, 40, 40)
+    for g in range(3):
+        np.testing.assert_allclose(densities[g], grid.density(idx=np.flatnonzero(codes == g)), atol=1e-5)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from matplotlib.figure import Figure
+
+from scilicium_django_react.utils.hexbin import hexbin
+
+
+@pytest.fixture
+def points():
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=500)
+    y = rng.normal(scale=2, size=500)
+    values = rng.exponential(size=500)
+    return x, y, values
+
+
+def _by_center(offsets, array):
+    '''
+    Bins sorted by center, so the two implementations can be compared whatever their order
+    '''
+    offsets = np.asarray(offsets)
+    order = np.lexsort((offsets[:, 1], offsets[:, 0]))
+    return offsets[order], np.asarray(array)[order]
+
+
+def _matplotlib_hexbin(x, y, **kwargs):
+    collection = Figure().subplots().hexbin(x, y, **kwargs)
+    return _by_center(collection.get_offsets(), collection.get_array())
+
+
+@pytest.mark.parametrize('gridsize', [3, 5, 20, 33])
+def test_counts_match_matplotlib(points, gridsize):
+    x, y, _ = points
+    offsets, counts = _matplotlib_hexbin(x, y, gridsize=gridsize, mincnt=1)
+
+    bins = hexbin(x, y, gridsize=gridsize, agg='count')
+    centers, ours = _by_center(bins.centers, bins.counts)
+
+    np.testing.assert_allclose(centers, offsets)
+    np.testing.assert_array_equal(ours, counts)
+    assert bins.counts.sum() == len(x)
+    assert bins.values is None
+
+
+@pytest.mark.parametrize('agg, reduce', [('mean', np.mean), ('sum', np.sum)])
+@pytest.mark.parametrize('gridsize', [5, 20])
+def test_aggregates_match_matplotlib(points, gridsize, agg, reduce):
+    x, y, values = points
+    offsets, expected = _matplotlib_hexbin(x, y, C=values, reduce_C_function=reduce, gridsize=gridsize)
+
+    bins = hexbin(x, y, gridsize=gridsize, values=values, agg=agg)
+    centers, ours = _by_center(bins.centers, bins.values)
+
+    np.testing.assert_allclose(centers, offsets)
+    np.testing.assert_allclose(ours, expected)
+
+
+def test_single_point_and_empty_cloud():
+    bins = hexbin([1.], [2.], gridsize=10)
+    assert bins.counts.tolist() == [1]
+    assert len(hexbin([], [], gridsize=10)) == 0
+
+
+def test_unknown_aggregate(points):
+    x, y, values = points
+    with pytest.raises(Exception):
+        hexbin(x, y, values=values, agg='median')
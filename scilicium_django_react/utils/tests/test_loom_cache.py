@@ -0,0 +1,74 @@
+import os
+
+import loompy
+import numpy as np
+import pytest
+
+from scilicium_django_react.utils.loom_cache import CachedAttribute, build_attribute_sidecar, load_attribute_sidecar
+from scilicium_django_react.utils.loom_index import AttributeBitmaps
+
+
+@pytest.fixture
+def loom_path(settings, tmpdir):
+    settings.LOOM_SIDECAR_ROOT = os.path.join(tmpdir.strpath, 'sidecars')
+    path = os.path.join(tmpdir.strpath, 'test.loom')
+    ncells = 6
+    loompy.create(path, np.arange(3 * ncells, dtype=np.float32).reshape(3, ncells),
+        row_attrs={'Symbol': np.array(['Actb', 'Gapdh', 'Sox9'], dtype=object)},
+        col_attrs={
+            'CellID': np.array(['cell%d' % i for i in range(ncells)], dtype=object),
+            'cluster': np.array(['b', 'a', 'b', 'c', 'a', 'b'], dtype=object),
+            'nUMI': np.arange(ncells, dtype=np.float64),
+        })
+    return path
+
+
+def decoded(loom_path, axis, key):
+    with loompy.connect(loom_path, 'r') as df:
+        return CachedAttribute((df.ca if axis == 'ca' else df.ra)[key])
+
+
+@pytest.mark.parametrize('axis,key', [('ca', 'cluster'), ('ca', 'CellID'), ('ca', 'nUMI'), ('ra', 'Symbol')])
+def test_attribute_sidecar_round_trip(loom_path, axis, key):
+    expected = decoded(loom_path, axis, key)
+    assert build_attribute_sidecar(loom_path, axis, key) > 0
+
+    mapped = load_attribute_sidecar(loom_path, axis, key)
+
+    assert mapped is not None
+    assert mapped.is_categorical == expected.is_categorical
+    assert mapped.values().tolist() == expected.values().tolist()
+    assert mapped.unique().tolist() == expected.unique().tolist()
+    idx = np.array([0, 2, 5])
+    assert mapped.values(idx).tolist() == expected.values(idx).tolist()
+    assert mapped.unique(idx).tolist() == expected.unique(idx).tolist()
+
+
+def test_attribute_sidecar_is_read_only(loom_path):
+    build_attribute_sidecar(loom_path, 'ca', 'cluster')
+    mapped = load_attribute_sidecar(loom_path, 'ca', 'cluster')
+    with pytest.raises(ValueError):
+        mapped.codes[0] = 1
+
+
+def test_missing_attribute_sidecar(loom_path):
+    assert load_attribute_sidecar(loom_path, 'ca', 'cluster') is None
+
+
+def test_mapped_attribute_costs_no_heap(loom_path):
+    build_attribute_sidecar(loom_path, 'ca', 'cluster')
+    mapped = load_attribute_sidecar(loom_path, 'ca', 'cluster')
+
+    assert mapped.nbytes == 0 # codes and categories pages are shared by every process
+    codes, categories = mapped.factorize()
+    assert categories[codes].tolist() == ['b', 'a', 'b', 'c', 'a', 'b']
+
+
+def test_attribute_bitmaps_charge_their_masks(tmpdir):
+    bitmaps = np.zeros((3, 1000), dtype=np.uint8)
+    assert AttributeBitmaps(['a', 'b', 'c'], bitmaps, 8000).nbytes >= bitmaps.nbytes
+
+    path = os.path.join(tmpdir.strpath, 'bitmaps.npy')
+    np.save(path, bitmaps)
+    mapped = AttributeBitmaps(['a', 'b', 'c'], np.load(path, mmap_mode='r'), 8000)
+    assert mapped.nbytes < bitmaps.nbytes # pages of a memory map are not charged
@@ -0,0 +1,82 @@
+import os
+
+import loompy
+import numpy as np
+import pytest
+
+from scilicium_django_react.utils import loom_matrix
+from scilicium_django_react.utils.loom_matrix import _combine, _sidecar_cell_variances, _sidecar_variances, build_expression_sidecar, gene_variances
+
+RIDX = np.array([5, 0, 3])
+CIDX = np.array([9, 1, 4, 2, 7])
+
+
+@pytest.fixture
+def matrix():
+    return np.random.RandomState(0).poisson(0.7, size=(7, 11)).astype(np.float32)
+
+
+@pytest.fixture
+def loom_path(settings, tmpdir, matrix):
+    settings.LOOM_SIDECAR_ROOT = os.path.join(tmpdir.strpath, 'sidecars')
+    path = os.path.join(tmpdir.strpath, 'test.loom')
+    loompy.create(path, matrix,
+        row_attrs={'Symbol': np.array(['g%d' % i for i in range(matrix.shape[0])], dtype=object)},
+        col_attrs={'CellID': np.array(['cell%d' % i for i in range(matrix.shape[1])], dtype=object)})
+    return path
+
+
+def test_combine_matches_variance_of_both_parts():
+    a = np.array([1., 4., 2., 8.])
+    b = np.array([3., 3., 9.])
+    n, mean, m2 = _combine(len(a), a.mean(), ((a - a.mean())**2).sum(), len(b), b.mean(), ((b - b.mean())**2).sum())
+
+    assert n == 7
+    assert mean == pytest.approx(np.concatenate([a, b]).mean())
+    assert m2 / n == pytest.approx(np.var(np.concatenate([a, b])))
+
+
+def test_combine_with_empty_accumulator():
+    assert _combine(0, 0., 0., 3, 2., 6.) == (3, 2., 6.)
+
+
+@pytest.mark.parametrize('ridx, cidx', [(None, None), (RIDX, None), (None, CIDX), (RIDX, CIDX)])
+def test_loom_variances(loom_path, matrix, ridx, cidx):
+    expected = matrix[ridx if ridx is not None else slice(None)][:, cidx if cidx is not None else slice(None)]
+
+    # chunks of 3 genes and 4 cells do not divide the 7 x 11 matrix
+    v = gene_variances(loom_path, ridx_filter=ridx, cidx_filter=cidx, chunk_rows=3, chunk_cols=4)
+
+    np.testing.assert_allclose(v, np.var(expected.astype(np.float64), axis=1))
+
+
+@pytest.mark.parametrize('ridx, cidx', [(None, None), (RIDX, None), (None, CIDX), (RIDX, CIDX)])
+def test_sidecar_variances(loom_path, matrix, ridx, cidx):
+    expected = matrix[ridx if ridx is not None else slice(None)][:, cidx if cidx is not None else slice(None)]
+    build_expression_sidecar(loom_path)
+
+    v = gene_variances(loom_path, ridx_filter=ridx, cidx_filter=cidx, chunk_rows=3)
+
+    np.testing.assert_allclose(v, np.var(expected.astype(np.float64), axis=1))
+
+
+def test_sidecar_variances_by_gene_and_by_cell(loom_path, matrix, monkeypatch):
+    sidecar = build_expression_sidecar(loom_path)
+    rows, cells = np.sort(RIDX), np.sort(CIDX)
+    expected = np.var(matrix[rows][:, cells].astype(np.float64), axis=1)
+
+    np.testing.assert_allclose(_sidecar_variances(sidecar, rows, cells, chunk_rows=2), expected)
+    monkeypatch.setattr(loom_matrix, 'VARIANCE_CHUNK_NNZ', 3) # several chunks of cells
+    np.testing.assert_allclose(_sidecar_cell_variances(sidecar, rows, cells), expected)
+
+
+def test_sidecar_gathers_requested_entries(loom_path, matrix):
+    sidecar = build_expression_sidecar(loom_path, budget=1) # one gene per chunk
+
+    np.testing.assert_array_equal(sidecar.row(2), matrix[2])
+    np.testing.assert_array_equal(sidecar.row(2, CIDX), matrix[2, CIDX])
+    np.testing.assert_array_equal(sidecar.rows(RIDX, CIDX), matrix[RIDX][:, CIDX])
+    np.testing.assert_array_equal(sidecar.columns(CIDX), matrix[:, CIDX])
+    np.testing.assert_array_equal(sidecar.columns(CIDX, RIDX), matrix[RIDX][:, CIDX])
+    assert sidecar.nnz(ridx=RIDX) == np.count_nonzero(matrix[RIDX])
+    assert sidecar.nnz(cidx=CIDX) == np.count_nonzero(matrix[:, CIDX])
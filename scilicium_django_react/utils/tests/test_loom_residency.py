@@ -0,0 +1,80 @@
+import pytest
+from django.core.cache import cache
+
+from scilicium_django_react.utils import loom_residency
+from scilicium_django_react.utils.loom_residency import STATE_KEY, plan_residency, record_access, update_residency, warm_loom
+
+
+def test_plan_residency_keeps_most_requested_within_budget():
+    scores = {1: 10, 2: 5, 3: 1, 4: 0}
+    sizes = {1: 60, 2: 50, 3: 30, 4: 10}
+
+    # 2 does not fit next to 1, the less requested 3 does
+    assert plan_residency(scores, sizes, budget=100) == {1, 3}
+    assert plan_residency(scores, sizes, budget=200) == {1, 2, 3}
+    assert plan_residency(scores, sizes, budget=10) == set()
+
+
+def test_plan_residency_skips_looms_without_sidecar():
+    assert plan_residency({1: 10, 2: 5}, {2: 50}, budget=100) == {2}
+
+
+class TestUpdateResidency:
+    @pytest.fixture(autouse=True)
+    def files(self, monkeypatch):
+        cache.clear()
+        calls = {'load': [], 'evict': []}
+        sizes = {'a.loom': 60, 'b.loom': 50}
+        monkeypatch.setattr(loom_residency, 'sidecar_files', lambda path: [(path + '.npy', sizes[path])])
+        monkeypatch.setattr(loom_residency, 'load_files', lambda paths, read=True: calls['load'].append((paths, read)))
+        monkeypatch.setattr(loom_residency, 'evict_files', lambda paths: calls['evict'].append(paths))
+        return calls
+
+    def test_most_requested_loom_is_loaded(self, files):
+        for _ in range(3):
+            record_access(1)
+        record_access(2)
+
+        result = update_residency([(1, 'a.loom'), (2, 'b.loom')], budget=100, decay=0.5)
+
+        assert result == {'resident': [1], 'evicted': [], 'bytes': 60}
+        assert files['load'] == [(['a.loom.npy'], True)]
+        assert cache.get(STATE_KEY) == {'scores': {1: 3, 2: 1}, 'resident': [1]}
+
+    def test_resident_loom_is_only_hinted_then_evicted(self, files):
+        for _ in range(3):
+            record_access(1)
+        update_residency([(1, 'a.loom'), (2, 'b.loom')], budget=100, decay=0.5)
+        files['load'].clear()
+
+        # 1 decays to 1.5 while 2 gets 4 requests
+        for _ in range(4):
+            record_access(2)
+        result = update_residency([(1, 'a.loom'), (2, 'b.loom')], budget=100, decay=0.5)
+
+        assert result == {'resident': [2], 'evicted': [1], 'bytes': 50}
+        assert files['load'] == [(['b.loom.npy'], True)]
+        assert files['evict'] == [['a.loom.npy']]
+
+        result = update_residency([(1, 'a.loom'), (2, 'b.loom')], budget=100, decay=0.5)
+        assert result['resident'] == [2]
+        assert files['load'][-1] == (['b.loom.npy'], False) # already resident, readahead hint only
+
+    def test_accesses_are_consumed(self, files):
+        record_access(1)
+        update_residency([(1, 'a.loom')], budget=100, decay=0)
+        result = update_residency([(1, 'a.loom')], budget=100, decay=0)
+        assert result['resident'] == []
+
+    def test_only_resident_looms_are_warmed(self, files):
+        assert warm_loom(1, 'a.loom', budget=100) is False # never ranked
+
+        for _ in range(3):
+            record_access(1)
+        update_residency([(1, 'a.loom'), (2, 'b.loom')], budget=100, decay=0.5)
+        files['load'].clear()
+
+        assert warm_loom(1, 'a.loom', budget=100) is True
+        assert warm_loom(2, 'b.loom', budget=100) is False
+        assert warm_loom(1, 'a.loom', budget=50) is False # new sidecar no longer fits
+        assert files['load'] == [(['a.loom.npy'], True)]
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from scilicium_django_react.utils.plot_executor import PlotExecutor, DatasetBusy, JobTimeout, check_cancelled
+
+
+def make_executor(**kwargs):
+    options = dict(workers=4, dataset_concurrency=2, queue_timeout=0.2, timeout=5)
+    options.update(kwargs)
+    return PlotExecutor(**options)
+
+
+class Tracker:
+    '''
+    Jobs recording how many of them run at once
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def job(self, value, seconds=0.05):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(seconds)
+        with self.lock:
+            self.running -= 1
+        return value
+
+
+def test_imap_unordered_bounds_concurrency_per_dataset():
+    tracker = Tracker()
+    calls = [(tracker.job, (i,)) for i in range(6)]
+
+    results = list(make_executor().imap_unordered('loom', calls))
+
+    assert sorted(i for i,_,_ in results) == list(range(6))
+    assert all(result == i and error is None for i,result,error in results)
+    assert tracker.max_running == 2
+
+
+def test_imap_unordered_yields_in_completion_order():
+    def job(seconds):
+        time.sleep(seconds)
+        return seconds
+
+    results = list(make_executor().imap_unordered('loom', [(job, (0.3,)), (job, (0.01,))]))
+
+    assert [i for i,_,_ in results] == [1, 0]
+
+
+def test_imap_unordered_job_errors_are_yielded():
+    def fail():
+        raise ValueError('bad request')
+
+    results = list(make_executor().imap_unordered('loom', [(fail, ())]))
+
+    assert len(results) == 1
+    assert isinstance(results[0][2], ValueError)
+
+
+def test_imap_unordered_timeout():
+    stopped = threading.Event()
+
+    def slow():
+        try:
+            while True:
+                check_cancelled()
+                time.sleep(0.01)
+        finally:
+            stopped.set()
+
+    results = list(make_executor(timeout=0.2).imap_unordered('loom', [(slow, ()), (lambda: 'fast', ())]))
+
+    errors = {i: error for i,_,error in results}
+    assert isinstance(errors[0], JobTimeout)
+    assert errors[1] is None
+    assert stopped.wait(1) # the job was told to stop
+
+
+def test_imap_unordered_dataset_busy():
+    executor = make_executor(dataset_concurrency=1)
+    semaphore = executor._semaphore('loom')
+    semaphore.acquire() # slot taken by another request for the whole call
+    try:
+        results = list(executor.imap_unordered('loom', [(lambda: 1, ()), (lambda: 2, ())]))
+    finally:
+        semaphore.release()
+
+    assert sorted(i for i,_,_ in results) == [0, 1]
+    assert all(isinstance(error, DatasetBusy) for _,_,error in results)
+
+
+def test_imap_unordered_close_cancels_jobs():
+    started = threading.Event()
+    cancelled = threading.Event()
+
+    def endless():
+        started.set()
+        try:
+            while True:
+                check_cancelled()
+                time.sleep(0.01)
+        finally:
+            cancelled.set()
+
+    executor = make_executor(dataset_concurrency=1)
+    jobs = executor.imap_unordered('loom', [(lambda: 'first', ()), (endless, ()), (endless, ())])
+    assert next(jobs)[1] == 'first'
+    assert started.wait(1)
+
+    jobs.close() # client gone
+
+    assert cancelled.wait(1)
+    # the slot of the running job is given back once it stopped, the queued one never started
+    assert executor._semaphore('loom').acquire(timeout=1)
@@ -0,0 +1,186 @@
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import sentry_sdk
+except ImportError: # sentry is only installed in production
+    sentry_sdk = None
+
+logger = logging.getLogger(__name__)
+
+# stages reported in Server-Timing, in this order
+STAGES = ['queue', 'cache', 'filter', 'read', 'aggregate', 'figure', 'serialize']
+
+_current = threading.local()
+
+class RequestTrace:
+    '''
+    Time spent in each stage while serving one request
+
+    A stage is charged its own time only: when spans nest, the time of the
+    inner span is taken off the outer one, so stages add up to at most the
+    request duration. Spans may be opened from the plot executor threads
+    working for the request.
+    '''
+    def __init__(self, sentry_span=None):
+        self.start = time.perf_counter()
+        self.durations = dict() # stage -> seconds
+        self.counts = dict() # stage -> number of spans
+        self.sentry_span = sentry_span
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def stages(self):
+        order = {name: i for i,name in enumerate(STAGES)}
+        return sorted(self.durations, key=lambda s: (order.get(s, len(order)), s))
+
+    def server_timing(self):
+        '''
+        Server-Timing header value, durations in milliseconds
+        '''
+        metrics = ['%s;dur=%.1f' % (stage, 1000 * self.durations[stage]) for stage in self.stages()]
+        metrics.append('total;dur=%.1f' % (1000 * self.elapsed()))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {
+            'total_ms': round(1000 * self.elapsed(), 1),
+            'stages': {stage: {'ms': round(1000 * self.durations[stage], 1), 'count': self.counts[stage]} for stage in self.stages()},
+        }
+
+def current_trace():
+    return getattr(_current, 'trace', None)
+
+class bind_trace:
+    '''
+    Make a trace current in this thread, e.g. in a pool thread working for a request
+    '''
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = (getattr(_current, 'trace', None), getattr(_current, 'stack', None))
+        _current.trace = self.trace
+        _current.stack = []
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current.trace, _current.stack = self.previous
+
+class span:
+    '''
+    Charge the time of a block to a stage of the current request trace
+
+    Outside of a traced request it only costs a thread-local lookup. With
+    Sentry performance monitoring on, the block is also a child span of the
+    request transaction.
+
+    with span('read', 'expression rows'):
+        ...
+    '''
+    def __init__(self, stage, description=None):
+        self.stage = stage
+        self.description = description
+
+    def __enter__(self):
+        self.trace = current_trace()
+        if self.trace is None:
+            return self
+        self.sentry = None
+        if self.trace.sentry_span is not None:
+            self.sentry = self.trace.sentry_span.start_child(op=self.stage, description=self.description)
+            self.sentry.__enter__()
+        self.children = 0.0
+        _current.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is None:
+            return
+        seconds = time.perf_counter() - self.start
+        _current.stack.pop()
+        if _current.stack:
+            _current.stack[-1].children += seconds
+        self.trace.add(self.stage, max(seconds - self.children, 0.0))
+        if self.sentry is not None:
+            self.sentry.__exit__(*exc)
+
+def traced(stage):
+    '''
+    Decorator charging the calls of a function to a stage
+    '''
+    def decorator(fn):
+        description = fn.__qualname__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, description):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing_enabled():
+    return getattr(settings, 'SERVER_TIMING', False)
+
+def _sentry_span():
+    if sentry_sdk is None:
+        return None
+    return sentry_sdk.Hub.current.scope.span # request transaction, None if not sampled
+
+class ServerTimingMiddleware:
+    '''
+    Trace requests, report their stages in a Server-Timing header and in the logs
+
+    Requests slower than TRACING_LOG_THRESHOLD_MS (and with at least one
+    span) are logged as one JSON line on the scilicium_django_react.utils.tracing
+    logger.
+
+    Streaming responses do their work while their content is iterated, after
+    the headers are sent: the trace stays bound while each chunk is produced
+    and the request is logged once the content is exhausted. Their
+    Server-Timing header only covers the work done before streaming.
+    '''
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trace = RequestTrace(sentry_span=_sentry_span())
+        with bind_trace(trace):
+            response = self.get_response(request)
+        if server_timing_enabled():
+            response['Server-Timing'] = trace.server_timing()
+        if response.streaming:
+            response.streaming_content = self.stream(trace, request, response, response.streaming_content)
+        else:
+            self.log(trace, request, response)
+        return response
+
+    def stream(self, trace, request, response, content):
+        iterator = iter(content)
+        try:
+            while True:
+                with bind_trace(trace): # not across yields, the server thread may serve other code in between
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        return
+                yield chunk
+        finally:
+            self.log(trace, request, response)
+
+    def log(self, trace, request, response):
+        if trace.durations and 1000 * trace.elapsed() >= getattr(settings, 'TRACING_LOG_THRESHOLD_MS', 0):
+            record = dict(trace.as_dict(), method=request.method, path=request.path, status=response.status_code)
+            logger.info(json.dumps(record), extra={'trace': record})